@@ -1,23 +1,29 @@
+import asyncio
 import datetime
 import inspect
 import logging
 import os
 import sys
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from functools import partial
 
 import click
 import pandas as pd
 import pytz
-from yfinance import Ticker
-from yfinance.utils import auto_adjust
+from yfinance import Ticker, download
+from yfinance.exceptions import YFPricesMissingError, YFTickerMissingError, YFTzMissingError
 
-from modules.df_utils import df_to_csv, save_results
+from modules.batch_writer import BatchWriter
+from modules import df_utils
+from modules.df_utils import check_upsert_method, df_to_csv, save_batch, save_results
 from modules.disk_utils import check_disk_full
 from modules.dolt_api import fetch_rows
 from modules.log import get_logger
+from modules.quote_utils import normalize_quotes
 from modules.threaded import execute_parallel
+from modules.yahoo_chart import fetch_charts
 
 if not hasattr(sys.modules[__name__], '__file__'):
     __file__ = inspect.getfile(inspect.currentframe())
@@ -38,13 +44,26 @@ quote_table_name = 'yfinance_quote'
 @click.option('-p', '--parallel-threads', type=int, default=10, help='Number of parallel threads')
 @click.option('-n', '--include-new', default=False, is_flag=True, help='Also look for symbols without any quote')
 @click.option('--clean', default=False, is_flag=True, help='Deletes intermediary files directly after load (only works together with --dolt-load)')
-def cli(time, database, inactive, output_dir, parallel_threads, include_new, clean):
+@click.option('-b', '--batch-size', type=int, default=1, help='Symbols sharing a start date fetched by one request of the threads engine, 1 fetches every symbol on its own')
+@click.option('-r', '--batch-rows', type=int, default=0, help='Rows written by a single transaction of one writer, 0 saves every symbol on its own with a csv file in the output dir, batches write no csv files')
+@click.option('-w', '--batch-seconds', type=int, default=30, help='Maximum seconds the writer collects rows for a transaction')
+@click.option('-u', '--upsert', type=click.Choice(df_utils.upsert_methods), default='replace', help='Statements writing into a database server')
+@click.option('--upsert-chunk-size', type=int, default=5000, help='Rows sent by a single upsert statement')
+@click.option('-e', '--engine', type=click.Choice(['threads', 'async']), default='threads', help='Download with yfinance in threads or async from the chart api')
+@click.option('-c', '--concurrency', type=int, default=200, help='Maximum requests in flight of the async engine')
+def cli(time, database, inactive, output_dir, parallel_threads, include_new, clean, batch_size, batch_rows, batch_seconds, upsert, upsert_chunk_size, engine, concurrency):
     max_runtime = datetime.datetime.now() + timedelta(minutes=time) if time is not None else None
     log.info(f"jobs ends at: {max_runtime}")
 
     if database == "" or database == "None":
         database = None
 
+    # a method the database does not support would fail every transaction and only leave csv dumps
+    try:
+        check_upsert_method(database, upsert)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--upsert")
+
     log.info(f"select symbols where inactive = {inactive}")
     last_state = _select_last_state(database, include_new)
 
@@ -56,26 +75,144 @@ def cli(time, database, inactive, output_dir, parallel_threads, include_new, cle
     def early_exit():
         return (max_runtime is not None and datetime.datetime.now() >= max_runtime) or check_disk_full()
 
-    download_parallel(database, last_state, max_runtime, output_dir, True, clean, parallel_threads, early_exit)
+    if engine == 'async':
+        download_async(
+            database, last_state, output_dir, True, clean, parallel_threads, concurrency, early_exit, batch_rows, batch_seconds, upsert,
+            upsert_chunk_size
+        )
+    else:
+        download_parallel(
+            database, last_state, max_runtime, output_dir, True, clean, parallel_threads, early_exit, batch_size, batch_rows, batch_seconds,
+            upsert, upsert_chunk_size
+        )
+
+
+def download_parallel(
+        repo_database, last_state, max_runtime, output_dir, dolt_load=False, clean=False, num_threads=4, early_exit=None, batch_size=1,
+        batch_rows=0, batch_seconds=30, upsert="replace", upsert_chunk_size=5000
+):
+    writer = _batch_writer(repo_database, output_dir, dolt_load, clean, num_threads, batch_rows, batch_seconds, upsert, upsert_chunk_size)
+    try:
+        if batch_size > 1:
+            execute_parallel(
+                partial(
+                    _fetch_batch,
+                    database=repo_database,
+                    dolt_load=dolt_load,
+                    path=output_dir,
+                    early_exit=early_exit,
+                    clean=clean,
+                    writer=writer,
+                    upsert=upsert,
+                    upsert_chunk_size=upsert_chunk_size,
+                ),
+                _batches(last_state, batch_size),
+                "batch",
+                num_threads,
+                early_exit=early_exit
+            )
+        else:
+            execute_parallel(
+                partial(
+                    _fetch_data,
+                    database=repo_database,
+                    dolt_load=dolt_load,
+                    path=output_dir,
+                    early_exit=early_exit,
+                    clean=clean,
+                    writer=writer,
+                    upsert=upsert,
+                    upsert_chunk_size=upsert_chunk_size,
+                ),
+                last_state.iterrows(),
+                "last_state",
+                num_threads,
+                early_exit=early_exit
+            )
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print("done!")
+
+
+def download_async(
+        repo_database, last_state, output_dir, dolt_load=False, clean=False, num_threads=4, concurrency=200, early_exit=None,
+        batch_rows=0, batch_seconds=30, upsert="replace", upsert_chunk_size=5000
+):
+    writer = _batch_writer(repo_database, output_dir, dolt_load, clean, num_threads, batch_rows, batch_seconds, upsert, upsert_chunk_size)
+    try:
+        asyncio.run(_download_async(
+            repo_database, last_state, output_dir, dolt_load, clean, num_threads, concurrency, early_exit, writer, upsert, upsert_chunk_size
+        ))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print("done!")
+
 
+def _batch_writer(database, path, dolt_load, clean, num_threads, batch_rows, batch_seconds, upsert="replace", upsert_chunk_size=5000):
+    # the fetchers hand their rows to a single writer which loads them in large transactions
+    if not dolt_load or not batch_rows:
+        return None
 
-def download_parallel(repo_database, last_state, max_runtime, output_dir, dolt_load=False, clean=False, num_threads=4, early_exit=None):
-    execute_parallel(
+    return BatchWriter(
         partial(
-            _fetch_data,
-            database=repo_database,
-            dolt_load=dolt_load,
-            path=output_dir,
-            early_exit=early_exit,
-            clean=clean,
+            save_batch,
+            database,
+            index_columns={quote_table_name: ["symbol", "epoch"], quote_meta_table_name: "symbol"},
+            path=path,
+            clear_afterwards=clean,
+            method=upsert,
+            chunk_size=upsert_chunk_size
         ),
-        last_state.iterrows(),
-        "last_state",
-        num_threads,
-        early_exit=early_exit
+        batch_rows,
+        batch_seconds,
+        num_threads * 4
     )
 
-    print("done!")
+
+async def _download_async(
+        database, last_state, path, dolt_load, clean, num_threads, concurrency, early_exit, writer=None, upsert="replace", upsert_chunk_size=5000
+):
+    states = {state["symbol"]: _parse_state(state) for _, state in last_state.iterrows()}
+    requests = ((symbol, _start_date(state[3])) for symbol, state in states.items())
+    loop = asyncio.get_running_loop()
+
+    # the downloads share one connection pool, saving the results blocks and runs in threads
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        saving = set()
+        charts = fetch_charts(requests, concurrency)
+        try:
+            async for symbol, df in charts:
+                if early_exit is not None and early_exit():
+                    log.warning(f"max time reached or disk almost full, exit before saving {symbol}")
+                    break
+
+                if df is None:
+                    # a failed download is no sign of a delisting, the symbol is fetched again by the next run
+                    log.warning(f"{symbol}: download failed, skip it")
+                    continue
+
+                _, tz_info, first_price_date, _, delisted = states[symbol]
+                saving.add(loop.run_in_executor(
+                    executor,
+                    partial(
+                        _store_data, database, symbol, df, tz_info, first_price_date, delisted, path, dolt_load, clean, writer, upsert,
+                        upsert_chunk_size
+                    )
+                ))
+
+                # wait for the database when it falls behind the downloads
+                if len(saving) >= num_threads * 2:
+                    saved, saving = await asyncio.wait(saving, return_when=asyncio.FIRST_COMPLETED)
+                    for future in saved:
+                        future.result()
+        finally:
+            await charts.aclose()
+            for future in saving:
+                await future
 
 
 def _select_last_state(database, include_new_symbols=False):
@@ -99,24 +236,34 @@ def _select_last_state(database, include_new_symbols=False):
     return fetch_rows(database, query)
 
 
-def _fetch_data(database, last_state, path='.', dolt_load=False, early_exit=None, clean=False):
-    last_state = last_state[1] if isinstance(last_state, tuple) else last_state
+def _parse_state(last_state):
     symbol = last_state["symbol"]
     tz_info = pytz.timezone(last_state["tz_info"]) if last_state["tz_info"] is not None else pytz.timezone('US/Eastern')
     first_price_date, last_price_date = last_state["first_quote_epoch"], last_state["last_quote_epoch"]
     delisted = last_state["delisted"] if last_state["delisted"] is not None else 0
 
-    # check early exit
-    if early_exit is not None and early_exit():
-        log.warning(f"max time reached or disk almost full, exit before fetching {symbol}")
-        return f"skipped {symbol}"
-
     # parse dates
     first_price_date = datetime.datetime.fromtimestamp(first_price_date, tz=tz_info) if not pd.isna(first_price_date) else None
     last_price_date = datetime.datetime.fromtimestamp(last_price_date, tz=tz_info) if not pd.isna(last_price_date) else None
 
-    # define result file name
-    csv_file = os.path.abspath(os.path.join(path, f"{str(symbol)}.csv"))
+    return symbol, tz_info, first_price_date, last_price_date, delisted
+
+
+def _start_date(last_price_date):
+    # overwrite the last couple of days in case of error corrections, without a last price fetch the max history
+    return (last_price_date - timedelta(days=5)).date() if last_price_date is not None else None
+
+
+def _fetch_data(
+        database, last_state, path='.', dolt_load=False, early_exit=None, clean=False, writer=None, upsert="replace", upsert_chunk_size=5000
+):
+    last_state = last_state[1] if isinstance(last_state, tuple) else last_state
+    symbol, tz_info, first_price_date, last_price_date, delisted = _parse_state(last_state)
+
+    # check early exit
+    if early_exit is not None and early_exit():
+        log.warning(f"max time reached or disk almost full, exit before fetching {symbol}")
+        return f"skipped {symbol}"
 
     # try to fetch quotes
     try:
@@ -125,42 +272,116 @@ def _fetch_data(database, last_state, path='.', dolt_load=False, early_exit=None
             #df = download([symbol], progress=False, show_errors=False)
             df = Ticker(symbol).history(period='max')
         else:
-            # fetch data, and overwrite the last couple of days in case of error corrections
             log.info(f"{symbol}: fetch for new prices from {last_price_date}")
             # df = download([symbol], start=(last_price_date - timedelta(days=5)).date(), progress=False, show_errors=False)
-            df = Ticker(symbol).history(start=(last_price_date - timedelta(days=5)).date())
+            df = Ticker(symbol).history(start=_start_date(last_price_date))
     except KeyError as ke:
         log.warn(f"dataframe does not have key {ke} {symbol}")
         df = pd.DataFrame({})
 
-    if len(df) > 0:
-        # fix hick ups
-        if "Adj. Close" in df.columns:
-            log.warn("Auto Adjustment failed for some reason")
-            df = auto_adjust(df)
+    return _store_data(database, symbol, df, tz_info, first_price_date, delisted, path, dolt_load, clean, writer, upsert, upsert_chunk_size)
+
 
-        if "Dividends" not in df.columns:
-            log.warn("Add missing column Dividends")
-            df["Dividends"] = None
+def _batches(last_state, batch_size):
+    # most symbols of a nightly run start 5 days before the last run, they share a single request
+    states = [_parse_state(state) for _, state in last_state.iterrows()]
+    groups = {}
+    for state in states:
+        groups.setdefault(_start_date(state[3]), []).append(state)
 
-        if "Stock Splits" not in df.columns:
-            log.warn("Add missing column Stock Splits")
-            df["Stock Splits"] = None
+    return [group[i:i + batch_size] for group in groups.values() for i in range(0, len(group), batch_size)]
 
-        # convert date to float
-        df.insert(0, "epoch", df.index.to_series().apply(lambda x: x.tz_localize(tz_info).to_pydatetime().timestamp()))
 
-        # add symbol to dataframe
-        df.insert(0, "symbol", symbol)
+def _fetch_batch(
+        database, batch, path='.', dolt_load=False, early_exit=None, clean=False, writer=None, upsert="replace", upsert_chunk_size=5000
+):
+    symbols = [state[0] for state in batch]
+    start = _start_date(batch[0][3])
+
+    # check early exit
+    if early_exit is not None and early_exit():
+        log.warning(f"max time reached or disk almost full, exit before fetching {len(symbols)} symbols")
+        return [f"skipped {symbol}" for symbol in symbols]
 
-        # rename columns
-        df = df.rename(
-            columns={"Open": "o", "High": "h", "Low": "l", "Close": "c", "Volume": "v", "Dividends": "dividend", "Stock Splits": "split"}
+    try:
+        log.info(f"fetch prices of {len(symbols)} symbols from {start if start is not None else 'the beginning'}")
+        data = download(
+            symbols,
+            start=start,
+            period="max",
+            actions=True,
+            auto_adjust=True,
+            group_by="ticker",
+            ignore_tz=True,
+            threads=False,
+            progress=False
         )
+    except Exception as e:
+        # a failed request is no sign of a delisting, the symbols are fetched again by the next run
+        log.warning(f"failed to fetch prices of {len(symbols)} symbols, skip them: {e}")
+        return [f"failed {symbol}" for symbol in symbols]
+
+    results = []
+    for symbol, tz_info, first_price_date, _, delisted in batch:
+        df = _split_batch(data, symbol)
+        if len(df) <= 0:
+            # yfinance does not tell failed symbols of a batch apart from the ones without data, ask again for this one
+            df = _history(symbol, start)
+            if df is None:
+                results.append(f"failed {symbol}")
+                continue
+
+        results.append(
+            _store_data(database, symbol, df, tz_info, first_price_date, delisted, path, dolt_load, clean, writer, upsert, upsert_chunk_size)
+        )
+
+    return results
+
+
+def _history(symbol, start):
+    # an empty frame if yahoo has no prices, None if the download failed
+    try:
+        ticker = Ticker(symbol)
+        return ticker.history(period="max", raise_errors=True) if start is None else ticker.history(start=start, raise_errors=True)
+    except (YFPricesMissingError, YFTickerMissingError, YFTzMissingError) as e:
+        log.info(f"{symbol}: no prices found: {e}")
+        return pd.DataFrame({})
+    except Exception as e:
+        log.warning(f"{symbol}: failed to fetch prices, skip it: {e}")
+        return None
+
 
-        # save as csv
-        log.info(f"save csv for {symbol} containing {len(df)} rows to {csv_file}")
-        df_to_csv(df, csv_file)
+def _split_batch(data, symbol):
+    if data is None or len(data) <= 0:
+        return pd.DataFrame({})
+
+    if isinstance(data.columns, pd.MultiIndex):
+        tickers = data.columns.get_level_values(0)
+        ticker = symbol if symbol in tickers else str(symbol).upper()
+        if ticker not in tickers:
+            return pd.DataFrame({})
+
+        data = data[ticker]
+
+    # the dates of the batch are the union of all symbols, drop the ones without prices of this symbol
+    prices = [c for c in ("Open", "High", "Low", "Close") if c in data.columns]
+    return data.dropna(how="all", subset=prices)
+
+
+def _store_data(
+        database, symbol, df, tz_info, first_price_date, delisted, path='.', dolt_load=False, clean=False, writer=None, upsert="replace",
+        upsert_chunk_size=5000
+):
+    # define result file name
+    csv_file = os.path.abspath(os.path.join(path, f"{str(symbol)}.csv"))
+
+    if len(df) > 0:
+        df = normalize_quotes(df, symbol, tz_info)
+
+        # save as csv, the writer of a pipeline saves whole batches
+        if writer is None:
+            log.info(f"save csv for {symbol} containing {len(df)} rows to {csv_file}")
+            df_to_csv(df, csv_file)
 
         min_epoch = float(first_price_date.timestamp()) if first_price_date is not None else df["epoch"].min()
         max_epoch = df["epoch"].max()
@@ -171,17 +392,28 @@ def _fetch_data(database, last_state, path='.', dolt_load=False, early_exit=None
         max_epoch = None
 
     # save all results
-    _save_results(database, df, dolt_load, csv_file, clean, symbol, min_epoch, max_epoch, delisted, tz_info)
+    if writer is not None:
+        if len(df) > 0:
+            writer.put(quote_table_name, df)
+
+        writer.put(quote_meta_table_name, _meta(symbol, min_epoch, max_epoch, delisted, tz_info))
+    else:
+        _save_results(database, df, dolt_load, csv_file, clean, symbol, min_epoch, max_epoch, delisted, tz_info, upsert, upsert_chunk_size)
 
     # just to return something to the executor
     return symbol
 
 
-def _save_results(database, df, dolt_load,  csv_file, clean, symbol, min_epoch, max_epoch, delisted, tz_info):
+def _save_results(
+        database, df, dolt_load,  csv_file, clean, symbol, min_epoch, max_epoch, delisted, tz_info, upsert="replace", upsert_chunk_size=5000
+):
     if len(df) > 0:
         # safe df
         if pd.Series(['symbol', 'epoch']).isin(df.columns).all():
-            save_results(database, df, dolt_load, quote_table_name, csv_file, clean, index_columns=["symbol", "epoch"])
+            save_results(
+                database, df, dolt_load, quote_table_name, csv_file, clean, index_columns=["symbol", "epoch"], method=upsert,
+                chunk_size=upsert_chunk_size
+            )
         else:
             log.error(f"some strange dataframe for {symbol}\n{df.head()}")
             delisted = True
@@ -189,20 +421,26 @@ def _save_results(database, df, dolt_load,  csv_file, clean, symbol, min_epoch,
     # save metadata
     save_results(
         database,
-        pd.DataFrame(
-            [{
-                "symbol": symbol,
-                "min_epoch": min_epoch,
-                "max_epoch": max_epoch,
-                "delisted": int(delisted),
-                "tz_info": str(tz_info)
-            }]
-        ),
+        _meta(symbol, min_epoch, max_epoch, delisted, tz_info),
         dolt_load,
         quote_meta_table_name,
         csv_file + ".meta.csv",
         clean,
-        index_columns="symbol"
+        index_columns="symbol",
+        method=upsert,
+        chunk_size=upsert_chunk_size
+    )
+
+
+def _meta(symbol, min_epoch, max_epoch, delisted, tz_info):
+    return pd.DataFrame(
+        [{
+            "symbol": symbol,
+            "min_epoch": min_epoch,
+            "max_epoch": max_epoch,
+            "delisted": int(delisted),
+            "tz_info": str(tz_info)
+        }]
     )
 
 
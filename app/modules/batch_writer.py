@@ -0,0 +1,99 @@
+import logging
+from queue import Empty, Queue
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+_closed = object()
+
+
+class WriterClosed(Exception):
+    pass
+
+
+# single writer thread behind a bounded queue, a full queue blocks the producers
+class BatchWriter(object):
+    def __init__(self, write: Callable[[Dict[str, pd.DataFrame]], None], max_rows=100_000, max_delay=30, max_queue=64) -> None:
+        super().__init__()
+        self.write = write
+        self.max_rows = int(max_rows)
+        self.max_delay = float(max_delay)
+        self.queue = Queue(maxsize=int(max_queue))
+        self.closed = False
+        # producers blocked by a full queue, close waits for them before it ends the queue
+        self.putting = 0
+        self.lock = Condition()
+        self.error = None
+        self.writer = Thread(target=self._run, name="batch-writer", daemon=True)
+        self.writer.start()
+
+    def put(self, table: str, df: pd.DataFrame):
+        with self.lock:
+            if self.closed:
+                # producers outliving the pipeline, i.e. after an early exit, must not write besides the writer
+                log.warning(f"the writer is closed, dropped {len(df)} rows of {table}")
+                raise WriterClosed(f"the writer is closed, dropped {len(df)} rows of {table}")
+
+            self.putting += 1
+
+        try:
+            self.queue.put((table, df))
+        finally:
+            with self.lock:
+                self.putting -= 1
+                self.lock.notify_all()
+
+    def close(self):
+        with self.lock:
+            closing, self.closed = not self.closed, True
+            # rows accepted before the close are queued ahead of its end
+            self.lock.wait_for(lambda: self.putting <= 0)
+
+        if closing:
+            self.queue.put(_closed)
+
+        self.writer.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        batch: Dict[str, List[pd.DataFrame]] = {}
+        rows, started = 0, None
+        while True:
+            timeout = None if started is None else max(0.0, started + self.max_delay - monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                item = None
+
+            if item is not None and item is not _closed:
+                table, df = item
+                batch.setdefault(table, []).append(df)
+                rows += len(df)
+                started = started if started is not None else monotonic()
+
+            if len(batch) > 0 and (item is None or item is _closed or rows >= self.max_rows):
+                self._flush(batch, rows)
+                batch, rows, started = {}, 0, None
+
+            if item is _closed:
+                return
+
+    def _flush(self, batch: Dict[str, List[pd.DataFrame]], rows):
+        log.info(f"write a batch of {rows} rows into {', '.join(batch)}")
+        try:
+            self.write({table: pd.concat(frames, ignore_index=True) for table, frames in batch.items()})
+        except Exception as e:
+            # keep draining the queue, the producers must not block forever
+            log.error(f"failed to write a batch of {rows} rows", exc_info=e)
+            self.error = self.error or e
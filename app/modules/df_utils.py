@@ -2,8 +2,10 @@ import atexit
 import logging
 import os
 import random
-import warnings
+import tempfile
+from contextlib import nullcontext
 from threading import Lock
+from typing import Dict, Tuple
 
 from sqlalchemy import create_engine
 from sqlalchemy.engine import Engine
@@ -12,8 +14,10 @@ from modules.dolt_api import dolt_load_file
 
 threadlock = Lock()
 log = logging.getLogger(__name__)
-engine: Engine = None
-atexit.register(lambda: engine.dispose() if engine is not None else None)
+# by connection string and whether LOAD DATA LOCAL INFILE is allowed
+engines: Dict[Tuple[str, bool], Engine] = {}
+upsert_methods = ("replace", "on_duplicate", "load_data")
+atexit.register(lambda: [engine.dispose() for engine in engines.values()])
 
 
 def df_to_csv(df, file):
@@ -25,40 +29,93 @@ def df_to_csv(df, file):
         df.to_csv(file, header=True, index=False)
 
 
-def df_to_sql_with_replace(df, table_name, db_conn):
-    global engine
-    if engine is None:
-        engine = create_engine(db_conn)
+def df_to_sql_with_replace(df, table_name, db_conn, method="replace", chunk_size=5000):
+    frames_to_sql_with_replace({table_name: df}, db_conn, method, chunk_size)
 
-    def mysql_replace_into(table, conn, keys, data_iter):
-        from sqlalchemy.ext.compiler import compiles
-        from sqlalchemy.sql.expression import Insert
 
-        @compiles(Insert)
-        def replace_string(insert, compiler, **kw):
-            s = compiler.visit_insert(insert, **kw)
-            s = s.replace("INSERT INTO", "REPLACE INTO")
-            return s
+def frames_to_sql_with_replace(frames, db_conn, method="replace", chunk_size=5000):
+    engine = _get_engine(db_conn, method == "load_data")
+    with threadlock if engine.dialect.name == "sqlite" else nullcontext():
+        with engine.begin() as connection:
+            for table_name, df in frames.items():
+                if len(df) > 0:
+                    log.info(f"upsert {len(df)} rows into {db_conn} {table_name}")
+                    bulk_upsert(df, table_name, connection, method, chunk_size)
 
-        data = [dict(zip(keys, row)) for row in data_iter]
 
-        with warnings.catch_warnings():
-            conn.execute(table.table.insert(replace_string=""), data)
+def bulk_upsert(df, table_name, connection, method="replace", chunk_size=5000):
+    # on_duplicate and load_data need MySQL/dolt, the driver rewrites executemany into multi row statements
+    chunk_size = int(chunk_size)
+    sqlite = connection.dialect.name == "sqlite"
+    _check_method(method, connection.dialect.name)
+
+    if any(name is not None for name in df.index.names):
+        df = df.reset_index()
+
+    quote = connection.dialect.identifier_preparer.quote
+    table, columns = quote(table_name), ", ".join(quote(c) for c in df.columns)
+
+    if method == "load_data":
+        return _load_data(df, table_name, columns, connection)
+
+    placeholders = ", ".join(["?" if connection.dialect.paramstyle == "qmark" else "%s"] * len(df.columns))
+    if method == "on_duplicate":
+        updates = ", ".join(f"{quote(c)} = values({quote(c)})" for c in df.columns)
+        statement = f"insert into {table} ({columns}) values ({placeholders}) on duplicate key update {updates}"
+    else:
+        statement = f"{'insert or replace' if sqlite else 'replace'} into {table} ({columns}) values ({placeholders})"
+
+    for i in range(0, len(df), chunk_size):
+        connection.exec_driver_sql(statement, _rows(df.iloc[i:i + chunk_size]))
+
+
+def check_upsert_method(db_conn, method):
+    if db_conn is not None and "://" in db_conn:
+        _check_method(method, _get_engine(db_conn).dialect.name)
+
+
+def _check_method(method, dialect_name):
+    if method not in upsert_methods or (dialect_name == "sqlite" and method != "replace"):
+        raise ValueError(f"unsupported upsert method {method} for {dialect_name}")
 
-    if len(df) > 0:
-        with engine.connect() as connection:
-            log.info(f"insert {len(df)} rows into {db_conn} {table_name}")
-            try:
-                if "sqlite" in engine.url:
-                    threadlock.acquire()
 
-                df.to_sql(table_name, connection, if_exists='append', method=mysql_replace_into)
-            finally:
-                if threadlock.locked():
-                    threadlock.release()
+def _load_data(df, table_name, columns, connection):
+    quote = connection.dialect.identifier_preparer.quote
+    table, staging = quote(table_name), quote(f"{table_name}_staging")
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+        df.to_csv(f, header=False, index=False, na_rep="\\N")
 
+    try:
+        connection.exec_driver_sql(f"create temporary table {staging} like {table}")
+        connection.exec_driver_sql(
+            f"load data local infile '{f.name}' into table {staging} "
+            f"fields terminated by ',' optionally enclosed by '\"' lines terminated by '\\n' ({columns})"
+        )
+        connection.exec_driver_sql(f"replace into {table} ({columns}) select {columns} from {staging}")
+        connection.exec_driver_sql(f"drop temporary table {staging}")
+    finally:
+        os.unlink(f.name)
 
-def save_results(repo_database, df, load_into_dolt, table_name=None, csvfile=None, clear_afterwards=False, index_columns=None):
+
+def _rows(df):
+    # python scalars and None for missing values, the drivers neither know numpy types nor NaN
+    return list(zip(*[df[c].astype(object).where(df[c].notna(), None).to_numpy() for c in df.columns]))
+
+
+def _get_engine(db_conn, local_infile=False):
+    # LOAD DATA LOCAL INFILE has to be allowed by the client, only the engine of load_data does
+    local_infile = local_infile and db_conn.startswith("mysql")
+    with threadlock:
+        if (db_conn, local_infile) not in engines:
+            engines[(db_conn, local_infile)] = create_engine(db_conn, connect_args={"local_infile": True} if local_infile else {})
+
+        return engines[(db_conn, local_infile)]
+
+
+def save_results(
+        repo_database, df, load_into_dolt, table_name=None, csvfile=None, clear_afterwards=False, index_columns=None, method="replace",
+        chunk_size=5000
+):
     has_server = repo_database is not None and "://" in repo_database
 
     if csvfile is not None:
@@ -67,7 +124,9 @@ def save_results(repo_database, df, load_into_dolt, table_name=None, csvfile=Non
     if load_into_dolt:
         if has_server:
             try:
-                df_to_sql_with_replace(df.set_index(index_columns) if index_columns is not None else df, table_name, repo_database)
+                df_to_sql_with_replace(
+                    df.set_index(index_columns) if index_columns is not None else df, table_name, repo_database, method, chunk_size
+                )
             except Exception as e:
                 if csvfile is None:
                     csvfile = f"{random.random()}.csv"
@@ -84,3 +143,24 @@ def save_results(repo_database, df, load_into_dolt, table_name=None, csvfile=Non
                 os.unlink(csvfile)
             except Exception as e:
                 log.error(f"failed to delete file {csvfile}", e)
+
+
+def save_batch(repo_database, frames, index_columns=None, path='.', clear_afterwards=False, method="replace", chunk_size=5000):
+    has_server = repo_database is not None and "://" in repo_database
+    index_columns = index_columns or {}
+
+    if has_server:
+        try:
+            frames_to_sql_with_replace(
+                {t: df.set_index(index_columns[t]) if t in index_columns else df for t, df in frames.items()}, repo_database, method,
+                chunk_size
+            )
+        except Exception as e:
+            for table_name, df in frames.items():
+                csvfile = os.path.join(path, f"{table_name}.{random.random()}.csv")
+                df_to_csv(df, csvfile)
+                log.error(f"failed to insert DataFrame into table {table_name} dumped data to file {csvfile}\n{e}")
+    else:
+        for table_name, df in frames.items():
+            csvfile = os.path.join(path, f"{table_name}.{random.random()}.csv")
+            save_results(repo_database, df, True, table_name, csvfile, clear_afterwards, index_columns.get(table_name, None))
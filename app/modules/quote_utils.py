@@ -0,0 +1,36 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from yfinance.utils import auto_adjust
+
+log = logging.getLogger(__name__)
+
+quote_columns = {"Open": "o", "High": "h", "Low": "l", "Close": "c", "Volume": "v", "Dividends": "dividend", "Stock Splits": "split"}
+
+
+def normalize_quotes(df: pd.DataFrame, symbol, tz_info) -> pd.DataFrame:
+    # fix hick ups
+    if "Adj. Close" in df.columns:
+        log.warning("Auto Adjustment failed for some reason")
+        df = auto_adjust(df)
+
+    columns = {}
+    for column, name in quote_columns.items():
+        if column in df.columns:
+            columns[name] = df[column].to_numpy()
+        else:
+            log.warning(f"Add missing column {column}")
+            columns[name] = np.full(len(df), np.nan)
+
+    # dates without a timezone are local to the exchange
+    index = pd.DatetimeIndex(df.index)
+    if index.tz is None:
+        index = index.tz_localize(tz_info, ambiguous=False, nonexistent="shift_forward")
+
+    return pd.DataFrame({
+        "symbol": np.full(len(df), symbol, dtype=object),
+        "epoch": index.as_unit("s").asi8,
+        **columns,
+        **{c: df[c].to_numpy() for c in df.columns if c not in quote_columns},
+    })
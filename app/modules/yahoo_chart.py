@@ -0,0 +1,156 @@
+import asyncio
+import datetime
+import logging
+import random
+from typing import AsyncIterator, Iterable, Optional, Tuple
+
+import aiohttp
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+chart_url = "https://query2.finance.yahoo.com/v8/finance/chart/{symbol}"
+headers = {"User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:101.0) Gecko/20100101 Firefox/101.0"}
+# answers worth another try after a pause, only a 404 means there is no data for the symbol
+retry_status = (429, 500, 502, 503, 504)
+# seconds to wait before the first retry, doubled for every further one
+backoff = 1.0
+
+
+async def fetch_charts(
+        requests: Iterable[Tuple[str, Optional[datetime.date]]],
+        concurrency=200,
+        retries=3,
+        timeout=30,
+        url=chart_url,
+) -> AsyncIterator[Tuple[str, pd.DataFrame]]:
+    # yields None instead of a frame if the download failed, an empty frame if there is no data for the symbol
+    requests, results = iter(requests), asyncio.Queue(maxsize=concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+
+    async with aiohttp.ClientSession(connector=connector, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async def work():
+            # the symbols are pulled lazily, the consumer stops the download by not asking for more
+            for symbol, start in requests:
+                try:
+                    df = await fetch_chart(session, symbol, start, retries, url)
+                except Exception as e:
+                    # a single symbol must not stop the others
+                    log.warning(f"{symbol}: failed to fetch the chart: {e}")
+                    df = None
+
+                await results.put((symbol, df))
+
+        workers = [asyncio.ensure_future(work()) for _ in range(concurrency)]
+        done = asyncio.ensure_future(asyncio.gather(*workers))
+        try:
+            while not done.done() or not results.empty():
+                getter = asyncio.ensure_future(results.get())
+                await asyncio.wait([getter, done], return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+
+            # raise errors of the workers
+            await done
+        finally:
+            done.cancel()
+            for worker in workers:
+                worker.cancel()
+
+
+async def fetch_chart(session: aiohttp.ClientSession, symbol: str, start: datetime.date = None, retries=3, url=chart_url) -> Optional[pd.DataFrame]:
+    params = {"interval": "1d", "events": "div,splits", "includeAdjustedClose": "true"}
+    if start is None:
+        params["range"] = "max"
+    else:
+        params["period1"] = str(int(pd.Timestamp(start, tz="UTC").timestamp()))
+        params["period2"] = str(int(pd.Timestamp.now(tz="UTC").timestamp()))
+
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url.format(symbol=symbol), params=params) as response:
+                if response.status in retry_status:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status)
+
+                if response.status not in (200, 404):
+                    # e.g. an auth or ip block, not a delisted symbol
+                    log.warning(f"{symbol}: failed to download the chart: status {response.status}")
+                    return None
+
+                payload = await response.json(content_type=None) if response.status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            # ValueError: a truncated or otherwise invalid json body
+            if attempt >= retries:
+                log.warning(f"{symbol}: failed to download the chart: {e}")
+                return None
+
+            await asyncio.sleep(backoff * (2 ** attempt + random.random()))
+            continue
+
+        try:
+            return parse_chart(payload)
+        except Exception as e:
+            log.warning(f"{symbol}: failed to parse the chart: {e}")
+            return None
+
+
+def parse_chart(payload: Optional[dict]) -> pd.DataFrame:
+    # prices are adjusted by dividends and splits like `yfinance.Ticker.history`
+    result = ((payload or {}).get("chart", None) or {}).get("result", None) or [{}]
+    result = result[0]
+    timestamps = result.get("timestamp", None)
+    if not timestamps:
+        return pd.DataFrame({})
+
+    indicators = result.get("indicators", {})
+    quote = indicators.get("quote", [{}])[0]
+    timestamps = np.asarray(timestamps, dtype="int64")
+
+    def values(data: dict, column) -> np.ndarray:
+        # missing values are null in the json, numpy turns them into NaN
+        return np.array(data.get(column, None) or [None] * len(timestamps), dtype="float64")
+
+    close = values(quote, "close")
+    adjusted = values(indicators.get("adjclose", [{}])[0], "adjclose")
+    ratio = np.where(np.isnan(adjusted), 1.0, adjusted / close)
+
+    events = result.get("events", None) or {}
+    dividends = pd.Series({int(ts): e.get("amount", 0.0) for ts, e in (events.get("dividends", None) or {}).items()}, dtype="float64")
+    splits = pd.Series(
+        {int(ts): e["numerator"] / e["denominator"] for ts, e in (events.get("splits", None) or {}).items() if e.get("denominator", 0)},
+        dtype="float64"
+    )
+
+    tz = (result.get("meta", None) or {}).get("exchangeTimezoneName", None) or "UTC"
+    dates = pd.to_datetime(timestamps, unit="s", utc=True).tz_convert(tz).normalize().tz_localize(None)
+    df = pd.DataFrame(
+        {
+            "Open": values(quote, "open") * ratio,
+            "High": values(quote, "high") * ratio,
+            "Low": values(quote, "low") * ratio,
+            "Close": np.where(np.isnan(adjusted), close, adjusted),
+            "Volume": values(quote, "volume"),
+            "Dividends": _on_dates(dividends, dates, tz),
+            "Stock Splits": _on_dates(splits, dates, tz),
+        },
+        index=pd.DatetimeIndex(dates, name="Date")
+    )
+
+    # bars without any price are placeholders of days without trading
+    df = df[~df[["Open", "High", "Low", "Close"]].isna().all(axis=1)]
+    df = df[~df.index.duplicated(keep="last")]
+    if not df["Volume"].isna().any():
+        df["Volume"] = df["Volume"].astype("int64")
+
+    return df
+
+
+def _on_dates(events: pd.Series, dates: pd.DatetimeIndex, tz) -> np.ndarray:
+    if len(events) <= 0:
+        return np.zeros(len(dates))
+
+    events.index = pd.to_datetime(events.index, unit="s", utc=True).tz_convert(tz).normalize().tz_localize(None)
+    return events.groupby(level=0).sum().reindex(dates, fill_value=0.0).to_numpy()
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from collections import OrderedDict, defaultdict, deque
+from functools import partial
+from time import perf_counter
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from serve.config import Config
+from serve.datastream.closing_body import ClosingBody
+from serve import metrics
+
+log = logging.getLogger(__name__)
+admission: 'AdmissionControl' = None
+
+
+class Rejected(Exception):
+    def __init__(self, status, message, retry_after) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+# waiting requests are served round robin by client, so a single client can not starve the others
+class AdmissionControl(object):
+    def __init__(self, max_concurrent=8, max_queue=64, max_per_client=4, queue_timeout=30, client_header=None) -> None:
+        super().__init__()
+        self.max_concurrent = int(max_concurrent)
+        self.max_queue = int(max_queue)
+        self.max_per_client = int(max_per_client)
+        self.queue_timeout = float(queue_timeout)
+        self.client_header = client_header
+        self.active = 0
+        self.queued = 0
+        # admitted and waiting requests by client
+        self.clients: Dict[str, int] = defaultdict(int)
+        self.waiting: Dict[str, Deque[asyncio.Future]] = OrderedDict()
+        # moving average of the seconds a request is admitted, used to estimate Retry-After
+        self.service_time = 1.0
+
+    def client(self, request) -> str:
+        forwarded = request.headers.get(self.client_header, None) if self.client_header else None
+        return forwarded.split(",")[0].strip() if forwarded else (request.remote_addr or "")
+
+    async def acquire(self, client: str) -> float:
+        # the returned time has to be passed to `release`
+        if self.clients.get(client, 0) >= self.max_per_client:
+            self._reject(429, "client", f"too many concurrent requests of {client}")
+
+        if self.active < self.max_concurrent and self.queued == 0:
+            return self._admit(client)
+
+        if self.queued >= self.max_queue:
+            self._reject(503, "queue_full", "too many queued requests")
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(client, deque()).append(future)
+        self.clients[client] += 1
+        self.queued += 1
+        metrics.admission_queued.inc()
+        queued = perf_counter()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._dequeue(client, future)
+                self._reject(503, "timeout", f"waited more than {self.queue_timeout:.0f}s for the database")
+        except asyncio.CancelledError:
+            # the client is gone, hand on the slot if it was admitted in the meantime
+            if future.done() and not future.cancelled():
+                self.release(client, future.result())
+            else:
+                future.cancel()
+                self._dequeue(client, future)
+
+            raise
+        finally:
+            metrics.admission_wait_seconds.observe(perf_counter() - queued)
+
+        return future.result()
+
+    def release(self, client: str, admitted: float):
+        self.active -= 1
+        self.clients[client] -= 1
+        if self.clients[client] <= 0:
+            del self.clients[client]
+
+        self.service_time = 0.9 * self.service_time + 0.1 * (perf_counter() - admitted)
+        metrics.admission_active.dec()
+        self._dispatch()
+
+    def hold(self, client: str, admitted: float, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        return ClosingBody(body, partial(self.release, client, admitted))
+
+    def _admit(self, client: str) -> float:
+        self.active += 1
+        self.clients[client] += 1
+        metrics.admission_active.inc()
+        return perf_counter()
+
+    def _dispatch(self):
+        # the client waiting longest gets the next free slot and goes to the end of the line
+        while self.active < self.max_concurrent and self.queued > 0:
+            client, futures = next(iter(self.waiting.items()))
+            future = futures.popleft()
+            if len(futures) <= 0:
+                del self.waiting[client]
+            else:
+                self.waiting.move_to_end(client)
+
+            self.queued -= 1
+            metrics.admission_queued.dec()
+            self.active += 1
+            metrics.admission_active.inc()
+            future.set_result(perf_counter())
+
+    def _dequeue(self, client: str, future: asyncio.Future):
+        futures = self.waiting.get(client, None)
+        if futures is None or future not in futures:
+            return
+
+        futures.remove(future)
+        if len(futures) <= 0:
+            del self.waiting[client]
+
+        self.queued -= 1
+        metrics.admission_queued.dec()
+        self.clients[client] -= 1
+        if self.clients[client] <= 0:
+            del self.clients[client]
+
+    def _reject(self, status, reason, message):
+        metrics.admission_rejected.labels(reason).inc()
+        retry_after = max(1, round(self.service_time * (self.queued + 1) / self.max_concurrent))
+        raise Rejected(status, message, retry_after)
+
+
+def new_admission() -> Optional[AdmissionControl]:
+    config = Config.get().get("admission", None) or {}
+    if not config.get("enabled", True):
+        return None
+
+    return AdmissionControl(
+        config.get("max_concurrent", 8),
+        config.get("max_queue", 64),
+        config.get("max_per_client", 4),
+        config.get("queue_timeout", 30),
+        config.get("client_header", None),
+    )
+
+
+def get_admission() -> Optional[AdmissionControl]:
+    global admission
+    if admission is None:
+        admission = new_admission() or False
+
+    return admission or None
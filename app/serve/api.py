@@ -1,24 +1,37 @@
+import asyncio
 import datetime
 import json
 import mimetypes
 import os.path
 import subprocess
 import sys
+import tempfile
 from time import sleep
 
 import click
-from quart import Quart, request
+from quart import Quart, Response, request
 
+from serve.cache.response_cache import get_cache, get_immutable_cache, ResponseCache
+from serve.cache.single_flight import get_single_flight
 from serve.config import Config
-from serve.dataaccess.ohlcv import fetch_ohlcv
-from serve.datastream.pandas_response import make_pandas_response
-from serve.utils.request_util import get_data_args
+from serve.dataaccess import database
+from serve.dataaccess.commit import commit_pattern, current_commit, resolve_commit
+from serve.dataaccess.ohlcv import check_columns, fetch_ohlcv, stream_ohlcv
+from serve.datastream.pandas_response import make_pandas_response, make_pandas_stream_response
+from serve.flight import start_flight_server
+from serve import metrics, watcher
+from serve.admission import get_admission, Rejected
+from serve.errors import BadRequest
+from serve.utils.request_util import get_data_args, get_bulk_args, normalize_symbols, DataArgs
 
 # get server path
 PATH = os.path.abspath(os.path.dirname(__file__))
 
 # create app
 app = Quart(__name__)
+settings: dict = None
+immutable_cache_control = "public, max-age=31536000, immutable"
+watcher_task: asyncio.Task = None
 
 # the end of day data path is mapped to the EOD table.
 #
@@ -42,11 +55,36 @@ app = Quart(__name__)
 # ?Yahoo=aapl,msft&investing=10y,...
 @app.route("/api/ohlcv")
 async def ohlcv():
-    separator, as_type, where, axis, pandas_kwargs = get_data_args(request.args)
+    args = get_data_args(request.args)
 
-    symbols = {source: symbols.split(separator) for source, symbols in request.args.items() if not source.startswith("__")}
-    df = await fetch_ohlcv(symbols, where, axis)
-    return make_pandas_response(df, as_type, **pandas_kwargs)
+    symbols = {source: symbols.split(args.separator) for source, symbols in request.args.items() if not source.startswith("__")}
+    return await _ohlcv_response(symbols, args)
+
+
+# large universes of symbols are posted, the result is streamed in long format with one chunk of symbols after the other
+# {"symbols": [["yfinance", "MSFT"], ...], "from": "2020-01-01", "as": "arrow"}
+@app.route("/api/ohlcv", methods=["POST"])
+async def ohlcv_bulk():
+    symbols, args = get_bulk_args(request.args, await request.get_data(), request.mimetype)
+    request_metrics = metrics.start_request(request.url_rule.rule, symbols.keys())
+
+    try:
+        as_of = await resolve_commit(args.as_of) if args.as_of is not None else None
+        # the columns are checked before the response starts, errors of the stream truncate it
+        await check_columns(symbols.keys(), args.columns)
+        frames = stream_ohlcv(symbols, args.where, args.freq, args.columns, args.start, args.end, as_of)
+        body, status, headers = make_pandas_stream_response(frames, args.as_type, **args.pandas_kwargs)
+
+        # the symbols are queried while the body is streamed, the request stays admitted until it is sent
+        admission = get_admission()
+        if admission is not None:
+            client = admission.client(request)
+            body = admission.hold(client, await admission.acquire(client), body)
+    except BaseException as e:
+        request_metrics.finish(_error_status(e))
+        raise
+
+    return Response(request_metrics.stream(body, status), status, headers)
 
 
 # get joined symbols
@@ -54,11 +92,132 @@ async def ohlcv():
 # /Yahoo/aapl,msft,...
 @app.route("/api/ohlcv/<string:source>/<string:symbols>")
 async def ohlcv_source(source, symbols):
-    separator, as_type, where, axis, pandas_kwargs = get_data_args(request.args)
-    symbols = symbols.split(separator)
+    args = get_data_args(request.args)
+    symbols = symbols.split(args.separator)
+
+    return await _ohlcv_response({source: symbols}, args)
+
+
+async def _ohlcv_response(symbols, args: DataArgs):
+    # the symbols are part of the cache key, the response lists them in the requested order
+    symbols = normalize_symbols(symbols)
+    request_metrics = metrics.start_request(request.url_rule.rule, symbols.keys())
+    try:
+        # responses only change with a new dolt commit, the commit and the request are used as cache key and etag.
+        # responses pinned to a commit hash never change at all, branches and tags may move to another commit
+        pinned = args.as_of is not None
+        commit = await resolve_commit(args.as_of) if pinned else await current_commit()
+        immutable = pinned and commit == args.as_of and commit_pattern.match(commit) is not None
+        request_args = args._replace(separator=None, as_of=commit if pinned else None)
+        request_key = ResponseCache.make_key(commit, symbols, request_args)
+        key = request_key if commit is not None else None
+        cache_control = immutable_cache_control if immutable else get_settings().get("cache_control", "no-cache")
+        etag = {'ETag': f'"{key}"', 'Cache-Control': cache_control} if key is not None else {}
+
+        if key is not None and request.if_none_match.contains_weak(key):
+            request_metrics.cache("not_modified")
+            request_metrics.finish(304)
+            return "", 304, etag
+
+        if not pinned:
+            watcher.record(symbols, request_args)
+
+        cache = (get_immutable_cache() if immutable else get_cache()) if key is not None else None
+        entry = await cache.get(key) if cache is not None else None
+        if entry is not None:
+            request_metrics.cache("hit")
+            request_metrics.finish(200, len(entry.content))
+            return entry.content, 200, {**entry.headers, **etag, 'X-Cache': 'HIT', 'Server-Timing': request_metrics.server_timing()}
+
+        # identical requests in flight share one response, if the leader fails the followers compute their own
+        flights = get_single_flight()
+        flight, leading = flights.start(request_key) if flights is not None else (None, False)
+        entry = await flights.wait(request_key, flight) if flight is not None and not leading else None
+        if entry is not None:
+            request_metrics.collapsed()
+            request_metrics.finish(200, len(entry.content))
+            return entry.content, 200, {**entry.headers, **etag, 'X-Cache': 'COLLAPSED', 'Server-Timing': request_metrics.server_timing()}
+
+        request_metrics.cache("miss")
+        try:
+            # queries are admitted so a burst of requests can not overload the database
+            admission = get_admission()
+            client = admission.client(request) if admission is not None else None
+            admitted = await admission.acquire(client) if admission is not None else None
+            try:
+                body, status, headers = await _render(symbols, args, commit if pinned else None)
+            finally:
+                if admission is not None: admission.release(client, admitted)
+        except BaseException:
+            # also if the request is cancelled, i.e. the client went away
+            if leading: flights.abandon(request_key, flight)
+            raise
+
+        if cache is not None:
+            body = cache.tee(key, body, headers)
+        # the flight ends with the body, even if it is closed before it was sent
+        if leading:
+            body = flights.share(request_key, flight, body, headers)
+    except BaseException as e:
+        request_metrics.finish(_error_status(e))
+        raise
+
+    # the body is serialized while it is streamed, its timing is only part of the histograms
+    headers = {**headers, **etag, 'X-Cache': 'MISS', 'Server-Timing': request_metrics.server_timing()}
+    return Response(request_metrics.stream(body, status), status, headers)
+
+
+def _error_status(e: BaseException) -> int:
+    # requests cancelled as the client went away are counted like nginx does
+    return 499 if isinstance(e, asyncio.CancelledError) else getattr(e, "status", 400 if isinstance(e, BadRequest) else 500)
+
+
+async def _render(symbols, args: DataArgs, as_of=None):
+    df = await fetch_ohlcv(symbols, args.where, args.axis, args.freq, args.columns, args.start, args.end, args.layout, args.pivot, as_of)
+    return make_pandas_response(df, args.as_type, **args.pandas_kwargs)
 
-    df = await fetch_ohlcv({source: symbols}, where, axis)
-    return make_pandas_response(df, as_type, **pandas_kwargs)
+
+async def _render_head(symbols, args: DataArgs, commit):
+    # the head may move on while the responses are warmed, they are rendered as of the commit they are cached for
+    return await _render(symbols, args, commit)
+
+
+@app.route("/api/metrics")
+async def prometheus_metrics():
+    return metrics.render()
+
+
+@app.errorhandler(Rejected)
+async def rejected(error: Rejected):
+    return str(error), error.status, {'Retry-After': str(error.retry_after)}
+
+
+@app.errorhandler(BadRequest)
+async def bad_request(error: BadRequest):
+    return str(error), 400
+
+
+def get_settings() -> dict:
+    global settings
+    if settings is None:
+        settings = Config.get().get("server", None) or {}
+
+    return settings
+
+
+@app.before_serving
+async def startup():
+    global watcher_task
+    watcher_task = watcher.start_watcher(_render_head)
+
+
+@app.after_serving
+async def shutdown():
+    if watcher_task is not None:
+        watcher_task.cancel()
+
+    database.dispose()
+    metrics.worker_exit()
 
 
 # a route to just the test that the server is up and responses
@@ -80,14 +239,17 @@ async def ping():
 @click.command()
 @click.option('-e', '--env-file', type=str, default=None, help='Config file')
 @click.option('-c', '--config-file', type=str, default=None, help='Config file')
-def cli(env_file, config_file):
+@click.option('-w', '--workers', type=int, default=None, help='Number of worker processes, overwrites server.workers')
+def cli(env_file, config_file, workers):
     # overwrite configuration
-    if env_file is not None: Config.env_path = env_file
-    if config_file is not None: Config.conf_path = config_file
+    if env_file is not None: Config.env_path = os.environ["FINDB_ENV_PATH"] = os.path.abspath(env_file)
+    if config_file is not None: Config.conf_path = os.environ["FINDB_CONF_PATH"] = os.path.abspath(config_file)
 
     config = Config.get()
+    workers = workers if workers is not None else int(config["server"].get("workers", 1) or 1)
     print("starting api using", config)
     dolt_server_process = None
+    flight_server = None
 
     try:
         dolt_server_command = config["dolt"]["repository"].get("start_server", None)
@@ -96,14 +258,45 @@ def cli(env_file, config_file):
             dolt_server_process = subprocess.Popen(dolt_server_command, cwd=os.path.join(PATH, config["dolt"]["repository"].get("path", ".")))
             sleep(1)
 
-        print("starting http server")
-        app.run(
-            config["server"].get("host", None),
-            config["server"].get("port", None),
-        )
+        flight_server = start_flight_server(config)
+
+        if workers > 1:
+            print(f"starting http server with {workers} workers")
+            _run_workers(config, workers)
+        else:
+            print("starting http server")
+            app.run(
+                config["server"].get("host", None),
+                config["server"].get("port", None),
+            )
     finally:
+        if flight_server is not None: flight_server.shutdown()
         if dolt_server_process is not None: dolt_server_process.kill()
-        app.shutdown()
+        if workers <= 1: app.shutdown()
+
+
+def _run_workers(config: dict, workers: int):
+    # each worker is a process with its own interpreter, sending SIGHUP restarts the workers gracefully
+    from hypercorn.config import Config as HypercornConfig
+    from hypercorn.run import run
+
+    server = config["server"]
+    hypercorn_config = HypercornConfig()
+    hypercorn_config.application_path = "serve.api:app"
+    hypercorn_config.bind = [f"{server.get('host', None) or '127.0.0.1'}:{server.get('port', None) or 5000}"]
+    hypercorn_config.workers = workers
+    hypercorn_config.worker_class = server.get("worker_class", "asyncio")
+    hypercorn_config.graceful_timeout = float(server.get("graceful_timeout", 30))
+
+    with tempfile.TemporaryDirectory(prefix="findb_metrics_") as metrics_dir:
+        # the workers sum up their metrics, share the responses they computed in a disk cache and one of them watches the head
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+        os.environ["FINDB_WATCHER_LOCK"] = os.path.join(metrics_dir, "watcher.lock")
+        if not ((config.get("cache", None) or {}).get("disk", None) or {}).get("path", None):
+            os.environ["FINDB_CACHE_PATH"] = os.path.join(tempfile.gettempdir(), "findb_response_cache")
+            print("no cache.disk.path configured, workers share", os.environ["FINDB_CACHE_PATH"])
+
+        sys.exit(run(hypercorn_config))
 
 
 # start server
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+from typing import NamedTuple, Optional, AsyncIterator
+
+import humanfriendly
+
+from serve.config import Config
+
+log = logging.getLogger(__name__)
+# False once the configuration disabled them, so it is not read again on every request
+cache: 'ResponseCache' = None
+immutable_cache: 'ResponseCache' = None
+
+
+class CacheEntry(NamedTuple):
+    content: bytes
+    headers: dict
+
+
+# keys contain the dolt commit, so a new commit never hits stale entries
+class ResponseCache(object):
+    def __init__(self, max_size="512MB", max_entry_size="64MB", path=None, max_disk_size="4GB") -> None:
+        super().__init__()
+        self.max_bytes = _parse_size(max_size)
+        self.max_entry_bytes = _parse_size(max_entry_size)
+        self.path = path
+        # responses pinned to a commit never change, their disk tier can be unbounded
+        self.max_disk_bytes = _parse_size(max_disk_size) if max_disk_size else float("inf")
+        self.entries = OrderedDict()
+        self.size = 0
+        self.disk_size = 0
+        self.lock = Lock()
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            if self.max_disk_bytes < float("inf"):
+                self._evict_disk()
+
+    @staticmethod
+    def make_key(commit: str, *request) -> str:
+        return hashlib.sha256(json.dumps([commit, *request], sort_keys=True, default=str).encode("UTF-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+
+        if self.path is not None:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self._read, key)
+            if entry is not None:
+                self._put_memory(key, entry)
+                return entry
+
+        return None
+
+    async def put(self, key: str, content: bytes, headers: dict):
+        if len(content) > self.max_entry_bytes:
+            return
+
+        entry = CacheEntry(content, dict(headers))
+        self._put_memory(key, entry)
+
+        if self.path is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, key, entry)
+
+    async def tee(self, key: str, generator: AsyncIterator[bytes], headers: dict) -> AsyncIterator[bytes]:
+        # pass the chunks through to the client and cache the response once it was completely sent
+        chunks, size = [], 0
+        async for chunk in generator:
+            if chunks is not None:
+                size += len(chunk)
+                if size <= self.max_entry_bytes:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+
+            yield chunk
+
+        if chunks is not None:
+            await self.put(key, b"".join(chunks), headers)
+
+    async def discard(self, key: str):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry.content)
+
+        if self.path is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._remove, key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _put_memory(self, key: str, entry: CacheEntry):
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key).content)
+
+            self.entries[key] = entry
+            self.size += len(entry.content)
+
+            while self.size > self.max_bytes and len(self.entries) > 0:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.content)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def _read(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._file(key), "rb") as f:
+                header_size, = struct.unpack("<I", f.read(4))
+                headers = json.loads(f.read(header_size).decode("UTF-8"))
+                content = f.read()
+
+            os.utime(self._file(key))
+            return CacheEntry(content, headers)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"failed to read cache entry {key}: {e}")
+            return None
+
+    def _write(self, key: str, entry: CacheEntry):
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        headers = json.dumps(entry.headers).encode("UTF-8")
+
+        # write to a temporary file first, other workers might read the same entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(file))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(struct.pack("<I", len(headers)))
+                f.write(headers)
+                f.write(entry.content)
+
+            os.replace(tmp, file)
+            self.disk_size += len(entry.content)
+        except Exception as e:
+            log.warning(f"failed to write cache entry {key}: {e}")
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+        # the tracked size is only an estimate if several workers share the directory
+        if self.disk_size > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _remove(self, key: str):
+        try:
+            self.disk_size -= os.path.getsize(self._file(key))
+            os.unlink(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict_disk(self):
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+                except FileNotFoundError:
+                    pass
+
+        size = sum(f[1] for f in files)
+        for _, file_size, file in sorted(files):
+            if size <= self.max_disk_bytes:
+                break
+
+            try:
+                os.unlink(file)
+            except FileNotFoundError:
+                pass
+
+            size -= file_size
+
+        self.disk_size = size
+
+
+def get_cache() -> Optional[ResponseCache]:
+    global cache
+    if cache is None:
+        config = Config.get().get("cache", None) or {}
+        memory, disk = config.get("memory", None) or {}, config.get("disk", None) or {}
+        cache = ResponseCache(
+            memory.get("max_size", "512MB"),
+            memory.get("max_entry_size", "64MB"),
+            disk.get("path", None) or os.environ.get("FINDB_CACHE_PATH", None),
+            disk.get("max_size", "4GB"),
+        ) if config.get("enabled", True) else False
+
+    return cache or None
+
+
+def get_immutable_cache() -> Optional[ResponseCache]:
+    global immutable_cache
+    if immutable_cache is None:
+        config = Config.get().get("cache", None) or {}
+        immutable = config.get("immutable", None) or {}
+        memory = config.get("memory", None) or {}
+        immutable_cache = ResponseCache(
+            immutable.get("memory_size", "128MB"),
+            memory.get("max_entry_size", "64MB"),
+            immutable.get("path", None),
+            immutable.get("max_size", None),
+        ) if config.get("enabled", True) and immutable.get("enabled", True) else False
+
+    return immutable_cache or None
+
+
+def _parse_size(size) -> int:
+    return humanfriendly.parse_size(size) if isinstance(size, str) else int(size)
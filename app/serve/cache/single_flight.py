@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from functools import partial
+from typing import Dict, Optional, AsyncIterator, Tuple
+
+from serve.cache.response_cache import CacheEntry, _parse_size
+from serve.config import Config
+from serve.datastream.closing_body import ClosingBody
+
+log = logging.getLogger(__name__)
+single_flight: 'SingleFlight' = None
+
+
+class SingleFlight(object):
+    def __init__(self, max_size="64MB", timeout=60) -> None:
+        super().__init__()
+        self.max_bytes = _parse_size(max_size)
+        self.timeout = float(timeout)
+        self.flights: Dict[str, asyncio.Future] = {}
+
+    def start(self, key: str) -> Tuple[asyncio.Future, bool]:
+        # a leader has to `share` or `abandon` its flight
+        flight = self.flights.get(key, None)
+        if flight is not None:
+            return flight, False
+
+        flight = self.flights[key] = asyncio.get_running_loop().create_future()
+        return flight, True
+
+    async def wait(self, key: str, flight: asyncio.Future) -> Optional[CacheEntry]:
+        # a cancelled follower must not cancel the flight of the others, and nobody waits forever for a stuck leader
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight), self.timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"gave up waiting for the flight of {key}")
+            self.abandon(key, flight)
+            return None
+
+    def share(self, key: str, flight: asyncio.Future, generator: AsyncIterator[bytes], headers: dict) -> AsyncIterator[bytes]:
+        return ClosingBody(self._collect(key, flight, generator, headers), partial(self.abandon, key, flight))
+
+    def abandon(self, key: str, flight: asyncio.Future):
+        self._land(key, flight, None)
+
+    async def _collect(self, key: str, flight: asyncio.Future, generator: AsyncIterator[bytes], headers: dict) -> AsyncIterator[bytes]:
+        # hand the complete response to the followers
+        chunks, size = [], 0
+        async for chunk in generator:
+            if chunks is not None:
+                size += len(chunk)
+                if size <= self.max_bytes:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+
+            yield chunk
+
+        self._land(key, flight, CacheEntry(b"".join(chunks), dict(headers)) if chunks is not None else None)
+
+    def _land(self, key: str, flight: asyncio.Future, entry: Optional[CacheEntry]):
+        # a flight which was given up already may have been followed by a new one of the same key
+        if self.flights.get(key, None) is flight:
+            del self.flights[key]
+
+        if not flight.done():
+            flight.set_result(entry)
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    global single_flight
+    if single_flight is None:
+        config = (Config.get().get("cache", None) or {}).get("single_flight", None) or {}
+        single_flight = SingleFlight(config.get("max_size", "64MB"), config.get("timeout", 60)) if config.get("enabled", True) else False
+
+    return single_flight or None
@@ -8,8 +8,9 @@ from pyaml_env import parse_config
 class Config():
 
     app_path = path.abspath(path.dirname(__file__))
-    conf_path = os.path.join(app_path, "conf.yml")
-    env_path = os.path.join(app_path, ".env")
+    # worker processes inherit the paths given on the command line through the environment
+    conf_path = os.environ.get("FINDB_CONF_PATH", os.path.join(app_path, "conf.yml"))
+    env_path = os.environ.get("FINDB_ENV_PATH", os.path.join(app_path, ".env"))
 
     @staticmethod
     def get():
@@ -0,0 +1,102 @@
+import logging
+import re
+from time import monotonic
+from typing import Dict, Optional
+
+from serve.config import Config
+from serve.dataaccess.database import read_sql
+from serve.dataaccess.replicas import head_queries
+from serve.errors import BadRequest
+
+log = logging.getLogger(__name__)
+
+# newer dolt versions renamed hashof to dolt_hashof
+ref_queries = ["select dolt_hashof(:ref) as hash", "select hashof(:ref) as hash"]
+ref_pattern = re.compile(r"^[A-Za-z0-9_./~^-]+$")
+commit_pattern = re.compile(r"^[0-9a-v]{32}$")
+# commit hashes resolve to themselves forever, branches and tags can move
+resolved: Dict[str, str] = {}
+head = None
+head_expires = 0
+head_ttl = None
+# file of the commit published by the watcher of another worker, see `serve.watcher`
+followed: Optional[str] = None
+
+
+async def current_commit(ttl: float = None) -> Optional[str]:
+    # None if the database is not a dolt database
+    global head, head_expires, head_ttl
+    if monotonic() < head_expires:
+        return head
+
+    if ttl is None:
+        if head_ttl is None:
+            head_ttl = float((Config.get().get("dolt", None) or {}).get("head_ttl", 5))
+
+        ttl = head_ttl
+
+    # workers not watching the head only switch to a commit once the watcher prepared the caches for it
+    commit = _read_published() if followed is not None else None
+    head, head_expires = commit if commit is not None else await query_head(), monotonic() + ttl
+    return head
+
+
+async def query_head() -> Optional[str]:
+    for query in head_queries:
+        try:
+            return str((await read_sql(query))["head"].iloc[0])
+        except Exception as e:
+            log.debug(f"failed to query dolt head using {query}: {e}")
+
+    log.warning("failed to get the dolt head commit")
+    return None
+
+
+def publish(commit: str, ttl: float):
+    global head, head_expires
+    head, head_expires = commit, monotonic() + ttl
+
+
+def follow(path: Optional[str]):
+    global followed
+    followed = path
+    reset()
+
+
+def _read_published() -> Optional[str]:
+    try:
+        with open(followed) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        # nothing published yet
+        return None
+
+
+async def resolve_commit(ref: str) -> str:
+    if ref in resolved:
+        return resolved[ref]
+
+    if ref_pattern.match(ref) is None:
+        raise BadRequest(f"invalid commit {ref}")
+
+    for query in ref_queries:
+        try:
+            commit = str((await read_sql(query, {"ref": ref}))["hash"].iloc[0])
+        except Exception as e:
+            log.debug(f"failed to resolve {ref} using {query}: {e}")
+            continue
+
+        if commit_pattern.match(commit) is None:
+            break
+
+        if commit == ref:
+            resolved[ref] = commit
+
+        return commit
+
+    raise BadRequest(f"unknown commit {ref}")
+
+
+def reset():
+    global head, head_expires
+    head, head_expires = None, 0
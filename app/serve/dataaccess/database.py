@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from typing import Dict, List, Tuple
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from serve.config import Config
+from serve.dataaccess.replicas import ReplicaSet
+
+log = logging.getLogger(__name__)
+threadlock = Lock()
+
+default_url = 'mysql+pymysql://root:@localhost/findb'
+
+engine: Engine = None
+replicas: ReplicaSet = None
+executor: ThreadPoolExecutor = None
+settings: dict = {}
+table_columns: Dict[str, Tuple[str, ...]] = {}
+
+
+def init(config: dict = None) -> Engine:
+    with threadlock:
+        dispose()
+        return _create(config)
+
+
+def get_engine() -> Engine:
+    if engine is None:
+        with threadlock:
+            if engine is None:
+                _create()
+
+    return engine
+
+
+def get_executor() -> ThreadPoolExecutor:
+    if executor is None:
+        get_engine()
+
+    return executor
+
+
+def dispose():
+    global engine, replicas, executor
+    table_columns.clear()
+    if executor is not None:
+        executor.shutdown(wait=False)
+        executor = None
+
+    if replicas is not None:
+        replicas.dispose()
+        replicas = None
+
+    if engine is not None:
+        engine.dispose()
+        engine = None
+
+
+def get_settings() -> dict:
+    get_engine()
+    return settings
+
+
+def _create(config: dict = None) -> Engine:
+    global engine, replicas, executor, settings
+    config = config if config is not None else Config.get().get("database", None) or {}
+    settings = config
+    engine, pool_size = _create_engine(config.get("url", default_url), config)
+
+    # read replicas share the load of the primary, every one has a pool of its own
+    urls = [replica["url"] if isinstance(replica, dict) else replica for replica in config.get("replicas", None) or []]
+    if len(urls) > 0:
+        engines = [engine, *[_create_engine(url, config)[0] for url in urls]]
+        replicas = ReplicaSet(engines, config.get("routing", "hash"), config.get("health_check_interval", 10))
+        pool_size *= len(engines)
+
+    # never run more blocking queries at once than the pools can serve
+    threads = config.get("executor_threads", None)
+    threads = int(threads) if threads is not None else pool_size
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="dataaccess")
+
+    return engine
+
+
+def _create_engine(url: str, config: dict) -> Tuple[Engine, int]:
+    pool = config.get("pool", None) or {}
+    kwargs = {}
+    if not url.startswith("sqlite"):
+        kwargs = dict(
+            pool_size=int(pool.get("size", 8)),
+            max_overflow=int(pool.get("max_overflow", 4)),
+            pool_timeout=float(pool.get("timeout", 30)),
+            pool_recycle=int(pool.get("recycle", 3600)),
+            pool_pre_ping=True,
+        )
+
+    connect_args = {}
+    if url.startswith("mysql"):
+        connect_args = dict(
+            connect_timeout=int(config.get("connect_timeout", 10)),
+            read_timeout=int(config.get("read_timeout", 300)),
+        )
+
+    created = create_engine(url, connect_args=connect_args, **kwargs)
+    log.info(f"created connection pool for {created.url} {kwargs}")
+    return created, kwargs.get("pool_size", 8) + kwargs.get("max_overflow", 0)
+
+
+async def read_sql(query: str, params: dict = None, key: str = None, commit: str = None) -> pd.DataFrame:
+    # pandas and the db driver are blocking, run them on the executor so the event loop stays responsive.
+    # with read replicas the key, i.e. a symbol, selects the replica, replicas behind the commit are avoided
+    return await run(_read_sql, query, params, key, commit)
+
+
+async def get_columns(table: str) -> Tuple[str, ...]:
+    if table not in table_columns:
+        table_columns[table] = tuple((await read_sql(f"select * from {table} where 1=0")).columns)
+
+    return table_columns[table]
+
+
+def partition(symbols: List[str]) -> List[List[str]]:
+    return replicas.partition(symbols) if replicas is not None else [symbols]
+
+
+def replicated() -> bool:
+    return replicas is not None
+
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
+
+
+def _read_sql(query: str, params: dict = None, key: str = None, commit: str = None) -> pd.DataFrame:
+    if replicas is not None:
+        return replicas.read_sql(query, params, key, commit)
+
+    with get_engine().connect() as connection:
+        return pd.read_sql(text(query), connection, params=params)
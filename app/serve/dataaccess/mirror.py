@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from threading import Lock
+from time import time
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+from serve.dataaccess.commit import current_commit
+from serve.dataaccess.database import get_engine, get_settings
+from serve.dataaccess.resample import duckdb_resample
+from serve.dataaccess.selection import Selection, key_columns
+
+log = logging.getLogger(__name__)
+threadlock = Lock()
+
+mirrors: Dict[str, 'ParquetMirror'] = {}
+refreshing: Dict[str, asyncio.Future] = {}
+# exports are heavy, never run more than one at a time
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mirror")
+
+
+# every commit is exported into its own directory, `CURRENT` points to the last complete one
+class ParquetMirror(object):
+    def __init__(self, path, table, export_chunk_rows=1000000) -> None:
+        super().__init__()
+        self.path = os.path.join(path, table)
+        self.table = table
+        self.export_chunk_rows = int(export_chunk_rows)
+        self.connection = duckdb.connect()
+        self.commit = self._read_current()
+        self.failed = None
+
+    def is_current(self, commit) -> bool:
+        return commit is not None and commit == self.commit
+
+    def export(self, commit):
+        lock = os.path.join(self.path, ".export.lock")
+        if not self._lock(lock):
+            log.info(f"{self.table} is exported by another process")
+            return
+
+        try:
+            # another process might have exported the commit in the meantime
+            if self._read_current() == commit:
+                self.commit = commit
+                return
+
+            target = os.path.join(self.path, commit)
+            tmp = target + ".tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            started = time()
+            log.info(f"export {self.table} at commit {commit} to {target}")
+
+            partitioning = ds.HivePartitioning(pa.schema([("symbol_key", pa.string()), ("year", pa.int32())]), segment_encoding="none")
+            schema = None
+            with get_engine().connect().execution_options(stream_results=True) as connection:
+                for i, df in enumerate(pd.read_sql(text(f"select * from {self._snapshot(commit)} order by symbol, epoch"), connection, chunksize=self.export_chunk_rows)):
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    schema = schema if schema is not None else table.schema
+                    table = table.append_column(
+                        "symbol_key", pa.array(df["symbol"].map(lambda s: quote(str(s), safe='')), pa.string())
+                    ).append_column(
+                        "year", pa.array(pd.to_datetime(df["epoch"], unit="s").dt.year.values, pa.int32())
+                    )
+
+                    ds.write_dataset(
+                        table, tmp, format="parquet", partitioning=partitioning, basename_template=f"part-{i}-{{i}}.parquet",
+                        existing_data_behavior="overwrite_or_ignore", max_partitions=1 << 30, max_open_files=1024
+                    )
+
+            # keep an empty file with the schema of the table to answer queries without matching symbols
+            os.makedirs(tmp, exist_ok=True)
+            if schema is None:
+                schema = pa.Table.from_pandas(pd.read_sql(text(f"select * from {self._snapshot(commit)} where 1=0"), get_engine())).schema
+
+            pq.write_table(schema.empty_table(), os.path.join(tmp, "_schema.parquet"))
+
+            os.replace(tmp, target)
+            self._write_current(commit)
+            self.commit = commit
+            log.info(f"exported {self.table} at commit {commit} in {time() - started:.1f}s")
+
+            # keep the previous export for queries which might still be running
+            exports = [d for d in glob(os.path.join(self.path, "*")) if os.path.isdir(d) and not d.endswith(".tmp")]
+            for old in sorted(exports, key=os.path.getmtime)[:-2]:
+                shutil.rmtree(old, ignore_errors=True)
+        except Exception as e:
+            log.error(f"failed to export {self.table} at commit {commit}", exc_info=e)
+            self.failed = commit
+        finally:
+            os.unlink(lock)
+
+    def query(self, symbols: List[str], selection: Selection = Selection()) -> pd.DataFrame:
+        path = os.path.join(self.path, self.commit)
+        files = [f for symbol in symbols for f in glob(os.path.join(path, f"symbol_key={quote(symbol, safe='')}", "*", "*.parquet"))]
+        if len(files) <= 0:
+            return pd.read_parquet(os.path.join(path, "_schema.parquet"), columns=selection.columns and list(dict.fromkeys([*key_columns, *selection.columns])))
+
+        # the year partition and the parquet statistics let duckdb skip whatever the predicate does not need
+        relation = "read_parquet($files, hive_partitioning = true, hive_types = {'year': int}, union_by_name = true)"
+        predicate, params = selection.duckdb_predicate()
+        params["files"] = files
+
+        if selection.freq is not None:
+            columns = selection.columns or pq.read_schema(os.path.join(path, "_schema.parquet")).names
+            return self.connection.cursor().execute(duckdb_resample(relation, predicate, selection.freq, columns), params).df()
+
+        columns = "* exclude (symbol_key, year)" if selection.columns is None else selection.sql_columns()
+        return self.connection.cursor().execute(
+            f"select {columns} from {relation} where {predicate} order by symbol, epoch",
+            params
+        ).df()
+
+    def _snapshot(self, commit) -> str:
+        # the head may move on during the export, the files must hold the commit they are labelled with
+        return Selection(as_of=commit).sql_table(self.table)
+
+    def _read_current(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.path, "CURRENT")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _write_current(self, commit):
+        with open(os.path.join(self.path, "CURRENT.tmp"), "w") as f:
+            f.write(commit)
+
+        os.replace(os.path.join(self.path, "CURRENT.tmp"), os.path.join(self.path, "CURRENT"))
+
+    def _lock(self, lock, stale_after=3600) -> bool:
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(lock) and os.path.getmtime(lock) < time() - stale_after:
+            log.warning(f"remove stale lock {lock}")
+            os.unlink(lock)
+
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL))
+            return True
+        except FileExistsError:
+            return False
+
+
+async def get_mirror(table) -> Optional[ParquetMirror]:
+    # None until the mirror is at the current commit
+    settings = get_settings()
+    config = settings.get("mirror", None) or {}
+    if settings.get("backend", "sql") != "duckdb" or table not in config.get("tables", ["yfinance_quote"]):
+        return None
+
+    with threadlock:
+        if table not in mirrors:
+            mirrors[table] = ParquetMirror(config.get("path", "mirror"), table, config.get("export_chunk_rows", 1000000))
+
+    mirror = mirrors[table]
+    commit = await current_commit()
+    if mirror.is_current(commit):
+        return mirror
+
+    # queries use the sql backend until the new commit is exported
+    if commit is not None and commit != mirror.failed and (table not in refreshing or refreshing[table].done()):
+        refreshing[table] = asyncio.get_running_loop().run_in_executor(executor, mirror.export, commit)
+
+    return None
@@ -1,43 +1,148 @@
 import logging
-from datetime import datetime
-from typing import Dict
+from typing import AsyncIterator, Dict, List
 
 import asyncio
 import pandas as pd
 import pytz
 
+from serve.dataaccess.commit import current_commit
+from serve.dataaccess.database import get_columns, read_sql, get_settings, partition, replicated, run
+from serve.dataaccess.mirror import get_mirror
+from serve.dataaccess.panel import build_panel, pivot_panel
+from serve.dataaccess.resample import resample
+from serve.dataaccess.selection import Selection
+from serve.dataaccess.timeindex import to_datetime_index
+from serve.metrics import phase
+
 log = logging.getLogger(__name__)
 
 
-async def fetch_ohlcv(symbols: Dict[str, list], where=None, axis=1) -> pd.DataFrame:
-    log.info(f"fetch data for symbols: {symbols} where: {where}")
-    tasks, index_symbols = zip(*[(_fetch(source, symbol, where), symbol) for source, src_symbols in symbols.items() for symbol in src_symbols])
-    frames = await asyncio.gather(*tasks)
+async def fetch_ohlcv(
+        symbols: Dict[str, list], where=None, axis=1, freq=None, columns=None, start=None, end=None, layout="wide", pivot=None,
+        as_of=None
+) -> pd.DataFrame:
+    selection = Selection(where if where is not None else "1=1", columns, start, end, freq, as_of)
+    await check_columns(symbols.keys(), columns)
+    log.info(f"fetch data for symbols: {symbols} {selection}")
+    sources = list(symbols.items())
+    results = await asyncio.gather(*[_fetch(source, src_symbols, selection) for source, src_symbols in sources])
+    index_symbols, frames = zip(*[(symbol, result[symbol]) for (_, src_symbols), result in zip(sources, results) for symbol in src_symbols])
+
+    # long panels and pivots of a single column avoid the sparse outer join of many symbols
+    if pivot is not None:
+        with phase("transform"):
+            return pivot_panel(list(zip(index_symbols, frames)), pivot)
+
+    if layout == "long":
+        with phase("transform"):
+            return build_panel(list(zip(index_symbols, frames)))
+
     if len(frames) > 1:
-        return pd.concat([frame for frame in frames], join='outer', axis=axis, keys=index_symbols)
+        with phase("transform"):
+            return pd.concat([frame for frame in frames], join='outer', axis=axis, keys=index_symbols)
     else:
         return frames[0]
 
 
-async def _fetch(source, symbol, where):
-    df = pd.read_sql(
-        f"select * from {source}_quote where symbol='{symbol.upper()}' and {where} order by epoch",
-        'mysql+pymysql://root:@localhost/findb'
-    )
+async def stream_ohlcv(
+        symbols: Dict[str, list], where=None, freq=None, columns=None, start=None, end=None, as_of=None
+) -> AsyncIterator[pd.DataFrame]:
+    # the next chunk is queried while the current one is sent, so the memory is bounded by two chunks
+    selection = Selection(where if where is not None else "1=1", columns, start, end, freq, as_of)
+    chunk_size = int(get_settings().get("max_symbols_per_query", 500))
+    chunks = []
+    for source, src_symbols in symbols.items():
+        query_symbols = list(dict.fromkeys(symbol.upper() for symbol in src_symbols))
+        chunks.extend((source, chunk) for chunk in _chunks(query_symbols, chunk_size))
+
+    log.info(f"stream data for {sum(len(chunk) for _, chunk in chunks)} symbols in {len(chunks)} chunks {selection}")
+    pending = None
+    try:
+        for i, (source, chunk) in enumerate(chunks):
+            query = pending if pending is not None else asyncio.ensure_future(_query(source, chunk, selection))
+            pending = asyncio.ensure_future(_query(*chunks[i + 1], selection)) if i + 1 < len(chunks) else None
+            df = await query
+
+            with phase("transform"):
+                df = _long_frame(source, df, selection)
+
+            yield df
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def check_columns(sources, columns):
+    if columns is not None:
+        for source in sources:
+            Selection(columns=columns).check_columns(await get_columns(f"{source}_quote"))
+
+
+async def _fetch(source, symbols: List[str], selection: Selection) -> Dict[str, pd.DataFrame]:
+    # one query per chunk of symbols instead of one round trip per symbol
+    chunk_size = int(get_settings().get("max_symbols_per_query", 500))
+    query_symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+    chunks = _chunks(query_symbols, chunk_size)
+    frames = await asyncio.gather(*[_query(source, chunk, selection) for chunk in chunks])
 
-    def get_tz(tzinfo_str):
-        try:
-            return pytz.timezone(tzinfo_str)
-        except Exception:
-            return None
+    with phase("transform"):
+        df = pd.concat(frames) if len(frames) > 1 else frames[0]
 
-    if len(df) > 0:
-        df.index = pd.DatetimeIndex(
-            df[["epoch", "tzinfo"]]\
-                .apply(lambda x: datetime.fromtimestamp(x["epoch"], get_tz(x["tzinfo"])), axis=1).rename("time")
+        # split the result set back into one frame per requested symbol
+        groups = {symbol: frame for symbol, frame in df.groupby("symbol", sort=False)}
+        for symbol, frame in groups.items():
+            frame.index = to_datetime_index(frame["epoch"], frame["tzinfo"] if "tzinfo" in frame else None)
+            groups[symbol] = selection.project(frame)
+
+    empty = selection.project(df.iloc[0:0])
+    empty.index = pd.DatetimeIndex([], name="time", tz=pytz.timezone('UTC'))
+
+    return {symbol: groups.get(symbol.upper(), empty) for symbol in symbols}
+
+
+async def _query(source, symbols: List[str], selection: Selection) -> pd.DataFrame:
+    # the duckdb backend filters and aggregates bars within the query, otherwise pandas does the rest.
+    # the mirror only holds the head commit, older commits are always read from dolt
+    mirror = await get_mirror(f"{source}_quote") if selection.as_of is None else None
+    if mirror is not None:
+        with phase("db"):
+            return await run(mirror.query, symbols, selection)
+
+    predicate, params = selection.sql_predicate()
+    params.update({f"symbol{i}": symbol for i, symbol in enumerate(symbols)})
+    # the head is read from replicas at the commit the response is cached for, not from those still replicating it
+    commit = await current_commit() if selection.as_of is None and replicated() else None
+    with phase("db"):
+        df = await read_sql(
+            f"select {selection.sql_columns()} from {selection.sql_table(f'{source}_quote')}"
+            f" where symbol in ({', '.join(f':symbol{i}' for i in range(len(symbols)))}) and {predicate} order by symbol, epoch",
+            params,
+            symbols[0],
+            commit
         )
-    else:
-        df.index = pd.DatetimeIndex([], name="time", tz=pytz.timezone('UTC'))
 
-    return df
+    with phase("transform"):
+        df = selection.filter_range(df)
+        return await run(resample, df, selection.freq) if selection.freq is not None else df
+
+
+def _chunks(symbols: List[str], chunk_size: int) -> List[List[str]]:
+    # the symbols of a chunk are routed to the same replica, a chunk is routed by its first symbol
+    return [group[i:i + chunk_size] for group in partition(symbols) for i in range(0, len(group), chunk_size)]
+
+
+def _long_frame(source, df: pd.DataFrame, selection: Selection) -> pd.DataFrame:
+    # numbers are floats and texts are nullable strings, so every chunk of a stream has the same schema
+    columns = [c for c in (selection.columns or df.columns) if c in df.columns and c not in ("symbol", "source")]
+    long = pd.DataFrame({"source": pd.Series(source, index=df.index, dtype="string"), "symbol": df["symbol"].astype("string")})
+    for column in columns:
+        if column == "epoch":
+            long[column] = df[column].astype("int64")
+        elif column == "tzinfo" or not (pd.api.types.is_numeric_dtype(df[column]) or df[column].isna().all()):
+            long[column] = df[column].astype("string")
+        else:
+            long[column] = df[column].astype("float64")
 
+    # symbols of many exchanges share the stream, the time is always UTC
+    long.index = to_datetime_index(df["epoch"])
+    return long
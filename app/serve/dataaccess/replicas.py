@@ -0,0 +1,152 @@
+import bisect
+import hashlib
+import logging
+from threading import Event, Lock, Thread
+from typing import List, Optional
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+
+log = logging.getLogger(__name__)
+
+routings = ("hash", "least_loaded")
+# newer dolt versions renamed hashof to dolt_hashof
+head_queries = ["select dolt_hashof('HEAD') as head", "select hashof('HEAD') as head"]
+
+
+class Replica(object):
+
+    def __init__(self, engine: Engine) -> None:
+        super().__init__()
+        self.engine = engine
+        self.healthy = True
+        self.active = 0
+        # the dolt HEAD as of the last health check, None if unknown
+        self.head = None
+
+    def __repr__(self) -> str:
+        return f"Replica({self.engine.url!r}, healthy={self.healthy}, active={self.active}, head={self.head})"
+
+
+# the first replica is the primary, it answers queries without a routing key and is always up to date
+class ReplicaSet(object):
+    def __init__(self, engines: List[Engine], routing="hash", check_interval=10, virtual_nodes=64) -> None:
+        super().__init__()
+        if routing not in routings:
+            raise ValueError(f"unsupported routing {routing}, use one of {', '.join(routings)}")
+
+        self.replicas = [Replica(engine) for engine in engines]
+        self.routing = routing
+        self.check_interval = float(check_interval)
+        self.lock = Lock()
+        self.stopped = Event()
+
+        # every replica owns many points of the ring, so removing one spreads its keys over all the others
+        self.ring = sorted((_hash(f"{replica.engine.url}#{i}"), r) for r, replica in enumerate(self.replicas) for i in range(virtual_nodes))
+        self.ring_keys = [h for h, _ in self.ring]
+
+        self.checker = Thread(target=self._check_periodically, name="replica-health", daemon=True)
+        self.checker.start()
+
+    def route(self, key: str = None, commit: str = None) -> List[Replica]:
+        if key is None:
+            ordered = self.replicas
+        elif self.routing == "least_loaded":
+            ordered = sorted(self.replicas, key=lambda replica: replica.active)
+        else:
+            # walk the ring clockwise from the key, the replicas met first are preferred
+            start, ordered = bisect.bisect(self.ring_keys, _hash(key)), {}
+            for i in range(len(self.ring)):
+                ordered.setdefault(self.ring[(start + i) % len(self.ring)][1], None)
+                if len(ordered) >= len(self.replicas):
+                    break
+
+            ordered = [self.replicas[r] for r in ordered]
+
+        def lagging(replica: Replica) -> bool:
+            return commit is not None and replica is not self.replicas[0] and replica.head != commit
+
+        return sorted(ordered, key=lambda replica: (lagging(replica), not replica.healthy))
+
+    def partition(self, keys: List[str]) -> List[List[str]]:
+        if self.routing != "hash":
+            return [keys]
+
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.ring[bisect.bisect(self.ring_keys, _hash(key)) % len(self.ring)][1], []).append(key)
+
+        return list(groups.values())
+
+    def read_sql(self, query: str, params: dict = None, key: str = None, commit: str = None) -> pd.DataFrame:
+        error = None
+        for replica in self.route(key, commit):
+            with self.lock:
+                replica.active += 1
+
+            try:
+                with replica.engine.connect() as connection:
+                    return pd.read_sql(text(query), connection, params=params)
+            except DBAPIError as e:
+                # only lost connections fail over, a broken query fails on every replica
+                if not e.connection_invalidated and not _connect_failed(e):
+                    raise
+
+                log.warning(f"replica {replica.engine.url!r} failed, trying the next one: {e}")
+                replica.healthy = False
+                error = e
+            finally:
+                with self.lock:
+                    replica.active -= 1
+
+        raise error
+
+    def check(self):
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    connection.execute(text("select 1"))
+                    replica.head = _query_head(connection)
+
+                if not replica.healthy:
+                    log.info(f"replica {replica.engine.url!r} is back up")
+
+                replica.healthy = True
+            except Exception as e:
+                if replica.healthy:
+                    log.warning(f"replica {replica.engine.url!r} is down: {e}")
+
+                replica.healthy = False
+
+    def dispose(self):
+        self.stopped.set()
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def _check_periodically(self):
+        # the heads of the replicas are unknown until the first check, until then queries of a commit go to the primary
+        self.check()
+        while not self.stopped.wait(self.check_interval):
+            self.check()
+
+
+def _query_head(connection) -> Optional[str]:
+    for query in head_queries:
+        try:
+            return str(connection.execute(text(query)).scalar())
+        except DBAPIError:
+            connection.rollback()
+
+    return None
+
+
+def _connect_failed(error: DBAPIError) -> bool:
+    # errors raised while connecting are not bound to a statement
+    return error.statement is None
+
+
+def _hash(key: str) -> int:
+    # stable across processes, unlike hash()
+    return int.from_bytes(hashlib.md5(key.encode("UTF-8")).digest()[:8], "big")
@@ -0,0 +1,79 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from serve.dataaccess.timeindex import get_tz, local_time
+from serve.errors import BadRequest
+
+# bars are labeled by the local start of their period: weeks start on monday, n day bars are counted from 1970-01-01
+freq_pattern = re.compile(r"^(W|M|Q|([1-9][0-9]*)D)$")
+periods = {"W": "W", "M": "M", "Q": "Q"}
+duckdb_periods = {"W": "week", "M": "month", "Q": "quarter"}
+
+
+def parse_freq(freq):
+    if freq is None or freq == "":
+        return None
+
+    freq = freq.upper()
+    if freq_pattern.match(freq) is None:
+        raise BadRequest(f"unsupported frequency {freq}, use one of W, M, Q or <n>D")
+
+    return freq
+
+
+def resample(df: pd.DataFrame, freq) -> pd.DataFrame:
+    if len(df) <= 0:
+        return df
+
+    # the bar of every row in the local time of its exchange
+    local = pd.DatetimeIndex(local_time(df["epoch"], df["tzinfo"] if "tzinfo" in df else None))
+    bars = (local.floor(freq) if freq.endswith("D") else local.to_period(periods[freq]).start_time).values.astype("datetime64[ns]")
+
+    aggregations = {"o": "first", "h": "max", "l": "min", "c": "last", "v": "sum", "dividend": "sum", "tzinfo": "first"}
+    columns = [c for c in df.columns if c not in ("symbol", "epoch")]
+    df = df[columns].assign(
+        # splits of 0 mean there was no split, multiply the actual splits of the period
+        **({"split": df["split"].replace(0, 1).fillna(1)} if "split" in df else {})
+    ).groupby([df["symbol"].values, bars], sort=False).agg(
+        {c: aggregations.get(c, "prod" if c == "split" else "last") for c in columns}
+    )
+
+    if "split" in df:
+        df["split"] = df["split"].replace(1, 0)
+
+    # the epoch of a bar is the local start of its period
+    df.index.names = ["symbol", "bar"]
+    df = df.reset_index()
+    epoch = np.empty(len(df), dtype="int64")
+    zones = df["tzinfo"].fillna("UTC") if "tzinfo" in df else pd.Series("UTC", index=df.index)
+    for tz in zones.unique():
+        rows = (zones == tz).values
+        start = pd.DatetimeIndex(df["bar"].values[rows]).tz_localize(get_tz(tz) or "UTC", ambiguous=False, nonexistent="shift_forward")
+        epoch[rows] = start.as_unit("s").asi8
+
+    df.insert(1, "epoch", epoch)
+    return df.drop(columns=["bar"])
+
+
+def duckdb_resample(relation, where, freq, columns) -> str:
+    local = "timezone(coalesce(tzinfo, 'UTC'), to_timestamp(epoch))"
+    bar = f"time_bucket(interval '{freq[:-1]} days', {local}, timestamp '1970-01-01')" if freq.endswith("D") else \
+        f"date_trunc('{duckdb_periods[freq]}', {local})"
+
+    aggregations = {
+        "o": "arg_min(o, epoch)", "h": "max(h)", "l": "min(l)", "c": "arg_max(c, epoch)", "v": "sum(v)", "dividend": "sum(dividend)",
+        "split": "coalesce(nullif(product(case when split is null or split = 0 then 1 else split end), 1), 0)",
+        "tzinfo": "first(tzinfo)",
+    }
+    columns = [c for c in columns if c not in ("symbol", "epoch")]
+
+    return f"""
+        select symbol,
+               cast(epoch(timezone(coalesce(first(tzinfo), 'UTC'), bar)) as bigint) as epoch,
+               {", ".join(f"{aggregations.get(c, f'arg_max({c}, epoch)')} as {c}" for c in columns)}
+          from (select *, {bar} as bar from {relation} where {where})
+         group by symbol, bar
+         order by symbol, bar
+    """
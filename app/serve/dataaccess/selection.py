@@ -0,0 +1,127 @@
+import re
+from typing import NamedTuple, Tuple
+
+import pandas as pd
+
+from serve.dataaccess.commit import commit_pattern
+from serve.dataaccess.timeindex import local_time
+from serve.errors import BadRequest
+
+column_pattern = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# columns needed to split the result by symbol and to build the time index
+key_columns = ("symbol", "epoch", "tzinfo")
+# epochs are stored in the local time of the exchange, which is never more than a day away from UTC
+max_tz_offset = 86400
+
+
+class Selection(NamedTuple):
+    where: str = "1=1"
+    columns: Tuple[str, ...] = None
+    start: pd.Timestamp = None
+    end: pd.Timestamp = None
+    freq: str = None
+    # commit hash of a dolt commit to read instead of the working head
+    as_of: str = None
+
+    @property
+    def has_range(self) -> bool:
+        return self.start is not None or self.end is not None
+
+    def sql_columns(self) -> str:
+        return "*" if self.columns is None else ", ".join(dict.fromkeys([*key_columns, *self.columns]))
+
+    def sql_table(self, table) -> str:
+        if self.as_of is not None and commit_pattern.match(self.as_of) is None:
+            raise BadRequest(f"invalid commit {self.as_of}")
+
+        return table if self.as_of is None else f"{table} as of '{self.as_of}'"
+
+    def sql_predicate(self) -> Tuple[str, dict]:
+        # colons of the where clause are no bind parameters of the sqlalchemy `text` the query is run as
+        return self._predicate(self.where.replace(":", "\\:"))
+
+    def _predicate(self, where: str) -> Tuple[str, dict]:
+        # the epoch range is widened by the maximum timezone offset so it can use the (symbol, epoch) key,
+        # the exact local range is applied by `filter_range`
+        predicates, params = [f"({where})"], {}
+        if self.start is not None:
+            predicates.append("epoch >= :epoch_from")
+            params["epoch_from"] = _epoch(self.start) - max_tz_offset
+
+        if self.end is not None:
+            predicates.append("epoch <= :epoch_to")
+            params["epoch_to"] = _epoch(self.end) + max_tz_offset
+
+        return " and ".join(predicates), params
+
+    def duckdb_predicate(self) -> Tuple[str, dict]:
+        # duckdb compares the exact local time, the widened epoch range still prunes row groups
+        predicate, params = self._predicate(self.where)
+        local = "timezone(coalesce(tzinfo, 'UTC'), to_timestamp(epoch))"
+        if self.start is not None:
+            predicate += f" and {local} >= $local_from"
+            params["local_from"] = self.start.to_pydatetime()
+
+        if self.end is not None:
+            predicate += f" and {local} <= $local_to"
+            params["local_to"] = self.end.to_pydatetime()
+
+        return predicate.replace(":epoch_", "$epoch_"), params
+
+    def filter_range(self, df: pd.DataFrame) -> pd.DataFrame:
+        if not self.has_range or len(df) <= 0:
+            return df
+
+        local = local_time(df["epoch"], df["tzinfo"] if "tzinfo" in df else None)
+        mask = (local >= self.start.to_datetime64()) if self.start is not None else True
+        mask = mask & (local <= self.end.to_datetime64()) if self.end is not None else mask
+        return df[mask]
+
+    def check_columns(self, table_columns):
+        for column in self.columns or ():
+            if column not in table_columns:
+                raise BadRequest(f"unknown column {column}")
+
+    def project(self, df: pd.DataFrame) -> pd.DataFrame:
+        return df if self.columns is None else df[[c for c in self.columns if c in df.columns]]
+
+
+def parse_columns(columns):
+    if columns is None or columns == "":
+        return None
+
+    columns = tuple(c.strip() for c in columns.split(","))
+    for column in columns:
+        if column_pattern.match(column) is None:
+            raise BadRequest(f"invalid column {column}")
+
+    return columns
+
+
+def parse_date(date, end=False):
+    if date is None or date == "":
+        return None
+
+    try:
+        timestamp = pd.Timestamp(date)
+    except ValueError:
+        raise BadRequest(f"invalid date {date}")
+
+    if timestamp.tz is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+
+    if end:
+        # the period has the resolution of the date, e.g. 2022-01 ends with the last second of january
+        try:
+            period = pd.Period(timestamp, freq=pd.Period(date.strip()).freq)
+        except ValueError:
+            period = None
+
+        if period is not None and period.end_time - period.start_time >= pd.Timedelta(days=1) - pd.Timedelta(microseconds=1):
+            timestamp = period.end_time.floor("s")
+
+    return timestamp
+
+
+def _epoch(timestamp: pd.Timestamp) -> int:
+    return int(timestamp.tz_localize("UTC").timestamp())
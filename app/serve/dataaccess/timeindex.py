@@ -0,0 +1,33 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pytz
+
+
+def to_datetime_index(epoch: pd.Series, tzinfo: pd.Series = None) -> pd.DatetimeIndex:
+    # vectorized conversion, the index is localized to the timezone of the symbol or stays in UTC
+    # if the timezone is unknown or ambiguous
+    index = pd.DatetimeIndex(pd.to_datetime(epoch.values, unit="s", utc=True), name="time")
+    zones = tzinfo.dropna().unique() if tzinfo is not None else []
+    tz = get_tz(zones[0]) if len(zones) == 1 else None
+    return index.tz_convert(tz) if tz is not None else index
+
+
+@lru_cache(maxsize=None)
+def get_tz(tzinfo_str):
+    try:
+        return pytz.timezone(tzinfo_str)
+    except Exception:
+        return None
+
+
+def local_time(epoch: pd.Series, tzinfo: pd.Series = None) -> np.ndarray:
+    zones = tzinfo.fillna("UTC").values if tzinfo is not None else np.full(len(epoch), "UTC", dtype=object)
+    local = np.empty(len(epoch), dtype="datetime64[ns]")
+    for tz in pd.unique(zones):
+        rows = zones == tz
+        index = pd.DatetimeIndex(pd.to_datetime(epoch.values[rows], unit="s", utc=True)).tz_convert(get_tz(tz) or "UTC")
+        local[rows] = index.tz_localize(None).values.astype("datetime64[ns]")
+
+    return local
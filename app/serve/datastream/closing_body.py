@@ -0,0 +1,49 @@
+from typing import AsyncIterator, Callable, Optional
+
+
+# unlike the finally of an async generator `on_close` also runs if quart closes a body it never started
+class ClosingBody(object):
+    def __init__(self, body: AsyncIterator[bytes], on_close: Callable[[], None], on_chunk: Optional[Callable[[bytes], None]] = None) -> None:
+        super().__init__()
+        self.body = body
+        self.iterator = None
+        self.on_close = on_close
+        self.on_chunk = on_chunk
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self.closed:
+            raise StopAsyncIteration
+
+        if self.iterator is None:
+            self.iterator = self.body.__aiter__()
+
+        try:
+            chunk = await self.iterator.__anext__()
+        except BaseException:
+            self._close()
+            raise
+
+        if self.on_chunk is not None:
+            self.on_chunk(chunk)
+
+        return chunk
+
+    async def aclose(self):
+        try:
+            if hasattr(self.body, "aclose"):
+                await self.body.aclose()
+        finally:
+            self._close()
+
+    def _close(self):
+        if not self.closed:
+            self.closed = True
+            self.on_close()
+
+    def __del__(self):
+        # bodies dropped without being closed
+        self._close()
@@ -1,21 +1,87 @@
 import logging
-import mimetypes
-from tempfile import TemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
 
+import asyncio
 import pandas as pd
 
+from serve.config import Config
+from serve.datastream.writers import make_writer, StreamWriter
+from serve.metrics import current, phase, RequestMetrics
+
 log = logging.getLogger(__name__)
+executor: ThreadPoolExecutor = None
+settings: dict = None
 
 
 def make_pandas_response(df: pd.DataFrame, result_type, **kwargs):
-    async def generator():
-        with TemporaryFile() as tmp:
-            result = getattr(df, f"to_{result_type}")(tmp, **kwargs)
-            tmp.seek(0)
-            yield tmp.read()
+    writer = make_writer(result_type, df, **kwargs)
+
+    async def frames():
+        yield df
+
+    return (
+        _serialize(writer, frames(), current.get()),
+        200,
+        {'Content-Type': writer.content_type, 'Pandas-Version': pd.__version__}
+    )
+
+
+def make_pandas_stream_response(frames: AsyncIterator[pd.DataFrame], result_type, **kwargs):
+    writer = make_writer(result_type, None, **kwargs)
 
     return (
-        generator(),
+        _serialize(writer, frames, current.get()),
         200,
-        {'Content-Type': mimetypes.guess_type(f'test.{result_type}')[0], 'Pandas-Version': pd.__version__}
+        {'Content-Type': writer.content_type, 'Pandas-Version': pd.__version__}
     )
+
+
+async def _serialize(writer: StreamWriter, frames: AsyncIterator[pd.DataFrame], metrics: RequestMetrics) -> AsyncIterator[bytes]:
+    # serialize chunk by chunk on the executor, the first bytes are sent while the rest is still serialized
+    chunk_rows = int(get_settings().get("chunk_rows", 50000))
+    loop = asyncio.get_running_loop()
+    written, empty = False, None
+
+    async for df in frames:
+        # empty frames could lack the types of the columns, they are only written if there is nothing else
+        if len(df) <= 0:
+            empty = df if empty is None else empty
+            continue
+
+        for i in range(0, len(df), chunk_rows):
+            with phase("serialize", metrics):
+                data = await loop.run_in_executor(get_executor(), writer.write, df.iloc[i:i + chunk_rows])
+
+            written = True
+            if len(data) > 0:
+                yield data
+
+    if not written and empty is not None:
+        with phase("serialize", metrics):
+            data = await loop.run_in_executor(get_executor(), writer.write, empty)
+
+        if len(data) > 0:
+            yield data
+
+    with phase("serialize", metrics):
+        data = await loop.run_in_executor(get_executor(), writer.close)
+
+    if len(data) > 0:
+        yield data
+
+
+def get_settings() -> dict:
+    global settings
+    if settings is None:
+        settings = Config.get().get("datastream", None) or {}
+
+    return settings
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=int(get_settings().get("executor_threads", 4)), thread_name_prefix="datastream")
+
+    return executor
@@ -0,0 +1,184 @@
+import io
+import logging
+import mimetypes
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from serve.errors import BadRequest
+
+log = logging.getLogger(__name__)
+
+
+class StreamSink(io.RawIOBase):
+    def __init__(self) -> None:
+        super().__init__()
+        self.buffer = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buffer.append(bytes(b))
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class StreamWriter(object):
+    content_type = 'application/octet-stream'
+
+    def __init__(self, sample: pd.DataFrame = None, **kwargs) -> None:
+        super().__init__()
+        self.sample = sample
+        self.kwargs = kwargs
+
+    def write(self, df: pd.DataFrame) -> bytes:
+        raise NotImplementedError()
+
+    def close(self) -> bytes:
+        return b""
+
+
+class CsvWriter(StreamWriter):
+
+    content_type = 'text/csv'
+
+    def __init__(self, sample: pd.DataFrame = None, **kwargs) -> None:
+        super().__init__(sample, **kwargs)
+        self.header = True
+
+    def write(self, df: pd.DataFrame) -> bytes:
+        data = df.to_csv(header=self.header, **self.kwargs).encode("UTF-8")
+        self.header = False
+        return data
+
+
+class JsonLinesWriter(StreamWriter):
+
+    content_type = 'application/x-ndjson'
+
+    def write(self, df: pd.DataFrame) -> bytes:
+        if len(df) <= 0:
+            return b""
+
+        data = df.reset_index().to_json(orient="records", lines=True, date_format="iso", **self.kwargs)
+        return (data.rstrip("\n") + "\n").encode("UTF-8")
+
+
+class ParquetWriter(StreamWriter):
+
+    content_type = 'application/vnd.apache.parquet'
+
+    def __init__(self, sample: pd.DataFrame = None, **kwargs) -> None:
+        super().__init__(sample, **kwargs)
+        self.sink = StreamSink()
+        self.schema = pa.Schema.from_pandas(sample, preserve_index=True) if sample is not None else None
+        self.writer = None
+
+    def write(self, df: pd.DataFrame) -> bytes:
+        # every chunk becomes its own row group
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        if self.schema is not None and not table.schema.equals(self.schema):
+            table = table.cast(self.schema)
+
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = pq.ParquetWriter(self.sink, self.schema, compression=self.kwargs.get("compression", "snappy"))
+
+        self.writer.write_table(table)
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        if self.writer is not None:
+            self.writer.close()
+
+        return self.sink.drain()
+
+
+class ArrowWriter(StreamWriter):
+    content_type = 'application/vnd.apache.arrow.stream'
+
+    def __init__(self, sample: pd.DataFrame = None, **kwargs) -> None:
+        super().__init__(sample, **kwargs)
+        self.sink = StreamSink()
+        self.schema = pa.Schema.from_pandas(sample, preserve_index=True) if sample is not None else None
+        self.writer = None
+
+    def write(self, df: pd.DataFrame) -> bytes:
+        # numeric columns are handed over to arrow without copying
+        batch = pa.RecordBatch.from_pandas(df, preserve_index=True)
+        if self.schema is not None and not batch.schema.equals(self.schema):
+            batch = batch.cast(self.schema)
+
+        if self.writer is None:
+            self.schema = batch.schema
+            self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+        self.writer.write_batch(batch)
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        if self.writer is not None:
+            self.writer.close()
+
+        return self.sink.drain()
+
+
+class BufferedWriter(StreamWriter):
+    def __init__(self, result_type, sample: pd.DataFrame = None, **kwargs) -> None:
+        super().__init__(sample, **kwargs)
+        self.result_type = result_type
+        self.content_type = mimetypes.guess_type(f'test.{result_type}')[0] or self.content_type
+        self.frames = []
+
+    def write(self, df: pd.DataFrame) -> bytes:
+        self.frames.append(df)
+        return b""
+
+    def close(self) -> bytes:
+        if len(self.frames) <= 0:
+            # an empty stream is written as the empty sample or an empty frame
+            df = self.sample.iloc[0:0] if self.sample is not None else pd.DataFrame()
+        else:
+            df = pd.concat(self.frames) if len(self.frames) != 1 else self.frames[0]
+
+        self.frames.clear()
+
+        buffer = io.BytesIO()
+        getattr(df, f"to_{self.result_type}")(buffer, **self.kwargs)
+        return buffer.getvalue()
+
+
+# formats pandas writes into a binary buffer as a whole
+buffered_formats = ("json", "pickle", "xml", "feather", "orc", "stata", "excel")
+writers = {
+    "csv": CsvWriter,
+    "jsonl": JsonLinesWriter,
+    "parquet": ParquetWriter,
+    "arrow": ArrowWriter,
+}
+
+
+def parse_format(result_type):
+    if result_type not in writers and result_type not in buffered_formats:
+        raise BadRequest(f"unsupported format {result_type}, use one of {', '.join([*writers, *buffered_formats])}")
+
+    return result_type
+
+
+def make_writer(result_type, sample: pd.DataFrame = None, **kwargs) -> StreamWriter:
+    parse_format(result_type)
+    if result_type in writers:
+        return writers[result_type](sample, **kwargs)
+    else:
+        return BufferedWriter(result_type, sample, **kwargs)
@@ -0,0 +1,3 @@
+# answered with 400 and the message
+class BadRequest(ValueError):
+    pass
@@ -0,0 +1,161 @@
+import asyncio
+import base64
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.flight as flight
+
+from serve.admission import AdmissionControl, Rejected, new_admission
+from serve.dataaccess.commit import resolve_commit
+from serve.dataaccess.database import read_sql
+from serve.dataaccess.ohlcv import stream_ohlcv
+from serve.dataaccess.selection import column_pattern
+from serve.utils.request_util import get_data_args, DataArgs
+
+log = logging.getLogger(__name__)
+
+
+# a flight is a json command like {"source": "yfinance", "symbols": ["MSFT"], "columns": ["c"], "streams": 4},
+# a ticket is the same json with the symbols of one of its ranges and the schema of the flight
+class OhlcvFlightServer(flight.FlightServerBase):
+    def __init__(self, location, streams=4, admission: Optional[AdmissionControl] = None, **kwargs) -> None:
+        super().__init__(location, **kwargs)
+        self.streams = int(streams)
+        self.admission = admission
+        # flight calls are served by grpc threads, the async data access runs on a loop of its own
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="flight", daemon=True).start()
+
+    def get_flight_info(self, context, descriptor: flight.FlightDescriptor) -> flight.FlightInfo:
+        request = _parse_request(descriptor.command)
+        with self._admitted(_client(context)):
+            symbols = request.get("symbols", None) or self._run(_all_symbols(request["source"]))
+            symbols = sorted(dict.fromkeys(symbols))
+            # the schema is the one of the first symbol, every chunk of a stream has the same schema
+            schema = self._schema(request, symbols[:1])
+
+        streams = max(1, min(int(request.get("streams", self.streams)), len(symbols)))
+        size = -(-len(symbols) // streams) if len(symbols) > 0 else 0
+        encoded = base64.b64encode(schema.serialize().to_pybytes()).decode("ascii")
+        endpoints = [
+            flight.FlightEndpoint(json.dumps({**request, "symbols": symbols[i:i + size], "schema": encoded}).encode("UTF-8"), [])
+            for i in range(0, len(symbols), size or 1)
+        ]
+
+        return flight.FlightInfo(schema, descriptor, endpoints, -1, -1)
+
+    def do_get(self, context, ticket: flight.Ticket) -> flight.FlightDataStream:
+        request = _parse_request(ticket.ticket)
+        symbols = request.get("symbols", None) or []
+        client = _client(context)
+        if "schema" in request:
+            try:
+                schema = pa.ipc.read_schema(pa.py_buffer(base64.b64decode(request["schema"])))
+            except (ValueError, pa.ArrowInvalid) as e:
+                raise flight.FlightServerError(f"invalid schema in the ticket: {e}")
+        else:
+            # tickets made by hand announce the schema of the first symbol like `get_flight_info`
+            with self._admitted(client):
+                schema = self._schema(request, symbols[:1])
+
+        def batches():
+            # admitted once the client pulls the stream until it is sent, also if it is empty the schema is the announced one
+            with self._admitted(client):
+                frames = self._frames(request, symbols)
+                try:
+                    table = self._next(frames)
+                    while table is not None:
+                        yield from table.cast(schema).to_batches()
+                        table = self._next(frames)
+                finally:
+                    # the client might cancel the stream, stop prefetching the next chunk
+                    self._run(frames.aclose())
+
+        return flight.GeneratorStream(schema, batches())
+
+    @contextmanager
+    def _admitted(self, client: str):
+        if self.admission is None:
+            yield
+            return
+
+        try:
+            admitted = self._run(self.admission.acquire(client))
+        except Rejected as e:
+            raise flight.FlightUnavailableError(f"{e}, retry after {e.retry_after}s")
+
+        try:
+            yield
+        finally:
+            # the admission control is bound to the loop of the flight server
+            self.loop.call_soon_threadsafe(self.admission.release, client, admitted)
+
+    def _schema(self, request: dict, symbols: List[str]) -> pa.Schema:
+        table = self._first_table(request, symbols) if len(symbols) > 0 else None
+        return table.schema if table is not None else pa.schema([])
+
+    def _first_table(self, request: dict, symbols: List[str]) -> Optional[pa.Table]:
+        frames = self._frames(request, symbols)
+        try:
+            return self._next(frames)
+        finally:
+            self._run(frames.aclose())
+
+    def _frames(self, request: dict, symbols: List[str]):
+        args: DataArgs = get_data_args({
+            f"__{key}": ",".join(value) if isinstance(value, list) else value
+            for key, value in request.items() if key not in ("source", "symbols", "streams", "schema")
+        })
+        as_of = self._run(resolve_commit(args.as_of)) if args.as_of is not None else None
+        return stream_ohlcv({request["source"]: symbols}, args.where, args.freq, args.columns, args.start, args.end, as_of)
+
+    def _next(self, frames) -> Optional[pa.Table]:
+        try:
+            df = self._run(frames.__anext__())
+        except StopAsyncIteration:
+            return None
+
+        return pa.Table.from_pandas(df, preserve_index=True)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def shutdown(self):
+        super().shutdown()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def _client(context) -> str:
+    # the peer is the address and the port of the connection, i.e. ipv4:127.0.0.1:52512
+    return context.peer().rsplit(":", 1)[0]
+
+
+async def _all_symbols(source) -> List[str]:
+    return (await read_sql(f"select distinct symbol from {source}_quote"))["symbol"].tolist()
+
+
+def _parse_request(command: bytes) -> dict:
+    try:
+        request = json.loads(command)
+    except json.JSONDecodeError as e:
+        raise flight.FlightServerError(f"invalid json request: {e}")
+
+    if not isinstance(request, dict) or column_pattern.match(str(request.get("source", ""))) is None:
+        raise flight.FlightServerError("expected a json object with a source")
+
+    return request
+
+
+def start_flight_server(config: Dict) -> Optional[OhlcvFlightServer]:
+    config = config.get("flight", None) or {}
+    if not config.get("enabled", False):
+        return None
+
+    location = f"grpc://{config.get('host', None) or '0.0.0.0'}:{config.get('port', 9877)}"
+    server = OhlcvFlightServer(location, config.get("streams", 4), new_admission())
+    log.info(f"serving arrow flight at {location}")
+    return server
@@ -0,0 +1,170 @@
+import glob
+import logging
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import AsyncIterator, Iterable, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST, multiprocess
+
+from serve.config import Config
+from serve.datastream.closing_body import ClosingBody
+
+log = logging.getLogger(__name__)
+
+registry = CollectorRegistry()
+buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+requests_total = Counter(
+    "findb_requests", "Finished requests", ["route", "source", "status"], registry=registry
+)
+request_seconds = Histogram(
+    "findb_request_seconds", "Request latency by phase: db, transform, serialize and total", ["route", "source", "phase"],
+    buckets=buckets, registry=registry
+)
+response_bytes = Counter(
+    "findb_response_bytes", "Bytes sent", ["route", "source"], registry=registry
+)
+cache_total = Counter(
+    "findb_cache", "Cache lookups by result: hit, miss or not_modified, the hit ratio is hit / (hit + miss)", ["route", "result"],
+    registry=registry
+)
+collapsed_total = Counter(
+    "findb_collapsed_requests", "Requests answered by an identical request which was already in flight", ["route", "source"],
+    registry=registry
+)
+in_flight = Gauge(
+    "findb_requests_in_flight", "Requests currently served", ["route"], multiprocess_mode="livesum", registry=registry
+)
+admission_active = Gauge(
+    "findb_admission_active", "Requests admitted to query the database", multiprocess_mode="livesum", registry=registry
+)
+admission_queued = Gauge(
+    "findb_admission_queue_depth", "Requests waiting to query the database", multiprocess_mode="livesum", registry=registry
+)
+admission_wait_seconds = Histogram(
+    "findb_admission_wait_seconds", "Seconds queued requests waited to query the database", buckets=buckets, registry=registry
+)
+admission_rejected = Counter(
+    "findb_admission_rejected", "Rejected requests by reason: client, queue_full or timeout", ["reason"], registry=registry
+)
+
+# sources of the server.metric_sources setting are labelled by name, any other as "other" so requests can not grow
+# the label sets without bounds
+known_sources = None
+
+current: ContextVar[Optional['RequestMetrics']] = ContextVar("request_metrics", default=None)
+
+
+# overlapping intervals of the same phase are counted once
+class RequestMetrics(object):
+    def __init__(self, route, source="") -> None:
+        super().__init__()
+        self.route = route
+        self.source = source
+        self.started = perf_counter()
+        self.durations = defaultdict(float)
+        self.active = defaultdict(int)
+        self.since = {}
+        self.finished = False
+        self.sent = 0
+        in_flight.labels(route).inc()
+
+    @contextmanager
+    def phase(self, name):
+        if self.active[name] == 0:
+            self.since[name] = perf_counter()
+
+        self.active[name] += 1
+        try:
+            yield
+        finally:
+            self.active[name] -= 1
+            if self.active[name] == 0:
+                self.durations[name] += perf_counter() - self.since[name]
+
+    def cache(self, result):
+        cache_total.labels(self.route, result).inc()
+
+    def collapsed(self):
+        collapsed_total.labels(self.route, self.source).inc()
+
+    def server_timing(self) -> str:
+        timings = {**self.durations, "total": perf_counter() - self.started}
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+    def stream(self, body: AsyncIterator[bytes], status=200) -> AsyncIterator[bytes]:
+        # finished once the body is sent or closed, even if it never started
+        return ClosingBody(body, lambda: self.finish(status, self.sent), self._count)
+
+    def _count(self, chunk: bytes):
+        self.sent += len(chunk)
+
+    def finish(self, status, size=0):
+        if self.finished:
+            return
+
+        self.finished = True
+        in_flight.labels(self.route).dec()
+        requests_total.labels(self.route, self.source, str(status)).inc()
+        response_bytes.labels(self.route, self.source).inc(size)
+        for name, seconds in self.durations.items():
+            request_seconds.labels(self.route, self.source, name).observe(seconds)
+
+        request_seconds.labels(self.route, self.source, "total").observe(perf_counter() - self.started)
+
+
+def source_label(sources: Iterable[str]) -> str:
+    global known_sources
+    if known_sources is None:
+        known_sources = set(Config.get().get("server", {}).get("metric_sources", None) or ["yfinance"])
+
+    return ",".join(sorted({source if source in known_sources else "other" for source in sources}))
+
+
+def start_request(route, sources: Iterable[str] = ()) -> RequestMetrics:
+    metrics = RequestMetrics(route, source_label(sources))
+    current.set(metrics)
+    return metrics
+
+
+@contextmanager
+def phase(name, metrics: RequestMetrics = None):
+    metrics = metrics or current.get()
+    if metrics is None:
+        yield
+    else:
+        with metrics.phase(name):
+            yield
+
+
+def worker_exit():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def mark_dead_workers():
+    # workers which crashed or were killed did not remove their live gauges, they would be summed up forever
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    pids = {int(os.path.splitext(file)[0].rsplit("_", 1)[1]) for file in glob.glob(os.path.join(path, "gauge_live*_*.db"))}
+    for pid in pids:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            log.info(f"remove the live gauges of the dead worker {pid}")
+            multiprocess.mark_process_dead(pid, path)
+        except PermissionError:
+            pass
+
+
+def render():
+    # with several workers every process writes its metrics to PROMETHEUS_MULTIPROC_DIR and they are summed up here
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        mark_dead_workers()
+        collector = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector)
+        return generate_latest(collector), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+    return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
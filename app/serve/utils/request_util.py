@@ -1,7 +1,96 @@
-def get_data_args(args: dict):
+import json
+from typing import NamedTuple, Dict, List, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+from serve.dataaccess.panel import parse_layout
+from serve.dataaccess.resample import parse_freq
+from serve.dataaccess.selection import parse_columns, parse_date
+from serve.datastream.writers import parse_format
+from serve.errors import BadRequest
+
+
+class DataArgs(NamedTuple):
+    separator: str
+    as_type: str
+    where: str
+    axis: int
+    pandas_kwargs: dict
+    freq: str = None
+    columns: tuple = None
+    start: pd.Timestamp = None
+    end: pd.Timestamp = None
+    layout: str = "wide"
+    pivot: str = None
+    as_of: str = None
+
+
+def get_data_args(args: dict) -> DataArgs:
     separator = args.get('__separator', ',')
-    as_type = args.get('__as', 'csv')
+    as_type = parse_format(args.get('__as', 'csv'))
     where = args.get('__where', '1=1')
-    axis = int(args.get('__axis', 1))
+    try:
+        axis = int(args.get('__axis', 1))
+    except ValueError:
+        raise BadRequest(f"invalid axis {args.get('__axis')}")
+    freq = parse_freq(args.get('__freq', None))
+    columns = parse_columns(args.get('__columns', None))
+    start = parse_date(args.get('__from', None))
+    end = parse_date(args.get('__to', None), end=True)
+    layout = parse_layout(args.get('__layout', None))
+    pivot = parse_columns(args.get('__pivot', None))
+    as_of = args.get('__as_of', None) or None
+    if pivot is not None and len(pivot) != 1:
+        raise BadRequest("only a single column can be pivoted")
+
+    return DataArgs(
+        separator, as_type, where, axis,
+        {key.replace("_", ""): value for key, value in args.items() if key.startswith("__") and key.endswith("__")},
+        freq, columns, start, end, layout, pivot[0] if pivot is not None else None, as_of
+    )
+
+
+def normalize_symbols(symbols: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    symbols = {source: list(dict.fromkeys(symbol.strip().upper() for symbol in src_symbols if symbol.strip())) for source, src_symbols in symbols.items()}
+    symbols = {source: src_symbols for source, src_symbols in symbols.items() if len(src_symbols) > 0}
+    if len(symbols) <= 0:
+        raise BadRequest("no symbols requested")
+
+    return symbols
+
+
+def get_bulk_args(args: dict, data: bytes, mimetype: str) -> Tuple[Dict[str, List[str]], DataArgs]:
+    # an arrow stream with a source and a symbol column or json like {"symbols": [["yfinance", "MSFT"]], "as": "parquet"},
+    # json keys overwrite the `__` arguments of the query string
+    args = dict(args.items())
+    if mimetype == "application/vnd.apache.arrow.stream":
+        try:
+            table = pa.ipc.open_stream(data).read_all()
+            pairs = zip(table.column("source").to_pylist(), table.column("symbol").to_pylist())
+        except (pa.ArrowInvalid, KeyError) as e:
+            raise BadRequest(f"invalid arrow body, expected a source and a symbol column: {e}")
+    else:
+        try:
+            body = json.loads(data or b"{}")
+        except json.JSONDecodeError as e:
+            raise BadRequest(f"invalid json body: {e}")
+
+        if not isinstance(body, dict):
+            raise BadRequest("expected a json object with a list of [source, symbol] pairs as symbols")
+
+        pairs = body.pop("symbols", [])
+        pairs = [(source, symbol) for source, symbols in pairs.items() for symbol in symbols] if isinstance(pairs, dict) else pairs
+        args.update({f"__{key}": ",".join(value) if isinstance(value, list) else value for key, value in body.items()})
+
+    symbols = {}
+    for pair in pairs:
+        if len(pair) != 2 or not all(isinstance(value, str) and len(value) > 0 for value in pair):
+            raise BadRequest(f"invalid symbol {pair}, expected [source, symbol]")
+
+        symbols.setdefault(pair[0], []).append(pair[1])
+
+    if len(symbols) <= 0:
+        raise BadRequest("no symbols requested")
 
-    return separator, as_type, where, axis, {key.replace("_", ""): value for key, value in args.items() if key.startswith("__") and key.endswith("__")}
+    return symbols, get_data_args(args)
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from serve.cache.response_cache import ResponseCache, get_cache
+from serve.config import Config
+from serve.dataaccess.commit import current_commit, follow, publish, query_head
+from serve.dataaccess.database import get_engine, read_sql, run
+from serve.dataaccess.selection import column_pattern
+
+try:
+    import fcntl
+except ImportError:
+    # windows, where a single worker serves the api
+    fcntl = None
+
+log = logging.getLogger(__name__)
+watcher: 'CommitWatcher' = None
+
+# renders the response of the symbols and arguments of a request at a commit, returns the body, the status and the headers
+Render = Callable[[Dict[str, List[str]], tuple, str], Awaitable[tuple]]
+
+
+class RequestLog(object):
+    def __init__(self, max_size=1000) -> None:
+        super().__init__()
+        self.max_size = int(max_size)
+        self.requests: Dict[str, list] = OrderedDict()
+
+    def record(self, symbols: Dict[str, List[str]], args: tuple):
+        key = ResponseCache.make_key(None, symbols, args)
+        if key in self.requests:
+            self.requests[key][2] += 1
+            self.requests.move_to_end(key)
+        else:
+            self.requests[key] = [symbols, args, 1]
+            while len(self.requests) > self.max_size:
+                self.requests.popitem(last=False)
+
+    def most_requested(self) -> List[Tuple[Dict[str, List[str]], tuple]]:
+        return [(symbols, args) for symbols, args, _ in sorted(self.requests.values(), key=lambda request: -request[2])]
+
+
+# before a new commit is published, responses of unchanged symbols are moved to it and the most requested others warmed
+class CommitWatcher(object):
+    def __init__(self, render: Render, interval=10, pull_interval=None, remote="origin", recent=1000, warm=50, warm_concurrency=2) -> None:
+        super().__init__()
+        self.render = render
+        self.interval = float(interval)
+        self.pull_interval = float(pull_interval) if pull_interval else None
+        self.remote = remote
+        self.log = RequestLog(recent)
+        self.warm = int(warm)
+        self.warm_concurrency = int(warm_concurrency)
+        self.commit = None
+        # file the commit is published to for the other workers
+        self.published: Optional[str] = None
+
+    async def run(self):
+        pulled = monotonic()
+        while True:
+            try:
+                if self.pull_interval is not None and monotonic() - pulled >= self.pull_interval:
+                    pulled = monotonic()
+                    await run(self._pull)
+
+                head = await query_head()
+                if head is not None and self.commit is not None and head != self.commit:
+                    await self.refresh(self.commit, head)
+
+                # requests use the published commit, should the watcher stop they query the head again
+                self.commit = head if head is not None else self.commit
+                if self.commit is not None:
+                    publish(self.commit, 3 * self.interval)
+                    if self.published is not None:
+                        self._write_published()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("failed to watch the dolt head", exc_info=e)
+
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self, old: str, new: str):
+        cache = get_cache()
+        if cache is None:
+            return
+
+        started = monotonic()
+        requests = self.log.most_requested()
+        changed = await self.changed_symbols(old, new, {source for symbols, _ in requests for source in symbols})
+
+        rebased, stale = 0, []
+        for symbols, args in requests:
+            old_key, new_key = ResponseCache.make_key(old, symbols, args), ResponseCache.make_key(new, symbols, args)
+            entry = await cache.get(old_key) if changed is not None and not _changes(symbols, changed) else None
+            if entry is not None:
+                await cache.put(new_key, entry.content, entry.headers)
+                rebased += 1
+            else:
+                stale.append((symbols, args, new_key))
+
+            await cache.discard(old_key)
+
+        # compute the responses of the most requested changed symbols before any request asks for them
+        semaphore = asyncio.Semaphore(self.warm_concurrency)
+
+        async def warm(symbols, args, key):
+            async with semaphore:
+                try:
+                    body, status, headers = await self.render(symbols, args, new)
+                    content = b"".join([chunk async for chunk in body])
+                    if status == 200:
+                        await cache.put(key, content, headers)
+                except Exception as e:
+                    log.warning(f"failed to warm the cache for {symbols}: {e}")
+
+        await asyncio.gather(*[warm(*request) for request in stale[:self.warm]])
+        log.info(
+            f"new commit {new}: {sum(map(len, changed.values())) if changed is not None else 'unknown'} symbols changed, "
+            f"rebased {rebased} and warmed {min(len(stale), self.warm)} responses in {monotonic() - started:.1f}s"
+        )
+
+    async def changed_symbols(self, old: str, new: str, sources: Set[str]) -> Optional[Dict[str, Set[str]]]:
+        changed = {}
+        for source in sources:
+            if column_pattern.match(source) is None:
+                return None
+
+            try:
+                df = await read_sql(
+                    f"select distinct from_symbol, to_symbol from dolt_diff(:old, :new, '{source}_quote')", {"old": old, "new": new}
+                )
+            except Exception as e:
+                log.warning(f"failed to diff {source}_quote from {old} to {new}: {e}")
+                return None
+
+            changed[source] = {str(symbol).upper() for column in ("from_symbol", "to_symbol") for symbol in df[column].dropna()}
+
+        return changed
+
+    def _write_published(self):
+        with open(self.published + ".tmp", "w") as f:
+            f.write(self.commit)
+
+        os.replace(self.published + ".tmp", self.published)
+
+    def _pull(self):
+        with get_engine().connect() as connection:
+            connection.execute(text("call dolt_pull(:remote)"), {"remote": self.remote})
+            connection.commit()
+
+
+def _changes(symbols: Dict[str, List[str]], changed: Dict[str, Set[str]]) -> bool:
+    return any(symbol.upper() in changed.get(source, ()) for source, source_symbols in symbols.items() for symbol in source_symbols)
+
+
+def start_watcher(render: Render) -> Optional['asyncio.Task']:
+    global watcher
+    config = Config.get().get("watcher", None) or {}
+    if not config.get("enabled", True):
+        return None
+
+    watcher = CommitWatcher(
+        render,
+        config.get("interval", 10),
+        config.get("pull_interval", None),
+        config.get("remote", "origin"),
+        config.get("recent", 1000),
+        config.get("warm", 50),
+        config.get("warm_concurrency", 2),
+    )
+
+    # the workers of `api server --workers` share a lock file, only the worker holding it watches
+    return asyncio.get_running_loop().create_task(_watch(watcher, os.environ.get("FINDB_WATCHER_LOCK", None)))
+
+
+async def _watch(commit_watcher: CommitWatcher, lock_path: Optional[str]):
+    if lock_path is None or fcntl is None:
+        await commit_watcher.run()
+        return
+
+    # the other workers use the commit the watcher published and take over once the worker holding the lock exited
+    published = f"{lock_path}.commit"
+    follow(published)
+    with open(lock_path, "a") as lock:
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(commit_watcher.interval)
+
+        log.info(f"watching the dolt head in worker {os.getpid()}")
+        # a worker taking over prepares the caches for a new head like the previous watcher would have
+        commit_watcher.commit = await current_commit()
+        follow(None)
+        commit_watcher.published = published
+        await commit_watcher.run()
+
+
+def record(symbols: Dict[str, List[str]], args: tuple):
+    if watcher is not None:
+        watcher.log.record(symbols, args)
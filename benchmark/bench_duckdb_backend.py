@@ -0,0 +1,77 @@
+# compares the sql backend with the duckdb backend over the parquet mirror of yfinance_quote
+# run from the app directory: PYTHONPATH=. python ../benchmark/bench_duckdb_backend.py --symbols 500 --days 5000
+# pass --database to benchmark against a running dolt sql-server instead of a synthetic sqlite database
+import asyncio
+import os
+import tempfile
+from timeit import default_timer
+
+import click
+import numpy as np
+import pandas as pd
+
+from serve.dataaccess import database, mirror, ohlcv
+
+
+def _synthetic_quotes(url, symbols, days):
+    epochs = np.arange(days, dtype="int64") * 86400 + 946684800
+    for s in range(symbols):
+        pd.DataFrame({
+            "symbol": f"SYM{s}",
+            "epoch": epochs,
+            "o": np.random.rand(days), "h": np.random.rand(days), "l": np.random.rand(days), "c": np.random.rand(days),
+            "v": np.random.randint(0, 1000000, days),
+            "dividend": 0.0, "split": 0.0,
+            "tzinfo": "America/New_York",
+        }).to_sql("yfinance_quote", url, index=False, if_exists="append")
+
+
+async def _run(url, fetch_symbols, where, repeat, mirror_path):
+    timings = {}
+    for backend in ["sql", "duckdb"]:
+        database.init({"url": url, "backend": backend, "mirror": {"path": mirror_path}})
+
+        if backend == "duckdb":
+            started = default_timer()
+            await mirror.get_mirror("yfinance_quote")
+            await mirror.refreshing["yfinance_quote"]
+            print(f"  mirror export: {default_timer() - started:.3f}s")
+
+        started = default_timer()
+        for _ in range(repeat):
+            frames = await ohlcv._fetch("yfinance", fetch_symbols, where)
+
+        timings[backend] = (default_timer() - started) / repeat
+        print(f"{backend:>6}: {timings[backend]:.3f}s per request, {sum(len(f) for f in frames.values())} rows")
+
+    print(f"speedup: {timings['sql'] / timings['duckdb']:.1f}x")
+
+
+@click.command()
+@click.option('-d', '--database', 'url', type=str, default=None, help='Database to benchmark, defaults to a synthetic sqlite database')
+@click.option('-s', '--symbols', type=int, default=500, help='Number of synthetic symbols')
+@click.option('--days', type=int, default=5000, help='Number of daily quotes per synthetic symbol')
+@click.option('-f', '--fetch', type=int, default=100, help='Number of symbols fetched per request')
+@click.option('-w', '--where', type=str, default="epoch >= 1262304000", help='Where clause of the requests')
+@click.option('-r', '--repeat', type=int, default=3, help='Repetitions per backend')
+def cli(url, symbols, days, fetch, where, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        if url is None:
+            url = f"sqlite:///{os.path.join(tmp, 'findb.sqlite')}"
+            _synthetic_quotes(url, symbols, days)
+
+        # without a dolt database there is no commit, use a fixed one for the mirror
+        async def _current_commit(*args, **kwargs):
+            return "benchmark"
+
+        if url.startswith("sqlite"):
+            mirror.current_commit = _current_commit
+
+        database.init({"url": url})
+        fetch_symbols = pd.read_sql("select distinct symbol from yfinance_quote", database.get_engine())["symbol"].tolist()[:fetch]
+
+        asyncio.run(_run(url, fetch_symbols, where, repeat, os.path.join(tmp, "mirror")))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,49 @@
+# compares the former row by row epoch conversion of serve.dataaccess.ohlcv with the vectorized one
+# run from the app directory: PYTHONPATH=. python ../benchmark/bench_epoch_index.py --rows 1000000
+from datetime import datetime
+from timeit import default_timer
+
+import click
+import numpy as np
+import pandas as pd
+import pytz
+
+from serve.dataaccess.timeindex import to_datetime_index
+
+
+def _row_wise(df):
+    def get_tz(tzinfo_str):
+        try:
+            return pytz.timezone(tzinfo_str)
+        except Exception:
+            return None
+
+    return pd.DatetimeIndex(
+        df[["epoch", "tzinfo"]].apply(lambda x: datetime.fromtimestamp(x["epoch"], get_tz(x["tzinfo"])), axis=1).rename("time")
+    )
+
+
+def _vectorized(df):
+    return to_datetime_index(df["epoch"], df["tzinfo"])
+
+
+@click.command()
+@click.option('-r', '--rows', type=int, default=1_000_000, help='Number of rows of the synthetic frame')
+def cli(rows):
+    df = pd.DataFrame({
+        "epoch": np.arange(rows, dtype="int64") * 60 + 946684800,
+        "tzinfo": "America/New_York",
+    })
+
+    timings = {}
+    for name, func in [("row wise", _row_wise), ("vectorized", _vectorized)]:
+        started = default_timer()
+        index = func(df)
+        timings[name] = default_timer() - started
+        print(f"{name:>12}: {timings[name]:.3f}s {index[0]} .. {index[-1]}")
+
+    print(f"     speedup: {timings['row wise'] / timings['vectorized']:.0f}x")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,47 @@
+# compares the outer join concat of fetch_ohlcv with the long panel and the pivot of a single column
+# run from the app directory: PYTHONPATH=. python ../benchmark/bench_panel.py --symbols 2000 --days 2500
+from timeit import default_timer
+
+import click
+import numpy as np
+import pandas as pd
+
+from serve.dataaccess.panel import build_panel, pivot_panel
+
+
+def _frames(symbols, days):
+    # daily bars of different length and timezone which do not align
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(symbols):
+        length = int(rng.integers(days // 10, days))
+        start = pd.Timestamp("2000-01-01") + pd.Timedelta(days=days - length)
+        index = pd.date_range(start, periods=length, freq="D", name="time").tz_localize(["America/New_York", "Europe/Berlin", "Asia/Tokyo"][i % 3])
+        frames.append((f"S{i}", pd.DataFrame({
+            "o": rng.random(length), "h": rng.random(length), "l": rng.random(length), "c": rng.random(length),
+            "v": rng.integers(0, 1_000_000, length),
+        }, index=index)))
+
+    return frames
+
+
+@click.command()
+@click.option('-s', '--symbols', type=int, default=2000, help='Number of symbols')
+@click.option('-d', '--days', type=int, default=2500, help='Maximum length of the history of a symbol')
+def cli(symbols, days):
+    frames = _frames(symbols, days)
+    keys, values = zip(*frames)
+
+    for name, func in [
+        ("concat", lambda: pd.concat(values, join='outer', axis=1, keys=keys, sort=True)),
+        ("long panel", lambda: build_panel(frames)),
+        ("pivot c", lambda: pivot_panel(frames, "c")),
+    ]:
+        started = default_timer()
+        df = func()
+        elapsed = default_timer() - started
+        print(f"{name:>12}: {elapsed:.3f}s {df.shape} {df.memory_usage(deep=True).sum() / 1024 ** 2:.0f}MB")
+
+
+if __name__ == '__main__':
+    cli()
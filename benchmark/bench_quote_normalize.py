@@ -0,0 +1,46 @@
+# compares the row by row epoch conversion of the quote command with the vectorized normalize_quotes
+# run from the app directory: PYTHONPATH=. python ../benchmark/bench_quote_normalize.py --symbols 20 --days 15000
+from timeit import default_timer
+
+import click
+import numpy as np
+import pandas as pd
+import pytz
+
+from modules.quote_utils import normalize_quotes
+
+
+def _frame(days):
+    # a full history of daily bars as returned by yfinance
+    rng = np.random.default_rng(0)
+    index = pd.date_range("1980-01-01", periods=days, freq="D", name="Date")
+    return pd.DataFrame({
+        "Open": rng.random(days), "High": rng.random(days), "Low": rng.random(days), "Close": rng.random(days),
+        "Volume": rng.integers(0, 1_000_000, days), "Dividends": np.zeros(days), "Stock Splits": np.zeros(days),
+    }, index=index)
+
+
+def _row_by_row(df, symbol, tz_info):
+    df = df.copy()
+    df.insert(0, "epoch", df.index.to_series().apply(lambda x: x.tz_localize(tz_info).to_pydatetime().timestamp()))
+    df.insert(0, "symbol", symbol)
+    return df.rename(columns={"Open": "o", "High": "h", "Low": "l", "Close": "c", "Volume": "v", "Dividends": "dividend", "Stock Splits": "split"})
+
+
+@click.command()
+@click.option('-s', '--symbols', type=int, default=20, help='Number of symbols')
+@click.option('-d', '--days', type=int, default=15000, help='Rows of the history of a symbol')
+def cli(symbols, days):
+    df, tz_info = _frame(days), pytz.timezone('US/Eastern')
+
+    for name, func in [("row by row", _row_by_row), ("vectorized", normalize_quotes)]:
+        started = default_timer()
+        for i in range(symbols):
+            func(df, f"S{i}", tz_info)
+
+        elapsed = default_timer() - started
+        print(f"{name:>12}: {elapsed:.3f}s, {symbols * days / elapsed:,.0f} rows/s")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,76 @@
+# rows per second of the upsert methods of df_utils against the per row dicts of pandas to_sql
+# run from the app directory: PYTHONPATH=. python ../benchmark/bench_upsert.py --rows 200000
+# and against dolt or mysql with the schema of yfinance_quote:
+#   PYTHONPATH=. python ../benchmark/bench_upsert.py -d mysql+pymysql://root:@localhost/findb
+import os
+import tempfile
+from timeit import default_timer
+
+import click
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from modules.df_utils import bulk_upsert
+
+table = "bench_quote"
+
+
+def _frame(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "symbol": [f"S{i // 5000}" for i in range(rows)], "epoch": np.arange(rows, dtype="int64") % 5000 * 86400,
+        "o": rng.random(rows), "h": rng.random(rows), "l": rng.random(rows), "c": rng.random(rows),
+        "v": rng.integers(0, 1_000_000, rows), "dividend": np.zeros(rows), "split": np.zeros(rows),
+    })
+
+
+def _dicts(df, connection):
+    # the former path, pandas builds a dict per row for sqlalchemy
+    def insert(pd_table, conn, keys, data_iter):
+        conn.execute(pd_table.table.insert(), [dict(zip(keys, row)) for row in data_iter])
+
+    df.to_sql(table, connection, if_exists="append", index=False, method=insert)
+
+
+@click.command()
+@click.option('-d', '--database', type=str, default=None, help='database connection string, a temporary sqlite database by default')
+@click.option('-r', '--rows', type=int, default=200_000, help='Number of rows')
+@click.option('-c', '--chunk-size', type=int, default=5000, help='Rows sent by a single statement')
+def cli(database, rows, chunk_size):
+    with tempfile.TemporaryDirectory() as tmp:
+        database = database or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        mysql = database.startswith("mysql")
+        engine = create_engine(database, connect_args={"local_infile": True} if mysql else {})
+        df = _frame(rows)
+
+        methods = [("to_sql dicts", _dicts), ("replace", lambda df, c: bulk_upsert(df, table, c, "replace", chunk_size))]
+        if mysql:
+            methods += [
+                ("on_duplicate", lambda df, c: bulk_upsert(df, table, c, "on_duplicate", chunk_size)),
+                ("load_data", lambda df, c: bulk_upsert(df, table, c, "load_data")),
+            ]
+
+        for name, func in methods:
+            with engine.begin() as connection:
+                connection.execute(text(f"drop table if exists {table}"))
+                connection.execute(text(
+                    f"create table {table} (symbol varchar(32), epoch bigint, o double, h double, l double, c double, v bigint, "
+                    f"dividend double, split double, primary key (symbol, epoch))"
+                ))
+
+            started = default_timer()
+            with engine.begin() as connection:
+                func(df, connection)
+
+            elapsed = default_timer() - started
+            print(f"{name:>14}: {elapsed:.2f}s, {rows / elapsed:,.0f} rows/s")
+
+        with engine.begin() as connection:
+            connection.execute(text(f"drop table if exists {table}"))
+
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,23 @@
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+
+from serve.dataaccess import database
+
+
+@pytest.fixture()
+def sqlite_db():
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'findb.sqlite')}"
+        pd.DataFrame({
+            "symbol": ["MSFT", "MSFT", "AAPL"],
+            "epoch": [1640995200, 1641081600, 1640995200],
+            "c": [1.0, 2.0, 3.0],
+            "tzinfo": ["America/New_York", "America/New_York", "America/New_York"],
+        }).to_sql("yfinance_quote", url, index=False)
+
+        database.init({"url": url, "executor_threads": 4})
+        yield url
+        database.dispose()
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from serve.admission import AdmissionControl, Rejected
+
+
+@pytest.mark.asyncio
+async def test_limit_and_fair_share():
+    admission = AdmissionControl(max_concurrent=1, max_queue=4, max_per_client=3)
+    admitted = await admission.acquire("a")
+
+    # a queues two requests before b, b is served after the first request of a nevertheless
+    order = []
+
+    async def request(client):
+        started = await admission.acquire(client)
+        order.append(client)
+        admission.release(client, started)
+
+    waiting = [asyncio.ensure_future(request(client)) for client in ["a", "a", "b"]]
+    await asyncio.sleep(0)
+    assert admission.queued == 3
+
+    admission.release("a", admitted)
+    await asyncio.gather(*waiting)
+    assert order == ["a", "b", "a"]
+    assert admission.active == 0 and admission.queued == 0 and len(admission.clients) == 0
+
+
+@pytest.mark.asyncio
+async def test_rejections():
+    admission = AdmissionControl(max_concurrent=1, max_queue=1, max_per_client=2, queue_timeout=0.05)
+    admitted = await admission.acquire("a")
+
+    # a client exceeding its share
+    waiting = asyncio.ensure_future(admission.acquire("a"))
+    await asyncio.sleep(0)
+    with pytest.raises(Rejected) as e:
+        await admission.acquire("a")
+    assert e.value.status == 429
+    assert e.value.retry_after >= 1
+
+    # a full queue
+    with pytest.raises(Rejected) as e:
+        await admission.acquire("b")
+    assert e.value.status == 503
+
+    # waiting longer than the timeout
+    with pytest.raises(Rejected) as e:
+        await waiting
+    assert e.value.status == 503
+    assert admission.queued == 0
+
+    admission.release("a", admitted)
+    assert admission.active == 0 and len(admission.clients) == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_while_queued():
+    admission = AdmissionControl(max_concurrent=1)
+    admitted = await admission.acquire("a")
+    waiting = asyncio.ensure_future(admission.acquire("b"))
+    await asyncio.sleep(0)
+
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    assert admission.queued == 0
+    admission.release("a", admitted)
+    assert admission.active == 0
+
+
+@pytest.mark.asyncio
+async def test_hold_until_the_body_is_closed():
+    admission = AdmissionControl(max_concurrent=1)
+
+    async def body():
+        yield b"a"
+
+    # sent bodies release the slot
+    body_sent = admission.hold("a", await admission.acquire("a"), body())
+    assert [chunk async for chunk in body_sent] == [b"a"]
+    assert admission.active == 0
+
+    # so do bodies which are closed before they started, i.e. the client went away, and the next request is admitted
+    unsent = admission.hold("a", await admission.acquire("a"), body())
+    waiting = asyncio.ensure_future(admission.acquire("b"))
+    await asyncio.sleep(0)
+    await unsent.aclose()
+    admission.release("b", await waiting)
+    assert admission.active == 0 and admission.queued == 0 and len(admission.clients) == 0
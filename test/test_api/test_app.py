@@ -1,4 +1,8 @@
+import io
+import os
+
 import pandas as pd
+import pyarrow as pa
 import pytest
 
 
@@ -33,15 +37,207 @@ async def test_ohlcv_same_source(client):
     assert b'{"(\'MSFT\', \'open\')"' in data
 
 
+@pytest.mark.asyncio
+async def test_ohlcv_arrow(client):
+    response = await client.get("/api/ohlcv/yahoo/MSFT,AAPL?__as=arrow&__axis=0")
+    assert response.headers["Content-Type"] == "application/vnd.apache.arrow.stream"
+
+    df = pa.ipc.open_stream(await response.get_data()).read_pandas()
+    assert df.index.get_level_values(0).unique().tolist() == ["MSFT", "AAPL"]
+
+
+@pytest.mark.asyncio
+async def test_ohlcv_cached(client, fetched, head):
+    response = await client.get("/api/ohlcv/yahoo/MSFT,AAPL?__as=parquet")
+    assert response.headers["X-Cache"] == "MISS"
+    data = await response.get_data()
+
+    response = await client.get("/api/ohlcv/yahoo/MSFT,AAPL?__as=parquet")
+    assert response.headers["X-Cache"] == "HIT"
+    assert await response.get_data() == data
+    assert len(fetched) == 1
+
+    # the symbols are normalized, repeating them or a different case hits the cache
+    response = await client.get("/api/ohlcv/yahoo/msft,AAPL,MSFT?__as=parquet")
+    assert response.headers["X-Cache"] == "HIT"
+    await response.get_data()
+
+    # a different request or a new commit misses the cache
+    response = await client.get("/api/ohlcv/yahoo/MSFT?__as=parquet")
+    assert response.headers["X-Cache"] == "MISS"
+    await response.get_data()
+
+    head.append("new-commit")
+    response = await client.get("/api/ohlcv/yahoo/MSFT,AAPL?__as=parquet")
+    assert response.headers["X-Cache"] == "MISS"
+    await response.get_data()
+    assert len(fetched) == 3
+
+
+@pytest.mark.asyncio
+async def test_ohlcv_etag(client, fetched, head):
+    response = await client.get("/api/ohlcv/yahoo/MSFT,AAPL?__as=parquet")
+    etag = response.headers["ETag"]
+    assert "max-age" in response.headers["Cache-Control"]
+    await response.get_data()
+
+    response = await client.get("/api/ohlcv/yahoo/MSFT,AAPL?__as=parquet", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert len(await response.get_data()) == 0
+
+    # the etag changes with the request and the dolt commit
+    response = await client.get("/api/ohlcv/yahoo/MSFT,AAPL?__as=csv", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    await response.get_data()
+
+    head.append("new-commit")
+    response = await client.get("/api/ohlcv/yahoo/MSFT,AAPL?__as=parquet", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    await response.get_data()
+    assert len(fetched) == 3
+
+
+@pytest.mark.asyncio
+async def test_ohlcv_freq(client):
+    response = await client.get("/api/ohlcv/yahoo/MSFT?__freq=W")
+    assert response.status_code == 200
+
+    response = await client.get("/api/ohlcv/yahoo/MSFT?__freq=1 week")
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_ohlcv_unsupported_format(client):
+    response = await client.get("/api/ohlcv/yahoo/MSFT?__as=foo")
+    assert response.status_code == 400
+    assert b"unsupported format foo" in await response.get_data()
+
+
+@pytest.mark.asyncio
+async def test_ohlcv_bulk(client, sqlite_db):
+    response = await client.post("/api/ohlcv", json={"symbols": [["yfinance", "MSFT"], ["yfinance", "AAPL"]], "as": "parquet", "columns": ["c"]})
+    df = pd.read_parquet(io.BytesIO(await response.get_data()))
+    assert df.columns.tolist() == ["source", "symbol", "c"]
+    assert df["c"].tolist() == [3.0, 1.0, 2.0]
+
+    # the symbols can also be posted as arrow table, the arguments of the query string still apply
+    symbols = pa.table({"source": ["yfinance"], "symbol": ["MSFT"]})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, symbols.schema) as writer:
+        writer.write_table(symbols)
+
+    response = await client.post("/api/ohlcv?__as=arrow", data=sink.getvalue().to_pybytes(), headers={"Content-Type": "application/vnd.apache.arrow.stream"})
+    df = pa.ipc.open_stream(await response.get_data()).read_pandas()
+    assert df["symbol"].tolist() == ["MSFT", "MSFT"]
+
+    response = await client.post("/api/ohlcv", json={"symbols": [["yfinance"]]})
+    assert response.status_code == 400
+
+    # unknown columns are rejected before the stream starts
+    response = await client.post("/api/ohlcv", json={"symbols": [["yfinance", "MSFT"]], "columns": ["nope"]})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_ohlcv_as_of(client, fetched, head, as_of):
+    response = await client.get("/api/ohlcv/yahoo/MSFT?__as_of=main")
+    assert "immutable" not in response.headers["Cache-Control"]
+    assert response.headers["X-Cache"] == "MISS"
+    await response.get_data()
+    assert as_of == ["0123456789abcdefghijklmnopqrstuv"]
+
+    # a new head commit does not change a pinned response, the ref resolving to the same commit hits the cache
+    head.append("new-commit")
+    response = await client.get("/api/ohlcv/yahoo/MSFT?__as_of=v1.0")
+    assert response.headers["X-Cache"] == "HIT"
+    assert len(fetched) == 1
+
+    # only a commit hash can never move
+    response = await client.get("/api/ohlcv/yahoo/MSFT?__as_of=0123456789abcdefghijklmnopqrstuv")
+    assert "immutable" in response.headers["Cache-Control"]
+    await response.get_data()
+    response = await client.get("/api/ohlcv/yahoo/MSFT?__as_of=0123456789abcdefghijklmnopqrstuv")
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.headers["X-Cache"] == "HIT"
+
+    response = await client.get("/api/ohlcv/yahoo/MSFT?__as_of=unknown")
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_ohlcv_rejected(client, monkeypatch):
+    from serve import admission
+    monkeypatch.setattr(admission, "admission", admission.AdmissionControl(max_per_client=0))
+
+    response = await client.get("/api/ohlcv/yahoo/MSFT")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+@pytest.mark.asyncio
+async def test_internal_errors(client, monkeypatch):
+    from serve.dataaccess import ohlcv
+
+    async def _failing_fetch(*args, **kwargs):
+        raise ValueError("internal detail")
+
+    # only invalid arguments are answered with 400 and their message
+    monkeypatch.setattr(ohlcv, "_fetch", _failing_fetch)
+    response = await client.get("/api/ohlcv/yahoo/MSFT")
+    assert response.status_code == 500
+
+    # failed bulk requests are finished as well
+    response = await client.post("/api/ohlcv", json={"symbols": [["yfinance", "MSFT"]], "as_of": "unknown"})
+    assert response.status_code == 400
+    data = (await (await client.get("/api/metrics")).get_data()).decode()
+    assert 'findb_requests_total{route="/api/ohlcv",source="yfinance",status="400"}' in data
+    assert 'findb_requests_in_flight{route="/api/ohlcv"} 0.0' in data
+
+
+@pytest.fixture()
+def fetched():
+    return []
+
+
+@pytest.fixture()
+def as_of():
+    return []
+
+
 @pytest.fixture()
-def app():
+def head():
+    return ["initial-commit"]
+
+
+@pytest.fixture()
+def app(monkeypatch, fetched, head, as_of):
+    import serve.api
+    from serve.cache import response_cache
     from serve.dataaccess import ohlcv
+    from serve.errors import BadRequest
 
     # setup mock implementations
-    async def _mock_fetch( *args, **kwargs):
-        return pd.DataFrame({"open": [1, 2, 3], "close": [1, 2, 3]})
+    async def _mock_fetch(source, symbols, selection, *args, **kwargs):
+        fetched.append(symbols)
+        as_of.append(selection.as_of)
+        return {symbol: pd.DataFrame({"open": [1, 2, 3], "close": [1, 2, 3]}) for symbol in symbols}
+
+    async def _mock_current_commit(*args, **kwargs):
+        return head[-1]
+
+    async def _mock_resolve_commit(ref):
+        if ref == "unknown":
+            raise BadRequest(f"unknown commit {ref}")
+
+        return "0123456789abcdefghijklmnopqrstuv"
 
-    ohlcv._fetch = _mock_fetch
+    monkeypatch.setattr(ohlcv, "_fetch", _mock_fetch)
+    monkeypatch.setattr(serve.api, "current_commit", _mock_current_commit)
+    monkeypatch.setattr(serve.api, "resolve_commit", _mock_resolve_commit)
+    monkeypatch.setattr(response_cache, "cache", response_cache.ResponseCache())
+    monkeypatch.setattr(response_cache, "immutable_cache", response_cache.ResponseCache())
 
     # setup app
     from serve.api import app
@@ -64,3 +260,113 @@ def client(app):
 def runner(app):
     return app.test_cli_runner()
 
+
+@pytest.mark.asyncio
+async def test_metrics(client):
+    response = await client.get("/api/ohlcv/yfinance/MSFT,AAPL?__as=parquet")
+    assert "total;dur=" in response.headers["Server-Timing"]
+    await response.get_data()
+
+    response = await client.get("/api/ohlcv/yfinance/MSFT,AAPL?__as=parquet")
+    await response.get_data()
+
+    # sources which are not configured share a label
+    response = await client.get("/api/ohlcv/unknown_source/MSFT?__as=parquet")
+    await response.get_data()
+
+    response = await client.get("/api/metrics")
+    data = (await response.get_data()).decode()
+    route = 'route="/api/ohlcv/<string:source>/<string:symbols>"'
+    assert f'findb_requests_total{{{route},source="yfinance",status="200"}}' in data
+    assert f'findb_requests_total{{{route},source="other",status="200"}}' in data
+    assert 'unknown_source' not in data
+    assert f'findb_cache_total{{result="hit",{route}}}' in data
+    assert f'findb_request_seconds_count{{phase="serialize",{route},source="yfinance"}}' in data
+    assert f'findb_requests_in_flight{{{route}}} 0.0' in data
+
+
+@pytest.mark.asyncio
+async def test_metrics_of_unsent_body():
+    from serve import metrics
+
+    async def body():
+        yield b"data"
+
+    # a body closed before it started, i.e. the client went away, still finishes the request
+    request_metrics = metrics.RequestMetrics("/unsent")
+    assert metrics.in_flight.labels("/unsent")._value.get() == 1
+    await request_metrics.stream(body()).aclose()
+    assert request_metrics.finished and metrics.in_flight.labels("/unsent")._value.get() == 0
+
+    request_metrics = metrics.RequestMetrics("/unsent")
+    assert [chunk async for chunk in request_metrics.stream(body())] == [b"data"]
+    assert request_metrics.finished and request_metrics.sent == 4
+
+
+def test_run_workers(monkeypatch, tmp_path):
+    import hypercorn.run
+    import serve.api
+
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    monkeypatch.delenv("FINDB_CACHE_PATH", raising=False)
+    monkeypatch.delenv("FINDB_WATCHER_LOCK", raising=False)
+    started = []
+
+    def _mock_run(config):
+        started.append((config, os.environ["PROMETHEUS_MULTIPROC_DIR"], os.environ.get("FINDB_CACHE_PATH", None)))
+        assert os.path.isdir(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+        assert os.path.dirname(os.environ["FINDB_WATCHER_LOCK"]) == os.environ["PROMETHEUS_MULTIPROC_DIR"]
+        return 0
+
+    monkeypatch.setattr(hypercorn.run, "run", _mock_run)
+    config = {"server": {"host": "0.0.0.0", "port": 9876, "graceful_timeout": 5}}
+    with pytest.raises(SystemExit) as e:
+        serve.api._run_workers(config, 3)
+    assert e.value.code == 0
+
+    hypercorn_config, metrics_dir, cache_path = started[0]
+    assert hypercorn_config.application_path == "serve.api:app"
+    assert hypercorn_config.bind == ["0.0.0.0:9876"]
+    assert hypercorn_config.workers == 3 and hypercorn_config.worker_class == "asyncio"
+    assert hypercorn_config.graceful_timeout == 5.0
+    # the metrics of the workers are removed with the server, without a configured disk cache the workers share one
+    assert not os.path.exists(metrics_dir)
+    assert cache_path is not None
+
+    started.clear()
+    monkeypatch.delenv("FINDB_CACHE_PATH")
+    with pytest.raises(SystemExit):
+        serve.api._run_workers({**config, "cache": {"disk": {"path": str(tmp_path)}}}, 2)
+    assert started[0][2] is None
+
+
+def test_mark_dead_workers(monkeypatch, tmp_path):
+    import subprocess
+    import sys
+    from serve import metrics
+
+    # the pid of a process which exited already
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    for pid in [dead.pid, os.getpid()]:
+        (tmp_path / f"gauge_livesum_{pid}.db").write_bytes(b"")
+        (tmp_path / f"counter_{pid}.db").write_bytes(b"")
+
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    metrics.mark_dead_workers()
+    assert sorted(file.name for file in tmp_path.iterdir()) == sorted([
+        f"counter_{dead.pid}.db", f"counter_{os.getpid()}.db", f"gauge_livesum_{os.getpid()}.db"
+    ])
+
+    metrics.worker_exit()
+    assert not (tmp_path / f"gauge_livesum_{os.getpid()}.db").exists()
+
+
+@pytest.mark.asyncio
+async def test_render_head(app, as_of):
+    import serve.api
+    from serve.utils.request_util import get_data_args
+
+    # responses warmed for a new commit are rendered as of that commit
+    body, status, _ = await serve.api._render_head({"yfinance": ["MSFT"]}, get_data_args({}), "0123456789abcdefghijklmnopqrstuv")
+    assert status == 200 and as_of == ["0123456789abcdefghijklmnopqrstuv"]
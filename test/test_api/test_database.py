@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+from serve.dataaccess import database
+
+
+@pytest.mark.asyncio
+async def test_read_sql_pool(sqlite_db):
+    df = await database.read_sql("select * from yfinance_quote where symbol = :symbol", {"symbol": "MSFT"})
+    assert len(df) == 2
+    assert df["symbol"].unique().tolist() == ["MSFT"]
+
+
+@pytest.mark.asyncio
+async def test_read_sql_runs_off_loop(sqlite_db, monkeypatch):
+    def _slow_read_sql(query, params=None, key=None, commit=None):
+        time.sleep(0.2)
+        return pd.DataFrame({"query": [query]})
+
+    monkeypatch.setattr(database, "_read_sql", _slow_read_sql)
+
+    started = time.time()
+    frames = await asyncio.gather(*[database.read_sql(f"select {i}") for i in range(4)])
+    assert len(frames) == 4
+    assert time.time() - started < 0.6, "queries did not run concurrently"
@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import pyarrow.flight as flight
+import pytest
+
+from serve.admission import AdmissionControl
+from serve.flight import OhlcvFlightServer
+
+
+@pytest.fixture()
+def flight_client(sqlite_db):
+    server = OhlcvFlightServer("grpc://127.0.0.1:0", streams=2)
+    client = flight.connect(f"grpc://127.0.0.1:{server.port}")
+    yield client
+    client.close()
+    server.shutdown()
+
+
+def test_flight_streams(flight_client):
+    # without symbols all symbols of the source are split into ranges
+    descriptor = flight.FlightDescriptor.for_command(json.dumps({"source": "yfinance", "columns": ["c"]}))
+    info = flight_client.get_flight_info(descriptor)
+    assert len(info.endpoints) == 2
+    assert info.schema.names[:3] == ["source", "symbol", "c"]
+
+    tables = [flight_client.do_get(endpoint.ticket).read_all() for endpoint in info.endpoints]
+    assert [table.column("symbol").to_pylist() for table in tables] == [["AAPL"], ["MSFT", "MSFT"]]
+    assert tables[1].column("c").to_pylist() == [1.0, 2.0]
+
+
+def test_flight_date_range(flight_client):
+    descriptor = flight.FlightDescriptor.for_command(json.dumps({"source": "yfinance", "symbols": ["MSFT"], "from": "2022-01-01"}))
+    info = flight_client.get_flight_info(descriptor)
+    table = flight_client.do_get(info.endpoints[0].ticket).read_all()
+    assert table.column("c").to_pylist() == [2.0]
+
+
+def test_flight_empty_result(flight_client):
+    # the stream of a range without data has the schema announced by the flight info
+    descriptor = flight.FlightDescriptor.for_command(json.dumps({"source": "yfinance", "symbols": ["MSFT"], "from": "2030-01-01"}))
+    info = flight_client.get_flight_info(descriptor)
+    table = flight_client.do_get(info.endpoints[0].ticket).read_all()
+    assert table.num_rows == 0
+    assert table.schema.equals(info.schema)
+
+    ticket = flight.Ticket(json.dumps({"source": "yfinance", "symbols": ["MSFT"], "from": "2030-01-01"}))
+    assert flight_client.do_get(ticket).read_all().schema.equals(info.schema)
+
+
+def test_flight_admission(sqlite_db):
+    admission = AdmissionControl(max_per_client=1)
+    server = OhlcvFlightServer("grpc://127.0.0.1:0", admission=admission)
+    client = flight.connect(f"grpc://127.0.0.1:{server.port}")
+    try:
+        descriptor = flight.FlightDescriptor.for_command(json.dumps({"source": "yfinance", "symbols": ["MSFT"]}))
+        info = client.get_flight_info(descriptor)
+        assert client.do_get(info.endpoints[0].ticket).read_all().num_rows == 2
+        server._run(asyncio.sleep(0))
+        assert admission.active == 0
+
+        # the flights of a client exceeding its share are rejected
+        admission.max_per_client = 0
+        with pytest.raises(flight.FlightUnavailableError):
+            client.get_flight_info(descriptor)
+        with pytest.raises(flight.FlightUnavailableError):
+            client.do_get(info.endpoints[0].ticket).read_all()
+    finally:
+        client.close()
+        server.shutdown()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+
+from serve.dataaccess import database, mirror, ohlcv
+from serve.dataaccess.mirror import ParquetMirror
+from serve.dataaccess.selection import Selection
+
+
+def test_export_and_query(sqlite_db, monkeypatch):
+    # sqlite has no commits to read the table as of
+    monkeypatch.setattr(ParquetMirror, "_snapshot", lambda self, commit: self.table)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        quotes = ParquetMirror(tmp, "yfinance_quote", export_chunk_rows=2)
+        quotes.export("commit-1")
+        assert quotes.is_current("commit-1")
+        assert os.path.exists(os.path.join(tmp, "yfinance_quote", "commit-1", "symbol_key=MSFT", "year=2022"))
+
+        df = quotes.query(["MSFT", "AAPL"], Selection("epoch > 1640995200"))
+        assert df["symbol"].tolist() == ["MSFT"]
+        assert df["c"].tolist() == [2.0]
+        assert "symbol_key" not in df.columns and "year" not in df.columns
+
+        df = quotes.query(["MSFT"], Selection(columns=("c",), start=pd.Timestamp("2022-01-01")))
+        assert df["c"].tolist() == [2.0]
+        assert df.columns.tolist() == ["symbol", "epoch", "tzinfo", "c"]
+
+        df = quotes.query(["MSFT"], Selection(columns=("c",), freq="M"))
+        assert df["c"].tolist() == [1.0, 2.0]
+
+        df = quotes.query(["XXXX"])
+        assert len(df) == 0
+        assert "symbol" in df.columns
+
+        df = quotes.query(["XXXX"], Selection(columns=("symbol", "c")))
+        assert df.columns.tolist() == ["symbol", "epoch", "tzinfo", "c"]
+
+        # a new process picks up the existing export
+        assert ParquetMirror(tmp, "yfinance_quote").is_current("commit-1")
+
+
+@pytest.mark.asyncio
+async def test_duckdb_backend(sqlite_db, monkeypatch):
+    async def _current_commit(*args, **kwargs):
+        return "commit-1"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(ParquetMirror, "_snapshot", lambda self, commit: self.table)
+        monkeypatch.setattr(mirror, "current_commit", _current_commit)
+        monkeypatch.setattr(mirror, "mirrors", {})
+        monkeypatch.setitem(database.get_settings(), "backend", "duckdb")
+        monkeypatch.setitem(database.get_settings(), "mirror", {"path": tmp})
+
+        # the first query is answered by sql while the mirror is exported in the background
+        assert await mirror.get_mirror("yfinance_quote") is None
+        expected = await ohlcv._fetch("yfinance", ["MSFT", "AAPL"], Selection())
+        await mirror.refreshing["yfinance_quote"]
+
+        assert await mirror.get_mirror("yfinance_quote") is not None
+        frames = await ohlcv._fetch("yfinance", ["MSFT", "AAPL"], Selection())
+        for symbol in ["MSFT", "AAPL"]:
+            pd.testing.assert_frame_equal(frames[symbol].reset_index(drop=True), expected[symbol].reset_index(drop=True), check_dtype=False)
+            assert frames[symbol].index.equals(expected[symbol].index)
+
+
+def test_export_snapshot():
+    with tempfile.TemporaryDirectory() as tmp:
+        commit = "0123456789abcdefghijklmnopqrstuv"
+        assert ParquetMirror(tmp, "yfinance_quote")._snapshot(commit) == f"yfinance_quote as of '{commit}'"
@@ -0,0 +1,116 @@
+import pandas as pd
+import pytest
+
+from serve.dataaccess import database, ohlcv, timeindex
+from serve.dataaccess.ohlcv import fetch_ohlcv
+from serve.dataaccess.selection import Selection, parse_date
+from serve.errors import BadRequest
+
+
+@pytest.mark.asyncio
+async def test_fetch_batched(sqlite_db, monkeypatch):
+    queries = []
+    read_sql = database.read_sql
+
+    async def _counting_read_sql(query, params=None, key=None, commit=None):
+        queries.append(query)
+        return await read_sql(query, params, key, commit)
+
+    monkeypatch.setattr(ohlcv, "read_sql", _counting_read_sql)
+
+    frames = await ohlcv._fetch("yfinance", ["msft", "AAPL", "XXXX"], Selection())
+    assert len(queries) == 1
+    assert list(frames.keys()) == ["msft", "AAPL", "XXXX"]
+    assert frames["msft"]["c"].tolist() == [1.0, 2.0]
+    assert frames["AAPL"]["c"].tolist() == [3.0]
+    assert len(frames["XXXX"]) == 0
+    assert isinstance(frames["XXXX"].index, pd.DatetimeIndex)
+
+
+@pytest.mark.asyncio
+async def test_fetch_chunked(sqlite_db, monkeypatch):
+    monkeypatch.setitem(database.get_settings(), "max_symbols_per_query", 1)
+
+    frames = await ohlcv._fetch("yfinance", ["MSFT", "AAPL"], Selection())
+    assert frames["MSFT"]["c"].tolist() == [1.0, 2.0]
+    assert frames["AAPL"]["c"].tolist() == [3.0]
+
+
+@pytest.mark.asyncio
+async def test_fetch_ohlcv_axis(sqlite_db):
+    df = await fetch_ohlcv({"yfinance": ["MSFT", "AAPL"]}, "1=1", 0)
+    assert df.index.get_level_values(0).unique().tolist() == ["MSFT", "AAPL"]
+    assert isinstance(df.index.get_level_values(1), pd.DatetimeIndex)
+
+    df = await fetch_ohlcv({"yfinance": ["MSFT", "AAPL"]}, "1=1", 1)
+    assert df.columns.get_level_values(0).unique().tolist() == ["MSFT", "AAPL"]
+    assert len(df) == 2
+
+
+@pytest.mark.asyncio
+async def test_fetch_where_with_colon(sqlite_db):
+    # colons of the where clause are no bind parameters
+    df = await fetch_ohlcv({"yfinance": ["MSFT"]}, "tzinfo <> ':mars'", 0)
+    assert df["c"].tolist() == [1.0, 2.0]
+
+
+def test_to_datetime_index():
+    index = timeindex.to_datetime_index(pd.Series([1640995200, 1641081600]), pd.Series(["America/New_York", "America/New_York"]))
+    assert str(index.tz) == "America/New_York"
+    assert index[0] == pd.Timestamp("2021-12-31 19:00", tz="America/New_York")
+
+    # unknown or mixed timezones stay in UTC
+    assert str(timeindex.to_datetime_index(pd.Series([1640995200]), pd.Series(["Mars/Olympus"])).tz) == "UTC"
+    assert str(timeindex.to_datetime_index(pd.Series([1640995200, 1640995200]), pd.Series(["UTC", "Europe/Zurich"])).tz) == "UTC"
+
+
+@pytest.mark.asyncio
+async def test_fetch_resampled(sqlite_db):
+    df = await fetch_ohlcv({"yfinance": ["MSFT"]}, "1=1", 0, "M")
+    assert df["c"].tolist() == [1.0, 2.0]
+    assert df.index.tolist() == [pd.Timestamp("2021-12-01", tz="America/New_York"), pd.Timestamp("2022-01-01", tz="America/New_York")]
+
+
+@pytest.mark.asyncio
+async def test_fetch_projected_range(sqlite_db):
+    # the second MSFT quote is 2022-01-01 19:00 in new york
+    df = await fetch_ohlcv({"yfinance": ["MSFT"]}, None, 0, columns=("c",), start=pd.Timestamp("2022-01-01"))
+    assert df.columns.tolist() == ["c"]
+    assert df["c"].tolist() == [2.0]
+
+    df = await fetch_ohlcv({"yfinance": ["MSFT"]}, None, 0, end=pd.Timestamp("2021-12-31 23:59:59"))
+    assert df["c"].tolist() == [1.0]
+
+    # the first MSFT quote is 2021-12-31 19:00 in new york, a month selects all of its days
+    df = await fetch_ohlcv({"yfinance": ["MSFT"]}, None, 0, end=parse_date("2021-12", end=True))
+    assert df["c"].tolist() == [1.0]
+
+    with pytest.raises(BadRequest):
+        await fetch_ohlcv({"yfinance": ["MSFT"]}, None, 0, columns=("c", "nope"))
+
+
+@pytest.mark.asyncio
+async def test_stream_ohlcv(sqlite_db, monkeypatch):
+    monkeypatch.setitem(database.get_settings(), "max_symbols_per_query", 1)
+
+    frames = [df async for df in ohlcv.stream_ohlcv({"yfinance": ["msft", "AAPL", "XXXX"]})]
+    assert len(frames) == 3
+    assert frames[0]["symbol"].tolist() == ["MSFT", "MSFT"]
+    assert frames[0]["source"].tolist() == ["yfinance", "yfinance"]
+    assert frames[1]["c"].tolist() == [3.0]
+    assert len(frames[2]) == 0
+
+    # every chunk has the same columns and types, also an empty one
+    assert all(frame.dtypes.equals(frames[0].dtypes) for frame in frames)
+    assert str(frames[0].index.tz) == "UTC"
+
+
+@pytest.mark.asyncio
+async def test_fetch_ohlcv_layouts(sqlite_db):
+    df = await fetch_ohlcv({"yfinance": ["MSFT", "AAPL"]}, layout="long")
+    assert df["symbol"].tolist() == ["MSFT", "MSFT", "AAPL"]
+    assert df["c"].tolist() == [1.0, 2.0, 3.0]
+
+    df = await fetch_ohlcv({"yfinance": ["MSFT", "AAPL"]}, pivot="c")
+    assert df.columns.tolist() == ["MSFT", "AAPL"]
+    assert df.shape == (2, 2)
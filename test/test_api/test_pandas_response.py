@@ -0,0 +1,89 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from serve.datastream import pandas_response
+from serve.datastream.pandas_response import make_pandas_response
+from serve.datastream.writers import make_writer
+
+
+@pytest.mark.asyncio
+async def test_csv_chunks(frame):
+    chunks = await _collect(make_pandas_response(frame, "csv"))
+    assert len(chunks) == 4
+    assert b"".join(chunks).decode("UTF-8") == frame.to_csv()
+
+
+@pytest.mark.asyncio
+async def test_jsonl_chunks(frame):
+    chunks = await _collect(make_pandas_response(frame, "jsonl"))
+    lines = b"".join(chunks).decode("UTF-8").splitlines()
+    assert len(lines) == len(frame)
+    assert '"symbol":"MSFT"' in lines[0]
+
+
+@pytest.mark.asyncio
+async def test_parquet_row_groups(frame):
+    chunks = await _collect(make_pandas_response(frame, "parquet"))
+    assert len(chunks) > 1
+
+    data = io.BytesIO(b"".join(chunks))
+    assert pq.ParquetFile(data).num_row_groups == 4
+    pd.testing.assert_frame_equal(pd.read_parquet(data), frame)
+
+
+@pytest.mark.asyncio
+async def test_arrow_record_batches(frame):
+    generator, status, headers = make_pandas_response(frame, "arrow")
+    assert headers["Content-Type"] == "application/vnd.apache.arrow.stream"
+
+    reader = pa.ipc.open_stream(b"".join([chunk async for chunk in generator]))
+    batches = list(reader)
+    assert len(batches) == 4
+    pd.testing.assert_frame_equal(pa.Table.from_batches(batches).to_pandas(), frame)
+
+
+@pytest.mark.asyncio
+async def test_empty_frame(frame):
+    chunks = await _collect(make_pandas_response(frame.iloc[0:0], "parquet"))
+    assert len(pd.read_parquet(io.BytesIO(b"".join(chunks)))) == 0
+
+
+@pytest.mark.asyncio
+async def test_buffered_fallback(frame):
+    chunks = await _collect(make_pandas_response(frame, "pickle"))
+    pd.testing.assert_frame_equal(pd.read_pickle(io.BytesIO(b"".join(chunks))), frame)
+
+
+def test_buffered_empty_stream():
+    writer = make_writer("pickle")
+    assert len(pd.read_pickle(io.BytesIO(writer.close()))) == 0
+
+
+def test_unsupported_format(frame):
+    # rejected before the response starts, not while its body is streamed
+    with pytest.raises(ValueError):
+        make_pandas_response(frame, "foo")
+
+    with pytest.raises(ValueError):
+        make_writer("dict")
+
+
+async def _collect(response):
+    generator, status, headers = response
+    assert status == 200
+    return [chunk async for chunk in generator]
+
+
+@pytest.fixture()
+def frame(monkeypatch):
+    monkeypatch.setattr(pandas_response, "settings", {"chunk_rows": 3})
+    index = pd.MultiIndex.from_product(
+        [["MSFT", "AAPL"], pd.date_range("2022-01-01", periods=5, tz="America/New_York", name="time")],
+        names=["symbol", "time"]
+    )
+    return pd.DataFrame({"c": np.arange(10, dtype="float64"), "v": np.arange(10)}, index=index)
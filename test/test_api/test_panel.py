@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from serve.dataaccess.panel import build_panel, pivot_panel, parse_layout
+
+
+def _frame(epochs, close, tz="America/New_York", **columns):
+    index = pd.DatetimeIndex(pd.to_datetime(epochs, unit="s", utc=True), name="time").tz_convert(tz)
+    return pd.DataFrame({"epoch": epochs, "c": close, **columns}, index=index)
+
+
+def test_build_panel():
+    panel = build_panel([
+        ("MSFT", _frame([1640995200, 1641081600], [1.0, 2.0], v=[10, 20])),
+        ("AAPL", _frame([1640995200], [3.0], v=[None])),
+        ("XXXX", _frame([], [])),
+    ])
+
+    assert panel["symbol"].tolist() == ["MSFT", "MSFT", "AAPL"]
+    assert panel["symbol"].cat.categories.tolist() == ["MSFT", "AAPL", "XXXX"]
+    assert panel["c"].dtype == np.float32
+    assert panel["epoch"].dtype == np.int64
+    # volumes with gaps can not be integers
+    assert panel["v"].dtype == np.float64
+    assert np.isnan(panel["v"].iloc[2])
+    assert str(panel.index.tz) == "UTC"
+    assert panel.index[0] == pd.Timestamp(1640995200, unit="s", tz="UTC")
+
+
+def test_pivot_panel():
+    # daily bars of different timezones share the local date of the calendar
+    wide = pivot_panel([
+        ("MSFT", _frame([1640995200 + 5 * 3600, 1641081600 + 5 * 3600], [1.0, 2.0])),
+        ("SAP", _frame([1641081600 - 3600], [3.0], tz="Europe/Berlin")),
+    ], "c")
+
+    assert wide.columns.tolist() == ["MSFT", "SAP"]
+    assert wide.index.tolist() == [pd.Timestamp("2022-01-01"), pd.Timestamp("2022-01-02")]
+    assert wide["MSFT"].tolist() == [1.0, 2.0]
+    assert np.isnan(wide["SAP"].iloc[0]) and wide["SAP"].iloc[1] == 3.0
+
+    with pytest.raises(ValueError):
+        pivot_panel([("MSFT", _frame([1640995200], [1.0]))], "x")
+
+
+def test_parse_layout():
+    assert parse_layout(None) == "wide"
+    assert parse_layout("long") == "long"
+    with pytest.raises(ValueError):
+        parse_layout("tall")
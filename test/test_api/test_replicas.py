@@ -0,0 +1,84 @@
+import os
+import shutil
+
+import pytest
+from sqlalchemy import create_engine
+
+from serve.dataaccess import database
+from serve.dataaccess.replicas import ReplicaSet
+
+
+@pytest.fixture()
+def replicated_db(sqlite_db):
+    # a copy of the database as replica and one which can not be reached
+    primary = sqlite_db[len("sqlite:///"):]
+    shutil.copy(primary, primary + ".replica")
+    database.init({
+        "url": sqlite_db,
+        "replicas": [{"url": sqlite_db + ".replica"}, {"url": f"sqlite:///{os.path.dirname(primary)}/missing/findb.sqlite"}],
+        "health_check_interval": 3600,
+    })
+    yield database.replicas
+    database.dispose()
+
+
+def test_consistent_hash_routing(tmp_path):
+    engines = [create_engine(f"sqlite:///{tmp_path}/replica{i}.sqlite") for i in range(3)]
+    replicas = ReplicaSet(engines, check_interval=3600)
+    routes = {symbol: replicas.route(symbol)[0] for symbol in [f"S{i}" for i in range(300)]}
+    assert len(set(routes.values())) == 3
+    assert all(replicas.route(symbol)[0] is replica for symbol, replica in routes.items())
+
+    # without a replica only its symbols move
+    smaller = ReplicaSet(engines[:2], check_interval=3600)
+    for symbol, replica in routes.items():
+        if replica.engine is not engines[2]:
+            assert smaller.route(symbol)[0].engine is replica.engine
+
+    replicas.dispose()
+    smaller.dispose()
+
+
+@pytest.mark.asyncio
+async def test_failover(replicated_db):
+    missing = replicated_db.replicas[2]
+
+    # every symbol finds its data, symbols routed to the missing replica fail over
+    for symbol in [f"S{i}" for i in range(20)]:
+        df = await database.read_sql("select * from yfinance_quote where symbol = :symbol", {"symbol": "MSFT"}, symbol)
+        assert len(df) == 2
+
+    assert not missing.healthy
+    assert all(replica.healthy for replica in replicated_db.replicas[:2])
+    assert replicated_db.route("S0")[-1] is missing
+
+    # broken queries are not failed over
+    with pytest.raises(Exception):
+        await database.read_sql("select * from missing_table", None, "S0")
+    assert replicated_db.replicas[0].healthy and replicated_db.replicas[1].healthy
+
+    replicated_db.check()
+    assert not missing.healthy
+
+
+def test_lagging_replicas_and_partitions(tmp_path):
+    engines = [create_engine(f"sqlite:///{tmp_path}/replica{i}.sqlite") for i in range(3)]
+    replicas = ReplicaSet(engines, check_interval=3600)
+    replicas.check()
+    primary, behind, current = replicas.replicas
+    behind.head, current.head = "old", "new"
+
+    # replicas which did not replicate the commit yet are tried last, the primary is always at the commit
+    for symbol in [f"S{i}" for i in range(50)]:
+        route = replicas.route(symbol, "new")
+        assert route[-1] is behind and route[0] in (primary, current)
+        assert replicas.route(symbol)[0] is replicas.route(symbol, None)[0]
+
+    # every symbol of a partition is routed to the same replica as the partition
+    symbols = [f"S{i}" for i in range(100)]
+    groups = replicas.partition(symbols)
+    assert sorted(symbol for group in groups for symbol in group) == sorted(symbols)
+    for group in groups:
+        assert all(replicas.route(symbol)[0] is replicas.route(group[0])[0] for symbol in group)
+
+    replicas.dispose()
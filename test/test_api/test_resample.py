@@ -0,0 +1,63 @@
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+
+from serve.dataaccess.resample import resample, duckdb_resample, parse_freq
+
+
+def test_parse_freq():
+    assert parse_freq("w") == "W"
+    assert parse_freq("5D") == "5D"
+    assert parse_freq(None) is None
+
+    with pytest.raises(ValueError):
+        parse_freq("1=1; drop table yfinance_quote")
+
+
+def test_weekly_bars(quotes):
+    df = resample(quotes, "W")
+    msft = df[df["symbol"] == "MSFT"]
+
+    # 2022-01-03 is a monday, the 14 days span two full weeks
+    assert len(msft) == 2
+    assert msft["o"].tolist() == [0.0, 7.0]
+    assert msft["c"].tolist() == [6.0, 13.0]
+    assert msft["h"].tolist() == [6.5, 13.5]
+    assert msft["l"].tolist() == [-0.5, 6.5]
+    assert msft["v"].tolist() == [7 * 100, 7 * 100]
+    assert msft["dividend"].tolist() == [0.5, 0.0]
+    assert msft["split"].tolist() == [0.0, 4.0]
+    assert pd.to_datetime(msft["epoch"], unit="s", utc=True).dt.tz_convert("America/New_York").tolist() == \
+        [pd.Timestamp("2022-01-03", tz="America/New_York"), pd.Timestamp("2022-01-10", tz="America/New_York")]
+
+
+@pytest.mark.parametrize("freq", ["W", "M", "Q", "3D"])
+def test_duckdb_same_as_pandas(quotes, freq):
+    expected = resample(quotes, freq)
+    actual = duckdb.connect().execute(duckdb_resample("quotes", "1=1", freq, quotes.columns)).df()
+
+    expected = expected.sort_values(["symbol", "epoch"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual[expected.columns], expected, check_dtype=False)
+
+
+@pytest.fixture()
+def quotes():
+    # two weeks of daily quotes starting monday 2022-01-03 in new york and zurich
+    frames = []
+    for symbol, tz in [("MSFT", "America/New_York"), ("NESN.SW", "Europe/Zurich")]:
+        days = pd.date_range("2022-01-03", periods=14, freq="D", tz=tz)
+        frames.append(pd.DataFrame({
+            "symbol": symbol,
+            "epoch": days.as_unit("s").asi8,
+            "o": np.arange(14, dtype="float64"),
+            "h": np.arange(14) + 0.5,
+            "l": np.arange(14) - 0.5,
+            "c": np.arange(14, dtype="float64"),
+            "v": 100,
+            "dividend": [0.5] + [0.0] * 13,
+            "split": [0.0] * 8 + [2.0, 0.0, 2.0] + [0.0] * 3,
+            "tzinfo": tz,
+        }))
+
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,50 @@
+import tempfile
+
+import pytest
+
+from serve.cache.response_cache import ResponseCache
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    cache = ResponseCache(max_size=10, max_entry_size=8)
+    await cache.put("a", b"aaaa", {})
+    await cache.put("b", b"bbbb", {})
+    assert (await cache.get("a")).content == b"aaaa"
+
+    # b is the least recently used entry
+    await cache.put("c", b"cccc", {})
+    assert await cache.get("b") is None
+    assert await cache.get("a") is not None
+    assert cache.size == 8
+
+    # entries exceeding the maximum entry size are not cached at all
+    await cache.put("d", b"d" * 9, {})
+    assert await cache.get("d") is None
+
+
+@pytest.mark.asyncio
+async def test_disk_tier():
+    with tempfile.TemporaryDirectory() as tmp:
+        await ResponseCache(path=tmp).put("a", b"aaaa", {"Content-Type": "text/csv"})
+
+        # a second cache i.e. of another worker process finds the entry on disk
+        entry = await ResponseCache(path=tmp).get("a")
+        assert entry.content == b"aaaa"
+        assert entry.headers == {"Content-Type": "text/csv"}
+
+
+@pytest.mark.asyncio
+async def test_tee():
+    async def generator():
+        yield b"a"
+        yield b"b"
+
+    cache = ResponseCache()
+    assert [chunk async for chunk in cache.tee("key", generator(), {})] == [b"a", b"b"]
+    assert (await cache.get("key")).content == b"ab"
+
+
+def test_make_key():
+    assert ResponseCache.make_key("x", {"yfinance": ["MSFT"]}, "1=1") == ResponseCache.make_key("x", {"yfinance": ["MSFT"]}, "1=1")
+    assert ResponseCache.make_key("x", {"yfinance": ["MSFT"]}, "1=1") != ResponseCache.make_key("y", {"yfinance": ["MSFT"]}, "1=1")
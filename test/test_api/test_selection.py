@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+from serve.dataaccess.selection import Selection, parse_columns, parse_date
+
+
+def test_parse_columns():
+    assert parse_columns("o, c,v") == ("o", "c", "v")
+    assert parse_columns(None) is None
+
+    with pytest.raises(ValueError):
+        parse_columns("c, (select 1)")
+
+
+def test_check_columns():
+    Selection(columns=("c", "symbol")).check_columns(("symbol", "epoch", "c"))
+    Selection().check_columns(("symbol", "epoch", "c"))
+
+    with pytest.raises(ValueError):
+        Selection(columns=("c", "nope")).check_columns(("symbol", "epoch", "c"))
+
+
+def test_parse_date():
+    assert parse_date("2010-01-01") == pd.Timestamp("2010-01-01")
+    assert parse_date("2010-01-31", end=True) == pd.Timestamp("2010-01-31 23:59:59")
+    assert parse_date("2010-01-31T12:00", end=True) == pd.Timestamp("2010-01-31 12:00")
+
+    # partial dates end with the month or year they name
+    assert parse_date("2010-02", end=True) == pd.Timestamp("2010-02-28 23:59:59")
+    assert parse_date("2010", end=True) == pd.Timestamp("2010-12-31 23:59:59")
+    assert parse_date("2010-02") == pd.Timestamp("2010-02-01")
+
+    with pytest.raises(ValueError):
+        parse_date("yesterday")
+
+
+def test_sql_predicate():
+    predicate, params = Selection("v > 0", ("c",), pd.Timestamp("2022-01-01"), pd.Timestamp("2022-01-31 23:59:59")).sql_predicate()
+    assert predicate == "(v > 0) and epoch >= :epoch_from and epoch <= :epoch_to"
+    assert params == {"epoch_from": 1640995200 - 86400, "epoch_to": 1643673599 + 86400}
+
+    assert Selection("t <> 'a:b'").sql_predicate()[0] == "(t <> 'a\\:b')"
+    assert Selection("t <> 'a:b'").duckdb_predicate()[0] == "(t <> 'a:b')"
+
+    assert Selection(columns=("c", "symbol")).sql_columns() == "symbol, epoch, tzinfo, c"
+    assert Selection().sql_columns() == "*"
+
+
+def test_filter_range():
+    # midnight in new york and tokyo of 2022-01-01 and 2022-01-02
+    df = pd.DataFrame({
+        "epoch": [1641013200, 1641099600, 1640962800, 1641049200],
+        "tzinfo": ["America/New_York", "America/New_York", "Asia/Tokyo", "Asia/Tokyo"],
+    })
+
+    selection = Selection(start=parse_date("2022-01-02"), end=parse_date("2022-01-02", end=True))
+    assert selection.filter_range(df).index.tolist() == [1, 3]
+
+
+def test_sql_table_as_of():
+    assert Selection().sql_table("yfinance_quote") == "yfinance_quote"
+    assert Selection(as_of="0123456789abcdefghijklmnopqrstuv").sql_table("yfinance_quote") == \
+        "yfinance_quote as of '0123456789abcdefghijklmnopqrstuv'"
+
+    with pytest.raises(ValueError):
+        Selection(as_of="main' --").sql_table("yfinance_quote")
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from serve.cache.single_flight import SingleFlight
+
+
+async def _body(started: asyncio.Event, release: asyncio.Event):
+    started.set()
+    await release.wait()
+    yield b"a"
+    yield b"b"
+
+
+@pytest.mark.asyncio
+async def test_followers_share_the_response():
+    flights = SingleFlight()
+    started, release = asyncio.Event(), asyncio.Event()
+
+    flight, leading = flights.start("key")
+    assert leading
+    body = flights.share("key", flight, _body(started, release), {"Content-Type": "text/csv"})
+
+    # requests arriving while the first one is in flight await its bytes
+    followers = []
+    for _ in range(3):
+        follower, leading = flights.start("key")
+        assert follower is flight and not leading
+        followers.append(asyncio.ensure_future(flights.wait("key", follower)))
+
+    leader = asyncio.ensure_future(_collect(body))
+    await started.wait()
+    release.set()
+
+    assert await leader == b"ab"
+    for entry in await asyncio.gather(*followers):
+        assert entry.content == b"ab"
+        assert entry.headers == {"Content-Type": "text/csv"}
+
+    # the flight is over, the next request leads again
+    assert flights.start("key")[1]
+
+
+@pytest.mark.asyncio
+async def test_abandoned_and_oversized_flights():
+    flights = SingleFlight(max_size=1)
+    flight, _ = flights.start("failed")
+    follower = asyncio.ensure_future(flights.wait("failed", flights.start("failed")[0]))
+    flights.abandon("failed", flight)
+    assert await follower is None
+
+    # responses larger than the maximum size are not handed to the followers
+    started, release = asyncio.Event(), asyncio.Event()
+    release.set()
+    flight, _ = flights.start("large")
+    follower = asyncio.ensure_future(flights.wait("large", flights.start("large")[0]))
+    assert await _collect(flights.share("large", flight, _body(started, release), {})) == b"ab"
+    assert await follower is None
+
+
+@pytest.mark.asyncio
+async def test_unsent_and_stuck_flights():
+    flights = SingleFlight(timeout=0.05)
+    started, release = asyncio.Event(), asyncio.Event()
+
+    # a body closed before it was sent ends the flight
+    flight, _ = flights.start("unsent")
+    follower = asyncio.ensure_future(flights.wait("unsent", flights.start("unsent")[0]))
+    await flights.share("unsent", flight, _body(started, release), {}).aclose()
+    assert await follower is None
+    assert not started.is_set() and "unsent" not in flights.flights
+
+    # followers give up a stuck leader and the next request leads a new flight, the old leader does not end it
+    stuck, _ = flights.start("stuck")
+    assert await flights.wait("stuck", flights.start("stuck")[0]) is None
+    flight, leading = flights.start("stuck")
+    assert leading and flight is not stuck
+    flights.abandon("stuck", stuck)
+    assert flights.flights["stuck"] is flight
+
+
+async def _collect(generator) -> bytes:
+    return b"".join([chunk async for chunk in generator])
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from serve import watcher
+from serve.dataaccess import commit
+from serve.cache.response_cache import ResponseCache
+from serve.utils.request_util import get_data_args
+from serve.watcher import CommitWatcher, RequestLog
+
+
+def test_request_log():
+    log = RequestLog(max_size=2)
+    args = get_data_args({})
+    log.record({"yfinance": ["MSFT"]}, args)
+    log.record({"yfinance": ["AAPL"]}, args)
+    log.record({"yfinance": ["AAPL"]}, args)
+    assert log.most_requested() == [({"yfinance": ["AAPL"]}, args), ({"yfinance": ["MSFT"]}, args)]
+
+    # the least recently made request is forgotten first
+    log.record({"yfinance": ["IBM"]}, args)
+    assert [symbols for symbols, _ in log.most_requested()] == [{"yfinance": ["AAPL"]}, {"yfinance": ["IBM"]}]
+
+
+@pytest.mark.asyncio
+async def test_refresh(monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr(watcher, "get_cache", lambda: cache)
+    rendered = []
+
+    async def render(symbols, args, commit):
+        rendered.append((symbols, commit))
+
+        async def body():
+            yield b"new"
+
+        return body(), 200, {"Content-Type": "text/csv"}
+
+    async def changed_symbols(old, new, sources):
+        assert (old, new, sources) == ("old", "new", {"yfinance"})
+        return {"yfinance": {"AAPL"}}
+
+    commit_watcher = CommitWatcher(render)
+    monkeypatch.setattr(commit_watcher, "changed_symbols", changed_symbols)
+    args = get_data_args({})
+    for symbols in ({"yfinance": ["MSFT"]}, {"yfinance": ["AAPL", "IBM"]}):
+        commit_watcher.log.record(symbols, args)
+        await cache.put(ResponseCache.make_key("old", symbols, args), b"old", {})
+
+    await commit_watcher.refresh("old", "new")
+
+    # unchanged responses move to the new commit, the changed ones are rendered again
+    assert (await cache.get(ResponseCache.make_key("new", {"yfinance": ["MSFT"]}, args))).content == b"old"
+    assert (await cache.get(ResponseCache.make_key("new", {"yfinance": ["AAPL", "IBM"]}, args))).content == b"new"
+    assert rendered == [({"yfinance": ["AAPL", "IBM"]}, "new")]
+    assert await cache.get(ResponseCache.make_key("old", {"yfinance": ["MSFT"]}, args)) is None
+
+
+@pytest.mark.asyncio
+async def test_single_watcher_of_workers(tmp_path, monkeypatch):
+    async def query_head():
+        return "head"
+
+    monkeypatch.setattr(commit, "query_head", query_head)
+    monkeypatch.setattr(commit, "followed", None)
+    watching = []
+
+    class Watcher(CommitWatcher):
+        async def run(self):
+            watching.append(self)
+            await asyncio.Event().wait()
+
+    # workers share the lock file, the next one takes over once the watching one stopped
+    lock_path = str(tmp_path / "watcher.lock")
+    first, second = Watcher(None, interval=0.01), Watcher(None, interval=0.01)
+    tasks = [asyncio.ensure_future(watcher._watch(first, lock_path)), asyncio.ensure_future(watcher._watch(second, lock_path))]
+    await asyncio.sleep(0.05)
+    assert watching == [first]
+
+    assert commit.followed == str(tmp_path / "watcher.lock.commit")
+
+    # the worker taking over starts at the commit published by the previous one
+    (tmp_path / "watcher.lock.commit").write_text("published")
+    tasks[0].cancel()
+    await asyncio.sleep(0.05)
+    assert watching == [first, second]
+    assert second.commit == "published"
+    assert commit.followed is None
+    tasks[1].cancel()
+    commit.reset()
+
+
+@pytest.mark.asyncio
+async def test_publish_to_workers(tmp_path, monkeypatch):
+    async def query_head():
+        return "head"
+
+    monkeypatch.setattr(watcher, "query_head", query_head)
+    monkeypatch.setattr(commit, "query_head", query_head)
+    monkeypatch.setattr(commit, "followed", None)
+    published = str(tmp_path / "watcher.lock.commit")
+
+    # workers which do not watch use the head until the watcher published a commit
+    commit.follow(published)
+    assert await commit.current_commit(0) == "head"
+    (tmp_path / "watcher.lock.commit").write_text("published")
+    assert await commit.current_commit(0) == "published"
+
+    commit_watcher = CommitWatcher(None, interval=0.01)
+    commit_watcher.published = published
+    task = asyncio.ensure_future(commit_watcher.run())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    assert (tmp_path / "watcher.lock.commit").read_text() == "head"
+    commit.reset()
@@ -1,11 +1,12 @@
 import os
 import os
 import tempfile
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import pandas as pd
+from click.testing import CliRunner
 
-from commands.yfinance.quote import _fetch_data, download_parallel
+from commands.yfinance.quote import cli, _batches, _fetch_batch, _fetch_data, _parse_state, _split_batch, download_parallel
 
 
 class TestQuote(TestCase):
@@ -34,3 +35,70 @@ class TestQuote(TestCase):
 
             df = pd.read_csv(os.path.join(tmp, 'XXXXXXXXX.csv.meta.csv'))
             self.assertEqual(len(df), 1)
+
+    def test_unsupported_upsert(self):
+        with mock.patch("commands.yfinance.quote._select_last_state") as select:
+            result = CliRunner().invoke(cli, ["-d", "sqlite:///fin.db.sqlite", "--upsert", "on_duplicate"])
+
+        # sqlite only supports replace, the command fails before it downloads anything
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("--upsert", result.output)
+        select.assert_not_called()
+
+    def test__batches(self):
+        last_state = pd.DataFrame([
+            {"symbol": "AAPL", "first_quote_epoch": 1.6e9, "last_quote_epoch": 1.7e9, "tz_info": 'US/Eastern', "delisted": 0},
+            {"symbol": "MSFT", "first_quote_epoch": 1.6e9, "last_quote_epoch": 1.7e9, "tz_info": 'US/Eastern', "delisted": 0},
+            {"symbol": "IBM", "first_quote_epoch": 1.6e9, "last_quote_epoch": 1.7e9, "tz_info": 'US/Eastern', "delisted": 0},
+            {"symbol": "NEW", "first_quote_epoch": None, "last_quote_epoch": None, "tz_info": 'US/Eastern', "delisted": 0},
+        ])
+
+        # symbols sharing a start date are fetched together
+        batches = _batches(last_state, 2)
+        self.assertListEqual([[state[0] for state in batch] for batch in batches], [["AAPL", "MSFT"], ["IBM"], ["NEW"]])
+
+    def test__split_batch(self):
+        index = pd.DatetimeIndex(["2021-01-04", "2021-01-05"], name="Date")
+        data = pd.concat(
+            {
+                "AAPL": pd.DataFrame({"Open": [1.0, 2.0], "Close": [1.0, 2.0]}, index=index),
+                "MSFT": pd.DataFrame({"Open": [None, 3.0], "Close": [None, 3.0]}, index=index),
+            },
+            axis=1
+        )
+
+        self.assertEqual(len(_split_batch(data, "AAPL")), 2)
+        self.assertEqual(len(_split_batch(data, "MSFT")), 1)
+        self.assertEqual(len(_split_batch(data, "IBM")), 0)
+        self.assertEqual(len(_split_batch(None, "IBM")), 0)
+
+    def test__fetch_batch(self):
+        states = [
+            _parse_state({"symbol": symbol, "first_quote_epoch": None, "last_quote_epoch": None, "tz_info": 'US/Eastern', "delisted": 0})
+            for symbol in ["AAPL", "MSFT", "IBM"]
+        ]
+        index = pd.DatetimeIndex(["2021-01-04", "2021-01-05"], name="Date")
+        data = pd.concat(
+            {
+                "AAPL": pd.DataFrame({"Open": [1.0, 2.0], "Close": [1.0, 2.0]}, index=index),
+                "MSFT": pd.DataFrame({"Open": [None, None], "Close": [None, None]}, index=index),
+                "IBM": pd.DataFrame({"Open": [None, None], "Close": [None, None]}, index=index),
+            },
+            axis=1
+        )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # a failed request stores nothing, the symbols are not marked as delisted
+            with mock.patch("commands.yfinance.quote.download", side_effect=Exception("rate limited")):
+                self.assertListEqual(_fetch_batch(None, states, tmp), ["failed AAPL", "failed MSFT", "failed IBM"])
+            self.assertListEqual(os.listdir(tmp), [])
+
+            # symbols without data in the batch are asked for again, MSFT fails and IBM has no prices
+            history = {"MSFT": None, "IBM": pd.DataFrame({})}
+            with mock.patch("commands.yfinance.quote.download", return_value=data), \
+                    mock.patch("commands.yfinance.quote._history", side_effect=lambda symbol, start: history[symbol]):
+                self.assertListEqual(_fetch_batch(None, states, tmp), ["AAPL", "failed MSFT", "IBM"])
+
+            self.assertListEqual(sorted(os.listdir(tmp)), ["AAPL.csv", "AAPL.csv.meta.csv", "IBM.csv.meta.csv"])
+            self.assertEqual(pd.read_csv(os.path.join(tmp, "IBM.csv.meta.csv"))["delisted"][0], 1)
+            self.assertEqual(pd.read_csv(os.path.join(tmp, "AAPL.csv.meta.csv"))["delisted"][0], 0)
@@ -0,0 +1,83 @@
+import time
+from threading import Event, Thread, Timer
+from unittest import TestCase
+
+import pandas as pd
+
+from modules.batch_writer import BatchWriter, WriterClosed
+
+
+class TestBatchWriter(TestCase):
+
+    def test_batches(self):
+        batches = []
+        with BatchWriter(batches.append, max_rows=4, max_delay=60) as writer:
+            for i in range(5):
+                writer.put("quote", pd.DataFrame({"symbol": [f"S{i}"] * 2}))
+                writer.put("meta", pd.DataFrame({"symbol": [f"S{i}"]}))
+
+        # a batch holds all tables once it reaches the rows, the rest is written on close
+        rows = [sum(len(df) for df in batch.values()) for batch in batches]
+        self.assertListEqual(rows, [5, 4, 5, 1])
+        self.assertListEqual(list(batches[0]), ["quote", "meta"])
+        self.assertEqual(sum(len(batch.get("quote", [])) for batch in batches), 10)
+
+        # rows put after close are rejected, the writer is the only one writing
+        self.assertRaises(WriterClosed, writer.put, "meta", pd.DataFrame({"symbol": ["late"]}))
+        self.assertEqual(len(batches), 4)
+
+    def test_delay_and_backpressure(self):
+        written, release = [], Event()
+
+        def write(batch):
+            release.wait()
+            written.append(batch)
+
+        writer = BatchWriter(write, max_rows=1000, max_delay=0.01, max_queue=1)
+        writer.put("quote", pd.DataFrame({"symbol": ["A"]}))
+        time.sleep(0.1)
+
+        # the writer is stuck, the queue fills up and blocks the producers
+        writer.put("quote", pd.DataFrame({"symbol": ["B"]}))
+        started = time.monotonic()
+        Timer(0.2, release.set).start()
+        writer.put("quote", pd.DataFrame({"symbol": ["C"]}))
+        writer.put("quote", pd.DataFrame({"symbol": ["D"]}))
+        self.assertGreater(time.monotonic() - started, 0.15)
+
+        writer.close()
+        self.assertListEqual([s for batch in written for s in batch["quote"]["symbol"]], ["A", "B", "C", "D"])
+
+    def test_close_while_producers_are_blocked(self):
+        written, release = [], Event()
+
+        def write(batch):
+            release.wait()
+            written.append(batch)
+
+        writer = BatchWriter(write, max_rows=1, max_queue=1)
+        writer.put("quote", pd.DataFrame({"symbol": ["A"]}))
+        writer.put("quote", pd.DataFrame({"symbol": ["B"]}))
+
+        # the producer blocked by the full queue does not block the close, its rows are written before the writer ends
+        blocked = Thread(target=writer.put, args=("quote", pd.DataFrame({"symbol": ["C"]})))
+        blocked.start()
+        time.sleep(0.05)
+        closing = Thread(target=writer.close)
+        closing.start()
+        time.sleep(0.05)
+        self.assertRaises(WriterClosed, writer.put, "quote", pd.DataFrame({"symbol": ["D"]}))
+
+        release.set()
+        blocked.join()
+        closing.join()
+        self.assertListEqual([s for batch in written for s in batch["quote"]["symbol"]], ["A", "B", "C"])
+
+    def test_errors(self):
+        def write(batch):
+            raise IOError("disk full")
+
+        writer = BatchWriter(write, max_rows=1)
+        writer.put("quote", pd.DataFrame({"symbol": ["A"]}))
+        writer.put("quote", pd.DataFrame({"symbol": ["B"]}))
+        self.assertRaises(IOError, writer.close)
@@ -0,0 +1,60 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from modules.df_utils import _get_engine, bulk_upsert, check_upsert_method, save_batch
+
+
+class TestDfUtils(TestCase):
+
+    def test_bulk_upsert(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'fin.db')}")
+            with engine.begin() as connection:
+                connection.execute(text("create table quote (symbol text, epoch int, c real, v int, primary key (symbol, epoch))"))
+
+                df = pd.DataFrame({"symbol": ["A", "A", "B"], "epoch": [1, 2, 1], "c": [1.0, np.nan, 3.0], "v": [10, 20, 30]})
+                bulk_upsert(df.set_index(["symbol", "epoch"]), "quote", connection, chunk_size=2)
+
+                # rows of existing keys are replaced
+                bulk_upsert(pd.DataFrame({"symbol": ["A"], "epoch": [2], "c": [2.0], "v": [21]}), "quote", connection)
+
+                rows = connection.execute(text("select * from quote order by symbol, epoch")).fetchall()
+                self.assertListEqual([tuple(row) for row in rows], [("A", 1, 1.0, 10), ("A", 2, 2.0, 21), ("B", 1, 3.0, 30)])
+
+                # NaN is stored as null, numpy integers as integers
+                bulk_upsert(df.iloc[[1]], "quote", connection)
+                self.assertEqual(tuple(connection.execute(text("select c, typeof(v) from quote where epoch = 2 and symbol = 'A'")).fetchone()), (None, "integer"))
+
+                self.assertRaises(ValueError, bulk_upsert, df, "quote", connection, "load_data")
+
+            engine.dispose()
+
+    def test_local_infile_only_for_load_data(self):
+        url = "mysql+pymysql://root:@localhost/test_local_infile"
+        with mock.patch("modules.df_utils.create_engine") as create:
+            _get_engine(url)
+            _get_engine(url, local_infile=True)
+            _get_engine(url)
+            _get_engine("sqlite:///test_local_infile.db", local_infile=True)
+
+        # the client only allows LOAD DATA LOCAL INFILE on the connections of load_data, every engine is created once
+        self.assertListEqual([call.kwargs["connect_args"] for call in create.call_args_list], [{}, {"local_infile": True}, {}])
+
+    def test_save_batch_method(self):
+        frames = {"quote": pd.DataFrame({"symbol": ["A"], "epoch": [1], "c": [1.0]})}
+        with mock.patch("modules.df_utils.frames_to_sql_with_replace") as upsert:
+            save_batch("mysql+pymysql://root:@localhost/findb", frames, {"quote": ["symbol", "epoch"]}, method="load_data", chunk_size=10)
+
+        self.assertEqual(upsert.call_args.args[2:], ("load_data", 10))
+
+    def test_check_upsert_method(self):
+        check_upsert_method("sqlite:///test_check_upsert_method.db", "replace")
+        check_upsert_method("mysql+pymysql://root:@localhost/findb", "load_data")
+        check_upsert_method(None, "load_data")
+
+        self.assertRaises(ValueError, check_upsert_method, "sqlite:///test_check_upsert_method.db", "on_duplicate")
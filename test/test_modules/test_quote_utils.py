@@ -0,0 +1,29 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from modules.quote_utils import normalize_quotes
+
+
+class TestQuoteUtils(TestCase):
+
+    def test_normalize_quotes(self):
+        tz_info = pytz.timezone('US/Eastern')
+        index = pd.DatetimeIndex(["2021-01-04", "2021-07-06"], name="Date")
+        df = pd.DataFrame({"Open": [1.0, 2.0], "High": [1.5, 2.5], "Low": [0.5, 1.5], "Close": [1.0, 2.0], "Volume": [10, 20], "Dividends": [0.0, 0.1]}, index=index)
+
+        df = normalize_quotes(df, "MSFT", tz_info)
+        self.assertListEqual(df.columns.tolist(), ["symbol", "epoch", "o", "h", "l", "c", "v", "dividend", "split"])
+        self.assertListEqual(df["symbol"].tolist(), ["MSFT", "MSFT"])
+
+        # local midnight of the exchange, in winter and summer time
+        self.assertListEqual(df["epoch"].tolist(), [int(tz_info.localize(d).timestamp()) for d in index.to_pydatetime()])
+        self.assertListEqual(df["v"].tolist(), [10, 20])
+        self.assertTrue(np.isnan(df["split"]).all())
+
+    def test_normalize_quotes_with_timezone(self):
+        index = pd.DatetimeIndex(["2021-01-04"]).tz_localize("Europe/Berlin")
+        df = normalize_quotes(pd.DataFrame({"Close": [1.0]}, index=index), "SAP", pytz.timezone('US/Eastern'))
+        self.assertListEqual(df["epoch"].tolist(), [int(index[0].timestamp())])
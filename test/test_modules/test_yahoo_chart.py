@@ -0,0 +1,107 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+import numpy as np
+from aiohttp import web
+
+from modules import yahoo_chart
+from modules.yahoo_chart import fetch_charts, parse_chart
+
+
+def _payload(symbol):
+    # 2021-01-04 and 2021-01-05 09:30 New York time, the second bar pays a dividend and adjusts the first one
+    return {"chart": {"result": [{
+        "meta": {"symbol": symbol, "exchangeTimezoneName": "America/New_York"},
+        "timestamp": [1609770600, 1609857000, 1609943400],
+        "events": {"dividends": {"1609857000": {"amount": 0.5, "date": 1609857000}}},
+        "indicators": {
+            "quote": [{"open": [10.0, 11.0, None], "high": [12.0, 13.0, None], "low": [9.0, 10.0, None], "close": [10.0, 12.0, None], "volume": [100, 200, None]}],
+            "adjclose": [{"adjclose": [9.5, 12.0, None]}]
+        }
+    }], "error": None}}
+
+
+class TestParseChart(TestCase):
+
+    def test_parse_chart(self):
+        df = parse_chart(_payload("MSFT"))
+
+        # the bar without prices is dropped, dates are local to the exchange
+        self.assertListEqual([str(d.date()) for d in df.index], ["2021-01-04", "2021-01-05"])
+        self.assertIsNone(df.index.tz)
+        np.testing.assert_allclose(df["Close"], [9.5, 12.0])
+        np.testing.assert_allclose(df["Open"], [9.5, 11.0])
+        np.testing.assert_allclose(df["Volume"], [100, 200])
+        np.testing.assert_allclose(df["Dividends"], [0.0, 0.5])
+        np.testing.assert_allclose(df["Stock Splits"], [0.0, 0.0])
+
+    def test_parse_empty_chart(self):
+        self.assertEqual(len(parse_chart(None)), 0)
+        self.assertEqual(len(parse_chart({"chart": {"result": None, "error": {"code": "Not Found"}}})), 0)
+
+
+class TestFetchCharts(IsolatedAsyncioTestCase):
+
+    async def test_fetch_charts(self):
+        calls = {}
+
+        async def chart(request):
+            symbol = request.match_info["symbol"]
+            calls[symbol] = calls.get(symbol, 0) + 1
+            if symbol == "BUSY" and calls[symbol] < 2:
+                return web.Response(status=429)
+
+            if symbol == "NONE":
+                return web.Response(status=404)
+
+            if symbol == "DENIED":
+                return web.Response(status=401)
+
+            if symbol == "BLOCKED":
+                return web.Response(status=403)
+
+            if symbol == "DOWN":
+                return web.Response(status=503)
+
+            if symbol == "TRUNCATED":
+                return web.Response(status=200, text='{"chart": {"res')
+
+            if symbol == "INVALID":
+                return web.json_response({"chart": {"result": [{"timestamp": [1609770600], "indicators": {"quote": "invalid"}}]}})
+
+            return web.json_response(_payload(symbol))
+
+        app = web.Application()
+        app.router.add_get("/chart/{symbol}", chart)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+
+        backoff, yahoo_chart.backoff = yahoo_chart.backoff, 0
+        try:
+            charts = {
+                symbol: df async for symbol, df in
+                fetch_charts(
+                    [(symbol, None) for symbol in ["MSFT", "BUSY", "NONE", "DENIED", "BLOCKED", "DOWN", "TRUNCATED", "INVALID"]],
+                    concurrency=2,
+                    url=f"http://127.0.0.1:{port}/chart/{{symbol}}"
+                )
+            }
+        finally:
+            yahoo_chart.backoff = backoff
+            await runner.cleanup()
+
+        self.assertEqual(len(charts["MSFT"]), 2)
+        self.assertEqual(len(charts["BUSY"]), 2)
+        self.assertEqual(calls["BUSY"], 2)
+        self.assertEqual(len(charts["NONE"]), 0)
+
+        # failed downloads are told apart from symbols without data
+        self.assertIsNone(charts["DENIED"])
+        self.assertEqual(calls["DENIED"], 1)
+        self.assertIsNone(charts["BLOCKED"])
+        self.assertIsNone(charts["DOWN"])
+        self.assertEqual(calls["DOWN"], 4)
+        self.assertIsNone(charts["TRUNCATED"])
+        self.assertIsNone(charts["INVALID"])